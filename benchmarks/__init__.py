@@ -0,0 +1,7 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+# Benchmark suite for the compiler; run it with `python -m benchmarks --help`.
+#
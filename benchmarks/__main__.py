@@ -0,0 +1,165 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+# Runs the benchmark suite and writes the results in a machine-readable form (JSON or CSV). Run it from the root
+# directory of the repository as:
+#
+#     python -m benchmarks [--benchmarks gmm hmm] [--sizes 10 100] [--format csv] [--output results.csv]
+#
+# For each benchmark program, size and language, the time of each stage of the compiler (lexing, parsing, every
+# transform pass, graph generation, code generation and instantiating the model) is recorded, together with the
+# throughput of the generated model's `gen_prior_samples` and `gen_log_pdf`.
+#
+import argparse
+import csv
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+from pyppl import compile_model, ppl_model_cache
+from pyppl.ppl_pass_manager import PassManager
+from .generators import generators, default_sizes
+
+
+_default_imports = 'import benchmarks.simple_distributions as dist'
+
+_fields = ['benchmark', 'language', 'size', 'index', 'stage', 'repeat', 'min_time', 'median_time',
+           'nodes_in', 'nodes_out', 'peak_memory', 'changed', 'calls_per_second', 'error']
+
+
+def _compile(source: str, language: str, imports: str, trace_memory: bool):
+    pass_manager = PassManager(collect_statistics=True, trace_memory=trace_memory)
+    model = compile_model(source, language=language, imports=imports, pass_manager=pass_manager)
+    return model, pass_manager.statistics
+
+
+def _measure_throughput(function, iterations: int):
+    start_time = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    wall_time = time.perf_counter() - start_time
+    return iterations / wall_time if wall_time > 0 else None
+
+
+def run_benchmark(name: str, size: int, language: str, *,
+                  imports: str=_default_imports,
+                  repeat: int=3,
+                  runtime_iterations: int=100,
+                  memory: bool=False):
+    """
+    Runs a single benchmark and returns a list of rows (dictionaries), one for each stage of the compiler, followed
+    by one row for each of the runtime methods of the model.
+    """
+    source = generators[name](size, language)
+    base = {'benchmark': name, 'language': language, 'size': size, 'repeat': repeat}
+    runs = []
+    model = None
+    for _ in range(repeat):
+        model, stats = _compile(source, language, imports, trace_memory=False)
+        runs.append(stats)
+
+    memory_stats = _compile(source, language, imports, trace_memory=True)[1] if memory else None
+
+    result = []
+    for index, stage in enumerate(runs[0]):
+        times = [run[index].wall_time for run in runs]
+        row = dict(base)
+        row.update({
+            'index': index,
+            'stage': stage.name,
+            'min_time': min(times),
+            'median_time': statistics.median(times),
+            'nodes_in': stage.nodes_in,
+            'nodes_out': stage.nodes_out,
+            'peak_memory': memory_stats[index].peak_memory if memory_stats is not None else None,
+            'changed': stage.changed,
+            'calls_per_second': None,
+        })
+        result.append(row)
+
+    if runtime_iterations > 0:
+        state = model.gen_prior_samples()
+        methods = [
+            ('gen_prior_samples', model.gen_prior_samples),
+            ('gen_log_pdf', lambda: model.gen_log_pdf(state)),
+        ]
+        for name, function in methods:
+            row = dict(base)
+            row.update({
+                'index': len(result),
+                'stage': name,
+                'calls_per_second': _measure_throughput(function, runtime_iterations),
+            })
+            result.append(row)
+
+    return result
+
+
+def _write_json(rows: list, output):
+    result = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': rows,
+    }
+    json.dump(result, output, indent=2)
+    output.write('\n')
+
+def _write_csv(rows: list, output):
+    writer = csv.DictWriter(output, fieldnames=_fields, lineterminator='\n')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow({key: row.get(key) for key in _fields})
+
+
+def main(args=None):
+    arg_parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                         description='Measures the compile time and runtime of synthetic models.')
+    arg_parser.add_argument('--benchmarks', nargs='+', choices=sorted(generators.keys()),
+                            default=sorted(generators.keys()))
+    arg_parser.add_argument('--sizes', nargs='+', type=int, default=None,
+                            help='the sizes of the programs (default: depends on the benchmark)')
+    arg_parser.add_argument('--languages', nargs='+', choices=['py', 'clj'], default=['py', 'clj'])
+    arg_parser.add_argument('--repeat', type=int, default=3,
+                            help='number of times each program is compiled')
+    arg_parser.add_argument('--runtime-iterations', type=int, default=100,
+                            help='number of calls to measure the throughput of the model (0 to skip)')
+    arg_parser.add_argument('--memory', action='store_true',
+                            help='compile once more to measure the peak memory of each stage')
+    arg_parser.add_argument('--imports', default=_default_imports,
+                            help='the import statement that provides the distributions as `dist`')
+    arg_parser.add_argument('--format', choices=['json', 'csv'], default='json')
+    arg_parser.add_argument('--output', default=None, help='output file (default: stdout)')
+    options = arg_parser.parse_args(args)
+
+    # Make sure that we measure the compiler and not the cache
+    os.environ.pop(ppl_model_cache.CACHE_DIR_VARIABLE, None)
+
+    rows = []
+    for name in options.benchmarks:
+        for size in (options.sizes if options.sizes is not None else default_sizes[name]):
+            for language in options.languages:
+                print("running {} ({}, size {})".format(name, language, size), file=sys.stderr, flush=True)
+                try:
+                    rows += run_benchmark(name, size, language, imports=options.imports,
+                                          repeat=max(options.repeat, 1),
+                                          runtime_iterations=options.runtime_iterations, memory=options.memory)
+                except Exception as e:
+                    # Record the failure (e.g., exceeding the maximal scope depth) and go on with the next benchmark
+                    rows.append({'benchmark': name, 'language': language, 'size': size, 'stage': 'error',
+                                 'error': '{}: {}'.format(type(e).__name__, e)})
+
+    writer = _write_json if options.format == 'json' else _write_csv
+    if options.output is not None:
+        with open(options.output, 'w', newline='') as output:
+            writer(rows, output)
+    else:
+        writer(rows, sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+# Parameterised generators for synthetic benchmark programs. Each generator takes the size of the program and the
+# language (`'py'` or `'clj'`) and returns the source code as a string. The programs are deterministic, i.e. the
+# same parameters always yield exactly the same program.
+#
+import random
+
+
+def _make_data(n: int, seed: int=42):
+    rnd = random.Random(seed)
+    return [round(rnd.gauss(0, 2), 3) for _ in range(n)]
+
+def _py_list(items):
+    return '[' + ', '.join([repr(item) for item in items]) + ']'
+
+def _clj_vector(items):
+    return '[' + ' '.join([repr(item) for item in items]) + ']'
+
+
+def gmm(n: int, language: str='py'):
+    """
+    A Gaussian mixture model with two components and `n` data points.
+    """
+    ys = _make_data(n)
+    if language == 'py':
+        return "ys = {}\n" \
+               "pi = [0.5, 0.5]\n" \
+               "mus = [sample(normal(0, 2)), sample(normal(0, 2))]\n" \
+               "for y in ys:\n" \
+               "    z = sample(categorical(pi))\n" \
+               "    observe(normal(mus[z], 2), y)\n" \
+               "mus\n".format(_py_list(ys))
+    else:
+        return "(let [ys {}\n" \
+               "      pi [0.5 0.5]\n" \
+               "      mus [(sample (normal 0 2)) (sample (normal 0 2))]]\n" \
+               "  (doseq [y ys]\n" \
+               "    (let [z (sample (categorical pi))]\n" \
+               "      (observe (normal (get mus z) 2) y)))\n" \
+               "  mus)\n".format(_clj_vector(ys))
+
+
+def hmm(t: int, language: str='py'):
+    """
+    A hidden Markov model with two states and `t` steps.
+    """
+    ys = _make_data(t)
+    if language == 'py':
+        return "ys = {}\n" \
+               "mus = [-1.0, 1.0]\n" \
+               "trans = [[0.9, 0.1], [0.2, 0.8]]\n" \
+               "z = sample(categorical([0.5, 0.5]))\n" \
+               "for y in ys:\n" \
+               "    z = sample(categorical(trans[z]))\n" \
+               "    observe(normal(mus[z], 1.0), y)\n" \
+               "z\n".format(_py_list(ys))
+    else:
+        return "(defn hmm-step [t z ys mus trans]\n" \
+               "  (let [z1 (sample (categorical (get trans z)))]\n" \
+               "    (observe (normal (get mus z1) 1.0) (get ys t))\n" \
+               "    z1))\n" \
+               "(let [ys {}\n" \
+               "      mus [-1.0 1.0]\n" \
+               "      trans [[0.9 0.1] [0.2 0.8]]\n" \
+               "      z0 (sample (categorical [0.5 0.5]))]\n" \
+               "  (loop {} z0 hmm-step ys mus trans))\n".format(_clj_vector(ys), t)
+
+
+def nested_if(d: int, language: str='py'):
+    """
+    A chain of `d` nested if-statements, each depending on a different random variable.
+    """
+    if language == 'py':
+        lines = ["x0 = sample(normal(0, 1))"]
+        indent = ''
+        for i in range(d):
+            lines.append("{}if x{} > {}:".format(indent, i, float(i % 3 - 1)))
+            lines.append("{}    x{} = sample(normal(x{}, 1))".format(indent, i+1, i))
+            lines.append("{}    observe(normal(x{}, 1), {})".format(indent, i+1, float(i)))
+            lines.append("{}else:".format(indent))
+            lines.append("{}    observe(normal(x{}, 2), {})".format(indent, i, float(-i)))
+            indent += '    '
+        lines.append("x0")
+        return '\n'.join(lines) + '\n'
+    else:
+        def make_if(i):
+            if i == d:
+                return "x{}".format(i)
+            return "(if (> x{i} {c})\n" \
+                   "  (let [x{j} (sample (normal x{i} 1))]\n" \
+                   "    (observe (normal x{j} 1) {o})\n" \
+                   "    {body})\n" \
+                   "  (observe (normal x{i} 2) {p}))".format(i=i, j=i+1, c=float(i % 3 - 1), o=float(i), p=float(-i),
+                                                          body=make_if(i+1))
+        return "(let [x0 (sample (normal 0 1))]\n" \
+               "  {}\n" \
+               "  x0)\n".format(make_if(0))
+
+
+def call_fan_out(f: int, language: str='py'):
+    """
+    A chain of `f` calls of two nested functions, all of which need to be inlined.
+    """
+    ys = _make_data(f)
+    if language == 'py':
+        lines = ["def noise(x):",
+                 "    return sample(normal(x, 1))",
+                 "",
+                 "def step(x, y):",
+                 "    z = noise(x)",
+                 "    observe(normal(z, 1), y)",
+                 "    return z",
+                 "",
+                 "x0 = sample(normal(0, 1))"]
+        for i in range(f):
+            lines.append("x{} = step(x{}, {})".format(i+1, i, ys[i]))
+        lines.append("x{}".format(f))
+        return '\n'.join(lines) + '\n'
+    else:
+        bindings = ["x0 (sample (normal 0 1))"]
+        for i in range(f):
+            bindings.append("x{} (step x{} {})".format(i+1, i, ys[i]))
+        return "(defn noise [x]\n" \
+               "  (sample (normal x 1)))\n" \
+               "(defn step [x y]\n" \
+               "  (let [z (noise x)]\n" \
+               "    (observe (normal z 1) y)\n" \
+               "    z))\n" \
+               "(let [{}]\n" \
+               "  x{})\n".format('\n      '.join(bindings), f)
+
+
+def large_data(n: int, language: str='py'):
+    """
+    A model with two data vectors of length `n`, which are accessed through a random index.
+    """
+    data = _make_data(n)
+    probs = [1.0 / n] * n
+    if language == 'py':
+        return "data = {}\n" \
+               "probs = {}\n" \
+               "i = sample(categorical(probs))\n" \
+               "observe(normal(data[i], 1), 0.5)\n" \
+               "i\n".format(_py_list(data), _py_list(probs))
+    else:
+        return "(let [data {}\n" \
+               "      probs {}\n" \
+               "      i (sample (categorical probs))]\n" \
+               "  (observe (normal (get data i) 1) 0.5)\n" \
+               "  i)\n".format(_clj_vector(data), _clj_vector(probs))
+
+
+generators = {
+    'gmm': gmm,
+    'hmm': hmm,
+    'nested_if': nested_if,
+    'call_fan_out': call_fan_out,
+    'large_data': large_data,
+}
+
+default_sizes = {
+    'gmm': [10, 50, 200],
+    'hmm': [10, 50, 200],
+    'nested_if': [2, 8, 32],
+    'call_fan_out': [10, 25, 50],
+    'large_data': [100, 1000, 10000],
+}
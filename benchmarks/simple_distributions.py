@@ -0,0 +1,77 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+# Minimal pure-Python implementations of the distributions used by the benchmark programs. They allow measuring the
+# runtime of the generated models without any dependency on `torch` or `numpy`. The parameter names follow the ones
+# defined in `pyppl.distributions`.
+#
+import math
+import random
+
+
+class Normal(object):
+
+    def __init__(self, loc=0.0, scale=1.0, transformed=False):
+        self.loc = loc
+        self.scale = scale
+
+    def sample(self, sample_size=None):
+        if sample_size is None:
+            return random.gauss(self.loc, self.scale)
+        return [random.gauss(self.loc, self.scale) for _ in range(sample_size)]
+
+    def log_pdf(self, value):
+        z = (value - self.loc) / self.scale
+        return -0.5 * z * z - math.log(self.scale) - 0.5 * math.log(2 * math.pi)
+
+
+class Exponential(object):
+
+    def __init__(self, rate=1.0, transformed=False):
+        self.rate = rate
+
+    def sample(self, sample_size=None):
+        if sample_size is None:
+            return random.expovariate(self.rate)
+        return [random.expovariate(self.rate) for _ in range(sample_size)]
+
+    def log_pdf(self, value):
+        if value < 0:
+            return -math.inf
+        return math.log(self.rate) - self.rate * value
+
+
+class Uniform(object):
+
+    def __init__(self, a=0.0, b=1.0, transformed=False):
+        self.a = a
+        self.b = b
+
+    def sample(self, sample_size=None):
+        if sample_size is None:
+            return random.uniform(self.a, self.b)
+        return [random.uniform(self.a, self.b) for _ in range(sample_size)]
+
+    def log_pdf(self, value):
+        if self.a <= value <= self.b:
+            return -math.log(self.b - self.a)
+        return -math.inf
+
+
+class Categorical(object):
+
+    def __init__(self, probs=None, transformed=False):
+        total = sum(probs)
+        self.probs = [p / total for p in probs]
+        self._indices = list(range(len(self.probs)))
+
+    def sample(self, sample_size=None):
+        if sample_size is None:
+            return random.choices(self._indices, weights=self.probs)[0]
+        return random.choices(self._indices, weights=self.probs, k=sample_size)
+
+    def log_pdf(self, value):
+        p = self.probs[int(value)] if 0 <= int(value) < len(self.probs) else 0.0
+        return math.log(p) if p > 0 else -math.inf
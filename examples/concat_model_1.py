@@ -0,0 +1,10 @@
+a = sample(normal(0, 1))
+b = sample(normal(0, 1))
+xs = [a, 1.0]
+ys = [b, 2.0]
+u = xs + ys
+v = ys + xs
+observe(normal(u[0], 1), 0.5)
+observe(normal(v[0], 1), 0.5)
+observe(normal(sum(u), 1), 0.5)
+observe(normal(sum(v), 1), 0.5)
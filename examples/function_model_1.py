@@ -0,0 +1,7 @@
+def f(x):
+    x = x + 1
+    return x * 2
+a = sample(normal(0, 1))
+y = f(a)
+z = f(y)
+observe(normal(z, 1), 0.5)
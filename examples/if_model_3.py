@@ -0,0 +1,5 @@
+x = sample(normal(0, 1))
+z = 1.0
+if x > 0:
+    z = 2.0
+observe(normal(0, z), 2.0)
@@ -0,0 +1,7 @@
+s = 0
+xs = []
+for i in range(10000):
+    s = s + i
+    xs.append(i * 0.5)
+mu = sample(normal(0, 1))
+observe(normal(mu + xs[3], 1), s / 10000)
@@ -7,8 +7,10 @@
 # 08. Jun 2018, Tobias Kohn
 #
 
+import concurrent.futures
+import contextlib
 from typing import Optional
-from . import distributions, parser
+from . import distributions, graphs, parser, ppl_ast, ppl_data, ppl_model_cache, ppl_pass_manager
 from .backend import ppl_graph_generator
 
 def get_supported_languages():
@@ -25,7 +27,11 @@ def compile_model(source, *,
                   language: Optional[str]=None,
                   imports=None,
                   base_class: Optional[str]=None,
-                  namespace: Optional[dict]=None):
+                  namespace: Optional[dict]=None,
+                  cache_dir: Optional[str]=None,
+                  pass_manager: Optional[ppl_pass_manager.PassManager]=None,
+                  data: Optional[dict]=None,
+                  lazy: bool=False):
     """
     COMPILE_MODEL
     =============
@@ -56,13 +62,72 @@ def compile_model(source, *,
         ```
         If a name should remain unaltered, use `{'name': 'name'}`.
 
+    Caching
+    -------
+        If a `cache_dir` is given (or the environment variable `PYPPL_CACHE_DIR` is set), the compiled model is stored
+        in this directory, keyed on a hash of the source, language, imports, base class and namespace. Compiling the
+        same program again then restores the model's code and graph from the cache, without running the compiler.
+
+    External Data
+    -------------
+        Data passed through the `data`-argument as a dictionary is not inlined into the model. The program refers to
+        the data by the names given in the dictionary (these names must not be defined in the program itself). The
+        compiled model reads the data at runtime, so that you can bind new data to the model later on:
+        ```
+        model = compile_model(..., data = {'ys': [1.2, 0.8, 1.7]})
+        model.rebind_data(ys = [1.1, 0.9, 1.4])
+        ```
+        Since loops over the data are unrolled during compilation, the new data must have the same shape as the
+        original data; `rebind_data` raises a `ValueError` otherwise.
+
+        Instead of the data itself, you can also pass the name of a NumPy `.npy`-file (or of an `.npz`-archive,
+        which contains an array with the same name as the data). The file is mapped into memory when the model is
+        created, so that large data sets are neither copied into the program nor into the model. Inside the program,
+        `load_data("ys.npy")` or `load_data("data.npz", "ys")` has the same effect (the file name then serves as
+        the name of the external data):
+        ```
+        model = compile_model(..., data = {'ys': 'observations.npy'})
+        ```
+
+    Lazy Models
+    -----------
+        If `lazy` is `True`, the compiler stops after creating the graph and returns a `LazyModel` (see module
+        `ppl_graph_generator.py`). The vertices, arcs, etc. of the graph are available right away, but the code of
+        the model-class is only generated and executed when you call a method such as `gen_prior_samples()` or
+        `gen_log_pdf(state)` for the first time.
+
+    Statistics
+    ----------
+        Pass an instance of `PassManager` (see `ppl_pass_manager.py`) to record the time, size of the AST and memory
+        used by each pass and stage of the compiler. Use `pass_manager.print_report()` to display the statistics.
+        The simplification passes are iterated until the program does not change any more; the maximal number of
+        iterations can be set through `PassManager(max_iterations=...)`.
+
     :param source:      A string containing the source code to be compiled.
     :param language:    [Optional] The language of the source code as a string like `Python`, `py` or `clj`.
     :param imports:     [Optional] A list or tuple of strings, giving the names of modules to import.
     :param base_class:  [Optional] The string of a base class upon which the model should be based.
     :param namespace:   [Optional] A dictionary with predefined names and their mapping for the output.
+    :param cache_dir:   [Optional] The directory used to cache compiled models.
+    :param pass_manager: [Optional] A `PassManager` to record statistics about the compilation.
+    :param data:        [Optional] A dictionary with external data, which can be replaced later on.
+    :param lazy:        [Optional] Defer generating the code of the model until it is needed.
     :return:            An instance of the `Model` class.
     """
+    imports, namespace = _prepare_arguments(imports, namespace)
+    data = ppl_data.prepare_data(data)
+    if pass_manager is None:
+        pass_manager = ppl_pass_manager.PassManager(collect_statistics=False)
+    artifact = _compile_artifact(source, language=language, imports=imports, base_class=base_class,
+                                 namespace=namespace, cache_dir=cache_dir, pass_manager=pass_manager,
+                                 external_data=data, lazy=lazy)
+    _bind_external_data(artifact[4], data)
+    create_model = ppl_graph_generator.LazyModel if lazy else ppl_graph_generator.create_model_instance
+    return pass_manager.run_stage('generate_model', create_model, *artifact,
+                                  nodes_in=len(artifact[2]), count_result=lambda model: len(model.vertices))
+
+
+def _prepare_arguments(imports, namespace):
     if type(imports) in (list, set, tuple):
         imports = '\n'.join(imports)
     if namespace is not None:
@@ -71,17 +136,151 @@ def compile_model(source, *,
         namespace = ns
     else:
         namespace = distributions.namespace
-    ast = parser.parse(source, language=language, namespace=namespace)
-    gg = ppl_graph_generator.GraphGenerator()
-    gg.visit(ast)
-    return gg.generate_model(base_class=base_class, imports=imports)
+    return imports, namespace
+
+
+@contextlib.contextmanager
+def _isolated_counters():
+    """
+    Resets the global counters used to generate names and bit indices for the duration of a single compilation.
+    The output of the compiler thus does not depend on what has been compiled before in the same process.
+    """
+    temp_var_counter = ppl_ast.reset_temp_var_counter()
+    cond_counter = graphs.ConditionNode.reset_bit_index_counter()
+    try:
+        yield
+    finally:
+        ppl_ast.reset_temp_var_counter(temp_var_counter)
+        graphs.ConditionNode.reset_bit_index_counter(cond_counter)
+
+
+def _bind_external_data(data_nodes: set, data: Optional[dict]):
+    """
+    Binds the values of the external data to the data nodes of a graph, which might have been restored from the
+    cache with different values.
+    """
+    if data is not None:
+        for node in data_nodes:
+            if node.is_external and node.external_name in data:
+                node.rebind(data[node.external_name])
+
+
+def _compile_artifact(source, *, language, imports, base_class, namespace, cache_dir, pass_manager=None,
+                      external_data=None, lazy: bool=False):
+    """
+    Compiles the source and returns the tuple `(code, class_name, vertices, arcs, data, conditionals)`, from which
+    the model can be instantiated through `create_model_instance` (see `ppl_graph_generator.py`). In contrast to
+    the model itself, this tuple can be pickled and thus be sent between processes.
+
+    If `lazy` is `True` (and the model is not cached), the `code` is a function that generates the code on demand.
+    """
+    if cache_dir is None:
+        cache_dir = ppl_model_cache.get_default_cache_dir()
+    if cache_dir is not None:
+        cache = ppl_model_cache.ModelCache(cache_dir)
+        key = cache.make_key(source, language=language, imports=imports, base_class=base_class, namespace=namespace,
+                             data=external_data)
+        entry = cache.load(key)
+        if entry is not None:
+            return entry
+    else:
+        cache = key = None
+    if pass_manager is None:
+        pass_manager = ppl_pass_manager.PassManager(collect_statistics=False)
+
+    if external_data is not None:
+        namespace = namespace.copy()
+        for name in external_data:
+            namespace[name] = ppl_data.make_data_symbol(name, external_data[name])
+    # Files opened through `load_data(...)` inside the program are added to the external data during parsing
+    external_data = dict(external_data) if external_data is not None else {}
+
+    class_name = 'Model'
+    with _isolated_counters():
+        ast = parser.parse(source, language=language, namespace=namespace, pass_manager=pass_manager,
+                           data=external_data)
+        ast_size = ppl_pass_manager.count_nodes(ast) if pass_manager.collect_statistics else None
+        gg = ppl_graph_generator.GraphGenerator(external_data=external_data)
+        pass_manager.run_stage('GraphGenerator', gg.visit, ast,
+                               nodes_in=ast_size, count_result=lambda _: len(gg.nodes))
+        graph = gg.get_graph()
+
+        def generate_code():
+            return gg.generate_code(imports=imports, base_class=base_class, class_name=class_name)
+
+        if lazy and cache is None:
+            return (generate_code, class_name) + graph
+        code = pass_manager.run_stage('generate_code', generate_code, nodes_in=len(gg.nodes),
+                                      count_result=lambda result: result.count('\n'))
+    result = (code, class_name) + graph
+    if cache is not None:
+        cache.store(key, *result)
+    return result
+
+
+def _compile_artifact_task(args):
+    source, kwargs = args
+    return _compile_artifact(source, **kwargs)
+
+
+def compile_models(sources, *,
+                   workers: Optional[int]=None,
+                   language: Optional[str]=None,
+                   imports=None,
+                   base_class: Optional[str]=None,
+                   namespace: Optional[dict]=None,
+                   cache_dir: Optional[str]=None,
+                   data: Optional[dict]=None,
+                   as_artifacts: bool=False):
+    """
+    Compiles a batch of programs in parallel, using a pool of `workers` processes. The arguments are the same as for
+    `compile_model` and apply to all programs in the batch. The result is a list of models in the same order as the
+    sources. Each compilation is isolated, so that the compiled models are identical to compiling the programs one
+    by one with `compile_model`.
+
+    Since models cannot be sent between processes, the workers return the generated code together with the graph
+    (see `_compile_artifact`), and the models are instantiated in the calling process. If `as_artifacts` is `True`,
+    these tuples `(code, class_name, vertices, arcs, data, conditionals)` are returned instead, so that they can be
+    stored, say, with `pickle`.
+
+    :param sources:       A list of strings containing the source code of the programs to be compiled.
+    :param workers:       [Optional] The number of worker processes; by default, the number of CPUs.
+    :param language:      [Optional] The language of the source code as a string like `Python`, `py` or `clj`.
+    :param imports:       [Optional] A list or tuple of strings, giving the names of modules to import.
+    :param base_class:    [Optional] The string of a base class upon which the model should be based.
+    :param namespace:     [Optional] A dictionary with predefined names and their mapping for the output.
+    :param cache_dir:     [Optional] The directory used to cache compiled models.
+    :param data:          [Optional] A dictionary with external data, which can be replaced later on.
+    :param as_artifacts:  [Optional] Return the generated code and graphs instead of the models.
+    :return:              A list with instances of the respective `Model` classes.
+    """
+    imports, namespace = _prepare_arguments(imports, namespace)
+    data = ppl_data.prepare_data(data)
+    kwargs = dict(language=language, imports=imports, base_class=base_class, namespace=namespace,
+                  cache_dir=cache_dir, external_data=data)
+    tasks = [(source, kwargs) for source in sources]
+    if workers == 1 or len(tasks) <= 1:
+        artifacts = [_compile_artifact_task(task) for task in tasks]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            artifacts = list(executor.map(_compile_artifact_task, tasks))
+    if as_artifacts:
+        return artifacts
+    else:
+        for artifact in artifacts:
+            _bind_external_data(artifact[4], data)
+        return [ppl_graph_generator.create_model_instance(*artifact) for artifact in artifacts]
 
 
 def compile_model_from_file(filename: str, *,
                             language: Optional[str]=None,
                             imports=None,
                             base_class: Optional[str]=None,
-                            namespace: Optional[dict]=None):
+                            namespace: Optional[dict]=None,
+                            cache_dir: Optional[str]=None,
+                            pass_manager: Optional[ppl_pass_manager.PassManager]=None,
+                            data: Optional[dict]=None,
+                            lazy: bool=False):
     """
     Takes a program as input and returns a graphical model of the program. In contrast to `compile_model`, the input
     is the name of file to be loaded rather than the program itself.
@@ -91,9 +290,14 @@ def compile_model_from_file(filename: str, *,
     :param imports:     [Optional] A list or tuple of strings, giving the names of modules to import.
     :param base_class:  [Optional] The string of a base class upon which the model should be based.
     :param namespace:   [Optional] A dictionary with predefined names and their mapping for the output.
+    :param cache_dir:   [Optional] The directory used to cache compiled models.
+    :param pass_manager: [Optional] A `PassManager` to record statistics about the compilation.
+    :param data:        [Optional] A dictionary with external data, which can be replaced later on.
+    :param lazy:        [Optional] Defer generating the code of the model until it is needed.
     :return:            An instance of the `Model` class.
     """
     with open(filename) as f:
         lines = ''.join(f.readlines())
         return compile_model(lines, language=language, imports=imports, base_class=base_class,
-                             namespace=namespace)
+                             namespace=namespace, cache_dir=cache_dir, pass_manager=pass_manager, data=data,
+                             lazy=lazy)
@@ -10,6 +10,12 @@ from ..ppl_ast import *
 from ast import copy_location as _cl
 
 class TransformVisitor(ScopedVisitor):
+    """
+    The default visit-methods of the `TransformVisitor` are generators, which yield the children to visit (see
+    `AstNode.visit`). Transforming a deep AST is therefore not limited by the recursion limit, as long as the
+    subclasses do not override the respective methods with recursive ones. An overriding method can still delegate
+    to these methods by returning, e.g., `super().visit_call(node)`.
+    """
 
     def do_visit_dict(self, items:dict):
         result = {}
@@ -18,7 +24,9 @@ class TransformVisitor(ScopedVisitor):
             if n_item is not items[key]:
                 result[key] = n_item
         if len(result) > 0:
-            return items.copy().update(result)
+            items = items.copy()
+            items.update(result)
+            return items
         else:
             return items
 
@@ -34,159 +42,193 @@ class TransformVisitor(ScopedVisitor):
         else:
             return result
 
+    def iter_visit_dict(self, items:dict):
+        """
+        Generator-version of `do_visit_dict` for use inside generator visit-methods:
+        `items = yield from self.iter_visit_dict(node.items)`.
+        """
+        n_items = yield items
+        if all([n_items[key] is items[key] for key in items]):
+            return items
+        else:
+            return n_items
+
+    def iter_visit_items(self, items:list):
+        """
+        Generator-version of `do_visit_items` for use inside generator visit-methods:
+        `items = yield from self.iter_visit_items(node.items)`.
+        """
+        n_items = yield items
+        if all([a is b for a, b in zip(n_items, items)]):
+            return items
+        else:
+            return n_items
+
 
     def visit_node(self, node: AstNode):
         return node
 
     def visit_attribute(self, node:AstAttribute):
-        base = self.visit(node.base)
+        base = yield node.base
         if base is node.base:
             return node
         else:
-            return node.clone(base=base)
+            return node.with_fields(base=base)
 
     def visit_binary(self, node:AstBinary):
-        left = self.visit(node.left)
-        right = self.visit(node.right)
+        left = yield node.left
+        right = yield node.right
         if left is node.left and right is node.right:
             return node
         else:
-            return node.clone(left=left, right=right)
+            return node.with_fields(left=left, right=right)
 
     def visit_body(self, node:AstBody):
-        items = self.do_visit_items(node.items)
+        items = yield from self.iter_visit_items(node.items)
         if items is node.items:
             return node
-        else:
-            return _cl(makeBody(items), node)
+        result = makeBody(items)
+        # Items might have been replaced by bodies, which amount to the original items once flattened
+        if isinstance(result, AstBody) and len(result.items) == len(node.items) and \
+                all([a is b for a, b in zip(result.items, node.items)]):
+            return node
+        return _cl(result, node)
 
     def visit_call(self, node: AstCall):
-        function = self.visit(node.function)
-        args = self.do_visit_items(node.args)
+        function = yield node.function
+        args = yield from self.iter_visit_items(node.args)
         if function is node.function and args is node.args:
             return node
         else:
-            return node.clone(function=function, args=args)
+            return node.with_fields(function=function, args=args)
 
     def visit_compare(self, node: AstCompare):
-        left = self.visit(node.left)
-        right = self.visit(node.right)
+        left = yield node.left
+        right = yield node.right
         if left is node.left and right is node.right:
             return node
         else:
-            return node.clone(left=left, right=right)
+            return node.with_fields(left=left, right=right)
 
     def visit_def(self, node: AstDef):
-        value = self.visit(node.value)
+        value = yield node.value
         if value is node.value:
             return node
         else:
-            return node.clone(value=value)
+            return node.with_fields(value=value)
 
     def visit_dict(self, node: AstDict):
-        items = self.do_visit_dict(node.items)
+        items = yield from self.iter_visit_dict(node.items)
         if items is node.items:
             return node
         else:
-            return node.clone(items=items)
+            return node.with_fields(items=items)
 
     def visit_for(self, node: AstFor):
-        source = self.visit(node.source)
-        body = self.visit(node.body)
+        source = yield node.source
+        body = yield node.body
         if source is node.source and body is node.body:
             return node
         else:
-            return node.clone(source=source, body=body)
+            return node.with_fields(source=source, body=body)
 
     def visit_function(self, node: AstFunction):
-        body = self.visit(node.body)
+        body = yield node.body
         if body is node.body:
             return node
         else:
-            return node.clone(body=body)
+            return node.with_fields(body=body)
 
     def visit_if(self, node: AstIf):
-        test = self.visit(node.test)
-        if_node = self.visit(node.if_node)
-        else_node = self.visit(node.else_node)
+        test = yield node.test
+        if_node = yield node.if_node
+        else_node = yield node.else_node
         if test is node.test and if_node is node.if_node and else_node is node.else_node:
             return node
         else:
-            return node.clone(test=test, if_node=if_node, else_node=else_node)
+            return node.with_fields(test=test, if_node=if_node, else_node=else_node)
 
     def visit_let(self, node: AstLet):
-        source = self.visit(node.source)
-        body = self.visit(node.body)
+        source = yield node.source
+        body = yield node.body
         if source is node.source and body is node.body:
             return node
         else:
-            return node.clone(source=source, body=body)
+            return node.with_fields(source=source, body=body)
 
     def visit_list_for(self, node: AstListFor):
-        source = self.visit(node.source)
-        expr = self.visit(node.expr)
+        source = yield node.source
+        expr = yield node.expr
         if source is node.source and expr is node.expr:
             return node
         else:
-            return node.clone(source=source, expr=expr)
+            return node.with_fields(source=source, expr=expr)
+
+    def visit_multi_slice(self, node: AstMultiSlice):
+        base = yield node.base
+        indices = yield from self.iter_visit_items(node.indices)
+        if base is node.base and indices is node.indices:
+            return node
+        else:
+            return node.with_fields(base=base, indices=indices)
 
     def visit_observe(self, node: AstObserve):
-        dist = self.visit(node.dist)
-        value = self.visit(node.value)
+        dist = yield node.dist
+        value = yield node.value
         if dist is node.dist and value is node.value:
             return node
         else:
-            return node.clone(dist=dist, value=value)
+            return node.with_fields(dist=dist, value=value)
 
     def visit_return(self, node: AstReturn):
-        value = self.visit(node.value)
+        value = yield node.value
         if value is node.value:
             return node
         else:
-            return node.clone(value=value)
+            return node.with_fields(value=value)
 
     def visit_sample(self, node: AstSample):
-        dist = self.visit(node.dist)
+        dist = yield node.dist
         if dist is node.dist:
             return node
         else:
-            return node.clone(dist=dist)
+            return node.with_fields(dist=dist)
 
     def visit_slice(self, node: AstSlice):
-        base = self.visit(node.base)
-        start = self.visit(node.start)
-        stop = self.visit(node.stop)
+        base = yield node.base
+        start = yield node.start
+        stop = yield node.stop
         if base is node.base and start is node.start and stop is node.stop:
             return node
         else:
-            return node.clone(base=base, start=start, stop=stop)
+            return node.with_fields(base=base, start=start, stop=stop)
 
     def visit_subscript(self, node: AstSubscript):
-        base = self.visit(node.base)
-        index = self.visit(node.index)
+        base = yield node.base
+        index = yield node.index
         if base is node.base and index is node.index:
             return node
         else:
-            return node.clone(base=base, index=index)
+            return node.with_fields(base=base, index=index)
 
     def visit_unary(self, node: AstUnary):
-        item = self.visit(node.item)
+        item = yield node.item
         if item is node.item:
             return node
         else:
-            return node.clone(item=item)
+            return node.with_fields(item=item)
 
     def visit_vector(self, node: AstVector):
-        items = self.do_visit_items(node.items)
+        items = yield from self.iter_visit_items(node.items)
         if items is node.items:
             return node
         else:
-            return node.clone(items=items)
+            return node.with_fields(items=items)
 
     def visit_while(self, node: AstWhile):
-        test = self.visit(node.test)
-        body = self.visit(node.body)
+        test = yield node.test
+        body = yield node.body
         if test is node.test and body is node.body:
             return node
         else:
-            return node.clone(test=test, body=body)
+            return node.with_fields(test=test, body=body)
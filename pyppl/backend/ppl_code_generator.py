@@ -116,6 +116,11 @@ class CodeGenerator(ScopedVisitor):
     def visit_binary(self, node:AstBinary):
         left = self.visit(node.left)
         right = self.visit(node.right)
+        # An inline `if` binds less tightly than any binary operator
+        if isinstance(node.left, AstIf):
+            left = "({})".format(left)
+        if isinstance(node.right, AstIf):
+            right = "({})".format(right)
         return "({} {} {})".format(left, node.op, right)
 
     def visit_body(self, node:AstBody):
@@ -251,7 +256,11 @@ class CodeGenerator(ScopedVisitor):
 
     def visit_observe(self, node: AstObserve):
         dist = self.visit(node.dist)
-        return "observe({}, {})".format(dist, self.visit(node.value))
+        size = self.visit(node.size)
+        if size is not None:
+            return "observe({}, {}, sample_size={})".format(dist, self.visit(node.value), size)
+        else:
+            return "observe({}, {})".format(dist, self.visit(node.value))
 
     def visit_return(self, node: AstReturn):
         if node.value is None:
@@ -313,7 +322,7 @@ class CodeGenerator(ScopedVisitor):
         return repr(node.value)
 
     def visit_value_vector(self, node: AstValueVector):
-        return repr(node.items)
+        return repr(node.value)
 
     def visit_vector(self, node: AstVector):
         return "[{}]".format(', '.join([self.visit(item) for item in node.items]))
@@ -65,8 +65,10 @@ class GraphCodeGenerator(object):
         self.imports = imports
         self.bit_vector_name = None
         self.logpdf_suffix = None
+        self.array_function = None
 
     def _complete_imports(self, imports: str):
+        result = ''
         if imports != '':
             has_dist = False
             uses_numpy = False
@@ -87,14 +89,18 @@ class GraphCodeGenerator(object):
                 uses_torch = uses_torch or m == 'torch'
             if uses_torch or uses_numpy:
                 self.logpdf_suffix = ''
+                # The module is imported under its own name, as the code of plates refers to it (see
+                # `_gen_log_pdf_term`)
+                self.array_function = 'torch.as_tensor' if uses_torch else 'numpy.asarray'
+                result += 'import torch\n' if uses_torch else 'import numpy\n'
             if not has_dist:
                 if uses_torch:
                     try:
                         __import__("pyfo.distributions")
-                        return 'import pyfo.distributions as dist\n'
+                        return result + 'import pyfo.distributions as dist\n'
                     except ModuleNotFoundError:
-                        return 'import torch.distributions as dist\n'
-        return ''
+                        return result + 'import torch.distributions as dist\n'
+        return result
 
 
     def generate_model_code(self, *,
@@ -174,7 +180,9 @@ class GraphCodeGenerator(object):
                "\tself.vertices = vertices\n" \
                "\tself.arcs = arcs\n" \
                "\tself.data = data\n" \
-               "\tself.conditionals = conditionals\n"
+               "\tself.conditionals = conditionals\n" \
+               "\tself.external_data = {d.external_name: d for d in data if d.is_external}\n" \
+               "\tself.data_values = {d.name: d.value.tolist() for d in data if d.is_packed}\n"
 
     def _generate_repr_method(self):
         s = "def __repr__(self):\n" \
@@ -249,17 +257,45 @@ class GraphCodeGenerator(object):
                 buffer.append(code)
                 buffer.append("{} |= {} if _c else 0".format(bit_vector, node.bit_index))
 
-            elif want_data_node or not isinstance(node, DataNode):
+            elif isinstance(node, DataNode) and node.is_external:
+                if want_data_node:
+                    buffer.append("{} = self.external_data[{!r}].value".format(name, node.external_name))
+
+            elif isinstance(node, DataNode) and node.is_packed:
+                if want_data_node:
+                    buffer.append("{} = self.data_values[{!r}]".format(name, node.name))
+
+            elif isinstance(node, DataNode) and node.loop:
+                if want_data_node or node.shared:
+                    buffer.append(node.get_code())
+
+            elif want_data_node or not isinstance(node, DataNode) or node.shared:
                 code = "{} = {}".format(name, node.get_code())
                 buffer.append(code)
 
+    def _gen_log_pdf_term(self, name: str, node: Vertex):
+        """
+        Returns the code that adds the log-pdf of the vertex to `log_pdf`.
+
+        The observation of a plate is a sequence of independent values (which might be a plain list, e.g., for packed
+        data). If torch or numpy is imported, the values are handed on to the distribution as one tensor or array,
+        respectively, and the log-pdf is computed in a single vectorised call. Only without either module, the log-pdf
+        is computed for each value separately and summed up in Python.
+        """
+        if node.has_observation and node.sample_size is not None and node.sample_size > 1:
+            if self.array_function is not None:
+                return "log_pdf = log_pdf + dst_.log_pdf({}({})).sum()".format(self.array_function, name)
+            else:
+                return "log_pdf = log_pdf + sum([dst_.log_pdf(x_) for x_ in {}])".format(name)
+        return "log_pdf = log_pdf + dst_.log_pdf({})".format(name)
+
     def gen_log_pdf(self):
         def code_for_vertex(name: str, node: Vertex):
             cond_code = node.get_cond_code(state_object=self.state_object)
             if cond_code is not None:
-                result = cond_code + "log_pdf = log_pdf + dst_.log_pdf({})".format(name)
+                result = cond_code + self._gen_log_pdf_term(name, node)
             else:
-                result = "log_pdf = log_pdf + dst_.log_pdf({})".format(name)
+                result = self._gen_log_pdf_term(name, node)
             if self.logpdf_suffix is not None:
                 result = result + self.logpdf_suffix
             return result
@@ -273,9 +309,9 @@ class GraphCodeGenerator(object):
         def code_for_vertex(name: str, node: Vertex):
             cond_code = node.get_cond_code(state_object=self.state_object)
             if cond_code is not None:
-                result = cond_code + "log_pdf = log_pdf + dst_.log_pdf({})".format(name)
+                result = cond_code + self._gen_log_pdf_term(name, node)
             else:
-                result = "log_pdf = log_pdf + dst_.log_pdf({})".format(name)
+                result = self._gen_log_pdf_term(name, node)
             if self.logpdf_suffix is not None:
                 result += self.logpdf_suffix
             return result
@@ -305,6 +341,15 @@ class GraphCodeGenerator(object):
             sample_code.append("return " + state)
         return '\n'.join(sample_code)
 
+    def rebind_data(self):
+        code = "for name in data:\n" \
+               "\tif name not in self.external_data:\n" \
+               "\t\traise KeyError(\"'{}' is not external data of the model\".format(name))\n" \
+               "\tself.external_data[name].check_value(data[name])\n" \
+               "for name in data:\n" \
+               "\tself.external_data[name].rebind(data[name])"
+        return '**data', code
+
     def gen_cond_bit_vector(self):
         code = "result = 0\n" \
                "for cond in self.conditionals:\n" \
@@ -38,6 +38,7 @@ class GraphFactory(object):
         self.code_generator = code_generator
         self.cond_nodes_map = {}
         self.data_nodes_cache = {}
+        self.external_data_nodes = {}
 
     def _generate_code_for_node(self, node: AstNode):
         return self.code_generator.visit(node)
@@ -51,10 +52,12 @@ class GraphFactory(object):
         return None
 
     def create_condition_node(self, test: AstNode, parents: set):
+        # Conditions and data are deduplicated by the structure of their AST (see `AstNode.__hash__`), so that
+        # no code needs to be generated for duplicates
         name = self.generate_symbol('cond_')
+        if test in self.cond_nodes_map:
+            return self.cond_nodes_map[test]
         code = self._generate_code_for_node(test)
-        if code in self.cond_nodes_map:
-            return self.cond_nodes_map[code]
         if isinstance(test, AstCompare) and is_zero(test.right) and test.second_right is None:
             result = ConditionNode(name, ancestors=parents, condition=code,
                                    function=self._generate_code_for_node(test.left), op=test.op)
@@ -65,22 +68,60 @@ class GraphFactory(object):
         else:
             result = ConditionNode(name, ancestors=parents, condition=code)
         self.nodes.append(result)
-        self.cond_nodes_map[code] = result
+        self.cond_nodes_map[test] = result
         return result
 
     def create_data_node(self, data: AstNode, parents: Optional[set]=None):
         if parents is None:
             parents = set()
-        code = self._generate_code_for_node(data)
-        if code in self.data_nodes_cache:
-            return self.data_nodes_cache[code]
+        if data in self.data_nodes_cache:
+            return self.data_nodes_cache[data]
         name = self.generate_symbol('data_')
-        result = DataNode(name, ancestors=parents, data=code)
+        if isinstance(data, AstValueVector) and data.is_packed:
+            # Hand the packed values on as they are, without creating the code for a (possibly very long) list
+            result = DataNode(name, ancestors=parents, data=None, value=data.items)
+        else:
+            code = self._generate_code_for_node(data)
+            result = DataNode(name, ancestors=parents, data=code)
+        self.nodes.append(result)
+        self.data_nodes_cache[data] = result
+        return result
+
+    def create_shared_node(self, value: AstNode, parents: set):
+        name = self.generate_symbol('data_')
+        code = self._generate_code_for_node(value)
+        result = DataNode(name, ancestors=parents, data=code, shared=True)
+        self.nodes.append(result)
+        return result
+
+    def create_variable_node(self, value: AstNode):
+        # The variables of a loop are changed by the loop, and can therefore not be deduplicated
+        name = self.generate_symbol('data_')
+        code = self._generate_code_for_node(value)
+        result = DataNode(name, data=code)
+        self.nodes.append(result)
+        return result
+
+    def create_loop_node(self, loop: AstFor, variables: list, parents: set, shared: bool):
+        name = self.generate_symbol('data_')
+        code = self._generate_code_for_node(loop)
+        result = DataNode(name, ancestors=parents, data=code, shared=shared, loop=True)
+        for node in variables:
+            node.ancestors = set(parents)
+            node.shared = shared
+        self.nodes.append(result)
+        return result
+
+    def create_external_data_node(self, external_name: str, value):
+        if external_name in self.external_data_nodes:
+            return self.external_data_nodes[external_name]
+        name = self.generate_symbol('data_')
+        result = DataNode(name, data=None, external_name=external_name, value=value)
         self.nodes.append(result)
-        self.data_nodes_cache[code] = result
+        self.external_data_nodes[external_name] = result
         return result
 
-    def create_observe_node(self, dist: AstNode, value: AstNode, parents: set, conditions: set):
+    def create_observe_node(self, dist: AstNode, value: AstNode, parents: set, conditions: set, size: int=1):
         arg_names = None
         if isinstance(dist, AstCall):
             func = dist.function_name
@@ -106,7 +147,8 @@ class GraphFactory(object):
                         distribution_transform=trans, distribution_arg_names=arg_names,
                         observation=v_code,
                         observation_value=obs_value, conditions=conditions,
-                        condition_nodes=cc.cond_nodes if len(cc.cond_nodes) > 0 else None)
+                        condition_nodes=cc.cond_nodes if len(cc.cond_nodes) > 0 else None,
+                        sample_size=size)
         self.nodes.append(result)
         return result
 
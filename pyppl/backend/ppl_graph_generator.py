@@ -8,7 +8,22 @@
 #
 from ..ppl_ast import *
 from ..graphs import *
+from ..ppl_ast_annotators import get_loop_vars
 from .ppl_graph_factory import GraphFactory
+from ..transforms.ppl_common_subexpressions import is_shared_def
+from ..transforms.ppl_constant_folding import ConstantDataChecker
+
+
+def _depends_on_shared_data(node) -> bool:
+    """
+    Checks whether the AST (or list of ASTs) reads any external or shared data nodes, whose values might change
+    after `gen_prior_samples` has been run (see `DataNode`).
+    """
+    for item in walk(node):
+        if isinstance(item, AstSymbol) and isinstance(item.node, DataNode) and \
+                (item.node.is_external or item.node.shared):
+            return True
+    return False
 
 
 class ConditionScope(object):
@@ -39,14 +54,18 @@ class ConditionScopeContext(object):
 
 class GraphGenerator(ScopedVisitor):
 
-    def __init__(self, factory: Optional[GraphFactory]=None):
+    def __init__(self, factory: Optional[GraphFactory]=None, external_data: Optional[dict]=None):
         super().__init__()
         if factory is None:
             factory = GraphFactory()
         self.factory = factory
+        self.external_data = external_data if external_data is not None else {}
         self.nodes = []
         self.conditions = None  # type: ConditionScope
         self.imports = set()
+        self.constant_data = ConstantDataChecker(self._is_constant_symbol)
+        self._in_constant_data = False
+        self._loop_variables = None
 
     def enter_condition(self, condition):
         self.conditions = ConditionScope(self.conditions, condition)
@@ -73,7 +92,7 @@ class GraphGenerator(ScopedVisitor):
         result = {}
         parents = set()
         for key in items.keys():
-            item, parent = self.visit(items[key])
+            item, parent = yield items[key]
             result[key] = item
             parents = set.union(parents, parent)
         return result, parents
@@ -81,7 +100,7 @@ class GraphGenerator(ScopedVisitor):
     def _visit_items(self, items):
         result = []
         parents = set()
-        for _item in (self.visit(item) for item in items):
+        for _item in (yield items):
             if _item is not None:
                 item, parent = _item
                 result.append(item)
@@ -90,28 +109,74 @@ class GraphGenerator(ScopedVisitor):
                 result.append(None)
         return result, parents
 
+    def _is_constant_symbol(self, node: AstSymbol):
+        item = self.resolve(node.name)
+        if item is not None:
+            value, parents = item
+            if len(parents) > 0:
+                return None
+            elif isinstance(value, AstSymbol) and isinstance(value.node, DataNode):
+                if self._loop_variables is not None and node.name in self._loop_variables:
+                    # The variable is changed by the loop currently visited
+                    return None
+                return True if not (value.node.is_external or value.node.shared) else None
+            elif isinstance(value, (AstValue, AstValueVector)):
+                return False
+            return None
+        elif node.node is None and node.predef and node.name not in self.external_data:
+            # E.g., `torch.float`
+            return False
+        return None
+
+    def _visit_constant_data(self, node: AstNode):
+        """
+        If the expression computes constant data (see `ConstantDataChecker`), it is turned into a data node, which the
+        model computes only once, instead of anew in every evaluation of the log-pdf. Returns `None` otherwise.
+        """
+        if self._in_constant_data or self.constant_data.check(node) is not True:
+            return None
+        self._in_constant_data = True
+        try:
+            value, _ = yield node
+        finally:
+            self._in_constant_data = False
+        data_node = self.factory.create_data_node(value)
+        if data_node is not None:
+            self.nodes.append(data_node)
+            return AstSymbol(data_node.name, node=data_node), set()
+        return value, set()
+
     def visit_node(self, node: AstNode):
         raise RuntimeError("cannot compile '{}'".format(node))
 
     def visit_attribute(self, node:AstAttribute):
-        base, parents = self.visit(node.base)
+        base, parents = yield node.base
         if base is node.base:
             return node, parents
         else:
             return AstAttribute(base, node.attr), parents
 
     def visit_binary(self, node:AstBinary):
-        left, l_parents = self.visit(node.left)
-        right, r_parents = self.visit(node.right)
+        result = yield from self._visit_constant_data(node)
+        if result is not None:
+            return result
+        left, l_parents = yield node.left
+        right, r_parents = yield node.right
         return AstBinary(left, node.op, right), set.union(l_parents, r_parents)
 
     def visit_body(self, node:AstBody):
-        items, parents = self._visit_items(node.items)
+        items, parents = yield from self._visit_items(node.items)
+        if self._loop_variables is not None:
+            # Definitions, which have been substituted, leave a `None` in the body of the loop
+            items = [item for item in items if not (isinstance(item, AstValue) and item.value is None)]
         return makeBody(items), parents
 
     def visit_call(self, node: AstCall):
-        function, f_parents = self.visit(node.function)
-        args, a_parents = self._visit_items(node.args)
+        result = yield from self._visit_constant_data(node)
+        if result is not None:
+            return result
+        function, f_parents = yield node.function
+        args, a_parents = yield from self._visit_items(node.args)
         parents = set.union(f_parents, a_parents)
         return AstCall(function, args, node.keywords), parents
 
@@ -127,8 +192,8 @@ class GraphGenerator(ScopedVisitor):
                     return AstSymbol(node.name, node=node), set()
 
         elif name.startswith('torch.') and name[6:] in ('eq', 'ge', 'gt', 'le', 'lt', 'ne') and node.arg_count == 2:
-            left, l_parents = self.visit(node.left)
-            right, r_parents = self.visit(node.right)
+            left, l_parents = yield node.left
+            right, r_parents = yield node.right
             parents = set.union(l_parents, r_parents)
             cond_node = self.factory.create_condition_node(node.clone(args=[left, right]), parents)
             if cond_node is not None:
@@ -136,13 +201,13 @@ class GraphGenerator(ScopedVisitor):
                 name = cond_node.name
                 return AstSymbol(name, node=cond_node), parents
 
-        return self.visit_call(node)
+        return (yield from self.visit_call(node))
 
     def visit_compare(self, node: AstCompare):
-        left, l_parents = self.visit(node.left)
-        right, r_parents = self.visit(node.right)
+        left, l_parents = yield node.left
+        right, r_parents = yield node.right
         if node.second_right is not None:
-            second_right, sc_parents = self.visit(node.second_right)
+            second_right, sc_parents = yield node.second_right
             parents = set.union(l_parents, r_parents)
             parents = set.union(parents, sc_parents)
             return AstCompare(left, node.op, right, node.second_op, second_right), parents
@@ -150,21 +215,76 @@ class GraphGenerator(ScopedVisitor):
             return AstCompare(left, node.op, right), set.union(l_parents, r_parents)
 
     def visit_def(self, node: AstDef):
-        self.define(node.name, self.visit(node.value))
+        if self._loop_variables is not None and node.name in self._loop_variables:
+            variable = self._loop_variables[node.name]
+            value, parents = yield node.value
+            return AstDef(variable.name, value), parents
+        elif is_shared_def(node):
+            # A common subexpression is computed once by a node of its own instead of being substituted
+            value, parents = yield node.value
+            if isinstance(value, AstSymbol) and isinstance(value.node, DataNode) and len(parents) == 0:
+                # Constant data is already computed once by a data node of its own
+                self.define(node.name, (value, parents))
+                return AstValue(None), set()
+            shared_node = self.factory.create_shared_node(value, parents)
+            self.nodes.append(shared_node)
+            self.define(node.name, (AstSymbol(shared_node.name, node=shared_node), parents))
+        else:
+            self.define(node.name, (yield node.value))
         return AstValue(None), set()
 
     def visit_dict(self, node: AstDict):
-        items, parents = self._visit_dict(node.items)
+        items, parents = yield from self._visit_dict(node.items)
         return AstDict(items), parents
 
+    def _define_loop_target(self, target):
+        # The target of a loop, which has not been unrolled, is a local variable in the generated code
+        for name in (target if type(target) is tuple else (target,)):
+            if name != '_':
+                self.define(name, (AstSymbol(name, predef=True), set()))
+
     def visit_for(self, node: AstFor):
-        source, s_parents = self.visit(node.source)
-        body, b_parents = self.visit(node.body)
-        parents = set.union(s_parents, b_parents)
-        return AstFor(node.target, source, body), parents
+        source, s_parents = yield node.source
+        names = get_loop_vars(node) if self._loop_variables is None else set()
+        if len(names) == 0:
+            with self.create_scope():
+                self._define_loop_target(node.target)
+                body, b_parents = yield node.body
+            parents = set.union(s_parents, b_parents)
+            return AstFor(node.target, source, body), parents
+
+        # The variables changed by the loop (see `get_loop_vars`) are data nodes, which the loop assigns. The loop is
+        # thus computed only once by `gen_prior_samples`, unless it depends on any vertices or external data
+        variables = {}
+        values = []
+        parents = set(s_parents)
+        for name in sorted(names):
+            item = self.resolve(name)
+            value, v_parents = item if item is not None else (AstValue(None), set())
+            variables[name] = self.factory.create_variable_node(value)
+            values.append(value)
+            parents.update(v_parents)
+        self._loop_variables = variables
+        try:
+            with self.create_scope():
+                self._define_loop_target(node.target)
+                for name, variable in variables.items():
+                    self.define(name, (AstSymbol(variable.name, node=variable), set()))
+                body, b_parents = yield node.body
+        finally:
+            self._loop_variables = None
+        parents.update(b_parents)
+        loop = AstFor(node.target, source, body)
+        shared = len(parents) > 0 or _depends_on_shared_data([loop] + values)
+        loop_node = self.factory.create_loop_node(loop, list(variables.values()), parents, shared)
+        self.nodes += list(variables.values())
+        self.nodes.append(loop_node)
+        for name, variable in variables.items():
+            self.define(name, (AstSymbol(variable.name, node=variable), parents))
+        return AstValue(None), set()
 
     def visit_if(self, node: AstIf):
-        test, parents = self.visit(node.test)
+        test, parents = yield node.test
         cond_node = self.factory.create_condition_node(test, parents)
         if cond_node is not None:
             self.nodes.append(cond_node)
@@ -172,10 +292,10 @@ class GraphGenerator(ScopedVisitor):
             test = AstSymbol(name, node=cond_node)
 
         with self.create_condition(cond_node):
-            a_node, a_parents = self.visit(node.if_node)
+            a_node, a_parents = yield node.if_node
             parents = set.union(parents, a_parents)
             self.switch_condition()
-            b_node, b_parents = self.visit(node.else_node)
+            b_node, b_parents = yield node.else_node
             parents = set.union(parents, b_parents)
 
         return AstIf(test, a_node, b_node), parents
@@ -185,37 +305,56 @@ class GraphGenerator(ScopedVisitor):
         return AstValue(None), set()
 
     def visit_let(self, node: AstLet):
-        self.define(node.target, self.visit(node.source))
-        return self.visit(node.body)
+        self.define(node.target, (yield node.source))
+        return (yield node.body)
 
     def visit_list_for(self, node: AstListFor):
-        source, s_parents = self.visit(node.source)
-        expr, e_parents = self.visit(node.expr)
-        parents = set.union(s_parents, e_parents)
-        if node.test is not None:
-            test, t_parents = self.visit(node.test)
-            parents = set.union(parents, t_parents)
-        else:
-            test = None
-        return AstListFor(node.target, source, expr, test), parents
+        source, s_parents = yield node.source
+        with self.create_scope():
+            self._define_loop_target(node.target)
+            expr, e_parents = yield node.expr
+            parents = set.union(s_parents, e_parents)
+            if node.test is not None:
+                test, t_parents = yield node.test
+                parents = set.union(parents, t_parents)
+            else:
+                test = None
+        result = AstListFor(node.target, source, expr, test)
+        if len(parents) == 0:
+            # A deterministic list comprehension is computed only once, as a data node
+            data_node = self.factory.create_data_node(result)
+            if data_node is not None:
+                self.nodes.append(data_node)
+                return AstSymbol(data_node.name, node=data_node), set()
+        return result, parents
 
     def visit_multi_slice(self, node: AstMultiSlice):
-        items, parents = self._visit_items(node.indices)
-        result = node.clone(indices=items)
-        return result, parents
+        base, b_parents = yield node.base
+        items, parents = yield from self._visit_items(node.indices)
+        result = node.clone(base=base, indices=items)
+        return result, set.union(b_parents, parents)
 
     def visit_observe(self, node: AstObserve):
-        dist, d_parents = self.visit(node.dist)
-        value, v_parents = self.visit(node.value)
+        dist, d_parents = yield node.dist
+        value, v_parents = yield node.value
         parents = set.union(d_parents, v_parents)
-        node = self.factory.create_observe_node(dist, value, parents, self.get_current_conditions())
+        if node.size is not None:
+            size, s_parents = yield node.size
+            parents = set.union(parents, s_parents)
+            if isinstance(size, AstValue):
+                size = size.value
+            else:
+                raise RuntimeError("observe size must be a constant integer value instead of '{}'".format(size))
+        else:
+            size = 1
+        node = self.factory.create_observe_node(dist, value, parents, self.get_current_conditions(), size)
         self.nodes.append(node)
         return AstSymbol(node.name, node=node), set()
 
     def visit_sample(self, node: AstSample):
-        dist, d_parents = self.visit(node.dist)
+        dist, d_parents = yield node.dist
         if node.size is not None:
-            size, s_parents = self.visit(node.size)
+            size, s_parents = yield node.size
             parents = set.union(d_parents, s_parents)
             if isinstance(size, AstValue):
                 size = size.value
@@ -229,24 +368,24 @@ class GraphGenerator(ScopedVisitor):
         return AstSymbol(node.name, node=node), { node }
 
     def visit_slice(self, node: AstSlice):
-        base, parents = self.visit(node.base)
+        base, parents = yield node.base
         if node.start is not None:
-            start, a_parents = self.visit(node.start)
+            start, a_parents = yield node.start
             parents = set.union(parents, a_parents)
         else:
             start = None
         if node.stop is not None:
-            stop, a_parents = self.visit(node.stop)
+            stop, a_parents = yield node.stop
             parents = set.union(parents, a_parents)
         else:
             stop = None
         return AstSlice(base, start, stop), parents
 
     def visit_subscript(self, node: AstSubscript):
-        base, b_parents = self.visit(node.base)
-        index, i_parents = self.visit(node.index)
+        base, b_parents = yield node.base
+        index, i_parents = yield node.index
         if is_vector(base) and is_integer(index):
-            return self.visit(base[index.value])
+            return (yield base[index.value])
         return makeSubscript(base, index), set.union(b_parents, i_parents)
 
     def visit_symbol(self, node: AstSymbol):
@@ -255,6 +394,12 @@ class GraphGenerator(ScopedVisitor):
             return item
         elif node.node is not None:
             return node, { node.node }
+        elif node.predef and node.name in self.external_data:
+            is_new = node.name not in self.factory.external_data_nodes
+            data_node = self.factory.create_external_data_node(node.name, self.external_data[node.name])
+            if is_new:
+                self.nodes.append(data_node)
+            return AstSymbol(data_node.name, node=data_node), set()
         elif node.predef:
             return node, set()
         else:
@@ -262,7 +407,10 @@ class GraphGenerator(ScopedVisitor):
             raise RuntimeError("symbol not found: '{}'{}".format(node.original_name, line))
 
     def visit_unary(self, node: AstUnary):
-        item, parents = self.visit(node.item)
+        result = yield from self._visit_constant_data(node)
+        if result is not None:
+            return result
+        item, parents = yield node.item
         return AstUnary(node.op, item), parents
 
     def visit_value(self, node: AstValue):
@@ -277,7 +425,7 @@ class GraphGenerator(ScopedVisitor):
         return node, set()
 
     def visit_vector(self, node: AstVector):
-        items, parents = self._visit_items(node.items)
+        items, parents = yield from self._visit_items(node.items)
         result = makeVector(items)
         return result, parents
 
@@ -295,7 +443,10 @@ class GraphGenerator(ScopedVisitor):
         return self.factory.generate_code(class_name=class_name, imports=_imports,
                                           base_class=base_class)
 
-    def generate_model(self, imports: Optional[str]=None, base_class: Optional[str]=None, class_name: str='Model'):
+    def get_graph(self):
+        """
+        Returns the graph as a tuple of four sets: `(vertices, arcs, data, conditionals)`.
+        """
         vertices = set()
         arcs = set()
         data = set()
@@ -309,11 +460,88 @@ class GraphGenerator(ScopedVisitor):
                 data.add(node)
             elif isinstance(node, ConditionNode):
                 conditionals.add(node)
-
+        return vertices, arcs, data, conditionals
+
+    def generate_model(self, imports: Optional[str]=None, base_class: Optional[str]=None, class_name: str='Model',
+                       lazy: bool=False):
+        vertices, arcs, data, conditionals = self.get_graph()
+        if lazy:
+            def generate_code():
+                return self.generate_code(imports=imports, base_class=base_class, class_name=class_name)
+            return LazyModel(generate_code, class_name, vertices, arcs, data, conditionals)
         code = self.generate_code(imports=imports, base_class=base_class, class_name=class_name)
-        c_globals = {}
-        exec(code, c_globals)
-        Model = c_globals[class_name]
-        result = Model(vertices, arcs, data, conditionals)
-        result.code = code
-        return result
+        return create_model_instance(code, class_name, vertices, arcs, data, conditionals)
+
+
+def create_model_instance(code: str, class_name: str, vertices: set, arcs: set, data: set, conditionals: set):
+    """
+    Executes the code of a model-class and returns an instance of the model-class for the given graph.
+    """
+    c_globals = {}
+    exec(code, c_globals)
+    Model = c_globals[class_name]
+    result = Model(vertices, arcs, data, conditionals)
+    result.code = code
+    return result
+
+
+class LazyModel(object):
+    """
+    A lazy model provides the graph of a compiled model right away, but defers generating and executing the code of
+    the model-class until it is actually needed. The methods `get_vertices`, `get_arcs`, etc. only inspect the graph
+    and do not trigger the code generation. Any other method, such as `gen_prior_samples` or `gen_log_pdf`, creates
+    the actual model on its first call and is then forwarded to the model.
+
+    The `code` can either be given as a string, or as a function that generates the code.
+    """
+
+    def __init__(self, code, class_name: str, vertices: set, arcs: set, data: set, conditionals: set):
+        self.vertices = vertices
+        self.arcs = arcs
+        self.data = data
+        self.conditionals = conditionals
+        self._code = code
+        self._class_name = class_name
+        self._model = None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.materialize(), name)
+
+    def __repr__(self):
+        return repr(self.materialize())
+
+    def materialize(self):
+        """
+        Generates and executes the code of the model-class (if that has not happened, yet), and returns the model.
+        """
+        if self._model is None:
+            code = self._code() if callable(self._code) else self._code
+            self._model = create_model_instance(code, self._class_name, self.vertices, self.arcs, self.data,
+                                                self.conditionals)
+            self._code = None
+        return self._model
+
+    @property
+    def is_materialized(self):
+        return self._model is not None
+
+    @property
+    def code(self):
+        return self.materialize().code
+
+    def get_vertices(self):
+        return self.vertices
+
+    def get_vertices_names(self):
+        return [v.name for v in self.vertices]
+
+    def get_arcs(self):
+        return self.arcs
+
+    def get_arcs_names(self):
+        return [(u.name, v.name) for (u, v) in self.arcs]
+
+    def get_conditions(self):
+        return self.conditionals
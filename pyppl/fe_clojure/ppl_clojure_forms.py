@@ -10,6 +10,51 @@ from typing import Optional
 import inspect
 from ast import copy_location
 
+
+# Maps `(visitor class, form class)` to the name of the method called by `ClojureObject.visit`, and
+# `(visitor class, name of the form)` to the method and its arity used by `Form.visit` (see `_resolve_form_method`)
+_dispatch_cache = {}
+
+def clear_dispatch_cache():
+    """
+    Clears the cache of visit-methods used by `ClojureObject.visit` and `Form.visit`. This is only necessary if
+    methods are added to or removed from a visitor class after it has been used.
+    """
+    _dispatch_cache.clear()
+
+
+_special_names = {
+    '->':  'arrow',
+    '->>': 'double_arrow',
+    '.':   'dot'
+}
+
+def _get_method_name(name: str):
+    """
+    Returns the name of the visit-method for a form such as `(get-x? ...)`, i.e. `visit_is_get_x`.
+    """
+    if name in _special_names:
+        name = '_sym_' + _special_names[name]
+    if name.endswith('?'):
+        name = 'is_' + name[:-1]
+    name = name.replace('-', '_').replace('.', '_').replace('/', '_')
+    name = ''.join([n if n.islower() else "_" + n.lower() for n in name])
+    return 'visit_' + name
+
+
+def _resolve_form_method(visitor, name: str):
+    """
+    Returns a tuple `(method name, parameter count, has varargs)` for the visit-method of the form with the given
+    name, or `None` if the visitor has no such method.
+    """
+    method_name = _get_method_name(name)
+    method = getattr(visitor, method_name, None)
+    if method is None:
+        return None
+    spec = inspect.getfullargspec(method)
+    return method_name, len(spec.args) - 1, spec.varargs is not None
+
+
 class ClojureObject(object):
 
     _attributes = {'col_offset', 'lineno'}
@@ -24,14 +69,18 @@ class ClojureObject(object):
         :param visitor: An object with a `visit_XXX`-method.
         :return:        The result returned by the `visit_XXX`-method of the visitor.
         """
-        name = self.__class__.__name__.lower()
-        method_names = ['visit_' + name + '_form', 'visit_node', 'generic_visit']
-        methods = [getattr(visitor, name, None) for name in method_names]
-        methods = [name for name in methods if name is not None]
-        if len(methods) == 0 and callable(visitor):
+        key = (visitor.__class__, self.__class__)
+        method_name = _dispatch_cache.get(key, None)
+        if method_name is None:
+            name = self.__class__.__name__.lower()
+            method_names = ['visit_' + name + '_form', 'visit_node', 'generic_visit']
+            method_names = [name for name in method_names if getattr(visitor, name, None) is not None]
+            method_name = method_names[0] if len(method_names) > 0 else False
+            _dispatch_cache[key] = method_name
+        if method_name is False and callable(visitor):
             return visitor(self)
-        elif len(methods) > 0:
-            result = methods[0](self)
+        elif method_name is not False:
+            result = getattr(visitor, method_name)(self)
             if hasattr(result, '_attributes'):
                 result = copy_location(result, self)
             return result
@@ -47,11 +96,6 @@ class Form(ClojureObject):
         self.items = items
         if lineno is not None:
             self.lineno = lineno
-        self._special_names = {
-            '->':  'arrow',
-            '->>': 'double_arrow',
-            '.':   'dot'
-        }
         assert type(items) in [list, tuple]
         assert all([isinstance(item, ClojureObject) for item in items])
         assert lineno is None or type(lineno) is int
@@ -68,17 +112,15 @@ class Form(ClojureObject):
     def visit(self, visitor):
         name = self.name
         if name is not None:
-            if name in self._special_names:
-                name = '_sym_' + self._special_names[name]
-            if name.endswith('?'):
-                name = 'is_' + name[:-1]
-            name = name.replace('-', '_').replace('.', '_').replace('/', '_')
-            name = ''.join([n if n.islower() else "_" + n.lower() for n in name])
-            method = getattr(visitor, 'visit_' + name, None)
-            if method is not None:
+            key = (visitor.__class__, name)
+            dispatch = _dispatch_cache.get(key, None)
+            if dispatch is None:
+                dispatch = _resolve_form_method(visitor, name)
+                _dispatch_cache[key] = dispatch if dispatch is not None else False
+            if dispatch:
+                method_name, param_count, has_varargs = dispatch
+                method = getattr(visitor, method_name)
                 arg_count = len(self.items) - 1
-                has_varargs = inspect.getfullargspec(method).varargs is not None
-                param_count = len(inspect.getfullargspec(method).args) - 1
                 has_correct_arg_count = arg_count >= param_count if has_varargs else arg_count == param_count
                 if not has_correct_arg_count:
                     s = "at least" if has_varargs else "exactly"
@@ -175,15 +217,27 @@ class Value(ClojureObject):
 
 
 class Vector(ClojureObject):
-
-    def __init__(self, items:list, lineno:Optional[int]=None):
-        self.items = items
+    """
+    A vector `[...]` of forms. A vector of numbers only might be read as a whole (see `ClojureLexer`), in which
+    case `values` holds the plain numbers, and the items are only created when they are actually needed.
+    """
+
+    def __init__(self, items:Optional[list], lineno:Optional[int]=None, *, values:Optional[list]=None):
+        self._items = items
+        self.values = values
         if lineno is not None:
             self.lineno = lineno
-        assert type(items) in [list, tuple]
-        assert all([isinstance(item, ClojureObject) for item in items])
+        assert type(items) in [list, tuple] or (items is None and type(values) is list)
+        assert items is None or all([isinstance(item, ClojureObject) for item in items])
         assert lineno is None or type(lineno) is int
 
+    @property
+    def items(self):
+        if self._items is None:
+            lineno = getattr(self, 'lineno', None)
+            self._items = [Value(value, lineno=lineno) for value in self.values]
+        return self._items
+
     def __getitem__(self, item):
         return self.items[item]
 
@@ -9,6 +9,13 @@
 from .. import lexer
 from ..fe_clojure import ppl_clojure_forms as clj
 from ..lexer import CatCode, TokenType
+import re
+
+
+# A vector that consists of nothing but numbers (e.g., `[1.5 -2 3e4]`), which is read in one go
+_number = r'[+\-]?[0-9]+(?:\.[0-9]+)?(?:[eE][+\-]?[0-9]+)?'
+_number_vector = re.compile(r'(?:[ \t\n,]*{}(?=[ \t\n,\]]))+[ \t\n,]*\]'.format(_number))
+_number_items = re.compile(_number)
 
 
 #######################################################################################################################
@@ -35,78 +42,114 @@ class ClojureLexer(object):
         return self
 
     def __next__(self):
+        # Nested forms are read with an explicit stack rather than through recursion. Each entry on the stack is
+        # either an open bracket `(left, lineno, items)`, or a prefix such as `@` or `'` as `(prefix, lineno, None)`,
+        # which applies to the next form read.
         source = self.source
-        if source.has_next:
-            token = source.next()
-            pos, token_type, value = token
-            lineno = self.lexer.get_line_from_pos(pos)
-
-            if token_type == TokenType.LEFT_BRACKET:
-                left = value
-                result = []
-                while source.has_next and source.peek()[1] != TokenType.RIGHT_BRACKET:
-                    result.append(self.__next__())
-
-                if source.has_next:
-                    token = source.next()
-                    right = token[2] if token is not None else '<EOF>'
-                    if not token[1] == TokenType.RIGHT_BRACKET:
-                        raise SyntaxError("expected right parentheses or bracket instead of '{}' (line {})".format(
-                            right, self.lexer.get_line_from_pos(token[0])
-                        ))
-                    if left == '(' and right == ')':
-                        return clj.Form(result, lineno=lineno)
-
-                    elif left == '[' and right == ']':
-                        return clj.Vector(result, lineno=lineno)
-
-                    elif left == '{' and right == '}':
-                        if len(result) % 2 != 0:
-                            raise SyntaxError("map requires an even number of elements ({} given)".format(len(result)))
-                        return clj.Map(result, lineno=lineno)
-
-                    else:
-                        raise SyntaxError("mismatched parentheses: '{}' amd '{}' (line {})".format(
-                            left, right, lineno
-                        ))
-
-            elif token_type == TokenType.NUMBER:
-                return clj.Value(value, lineno=lineno)
-
-            elif token_type == TokenType.STRING:
-                return clj.Value(eval(value), lineno=lineno)
+        stack = []
+        while True:
+            if len(stack) > 0 and stack[-1][2] is not None and source.has_next and \
+                    source.peek()[1] == TokenType.RIGHT_BRACKET:
+                left, lineno, items = stack.pop()
+                form = self._make_collection(left, source.next(), items, lineno)
+
+            elif source.has_next:
+                token = source.next()
+                pos, token_type, value = token
+                lineno = self.lexer.get_line_from_pos(pos)
+
+                if token_type == TokenType.LEFT_BRACKET:
+                    form = self._read_number_vector(pos, lineno) if value == '[' else None
+                    if form is None:
+                        stack.append((value, lineno, []))
+                        continue
+
+                elif token_type == TokenType.NUMBER:
+                    form = clj.Value(value, lineno=lineno)
+
+                elif token_type == TokenType.STRING:
+                    form = clj.Value(eval(value), lineno=lineno)
+
+                elif token_type == TokenType.VALUE:
+                    form = clj.Value(value, lineno=lineno)
+
+                elif token_type == TokenType.SYMBOL:
+                    if value in ('#', '@', '\'', '#\''):
+                        stack.append((value, lineno, None))
+                        continue
+                    form = clj.Symbol(value, lineno=lineno)
+
+                else:
+                    raise SyntaxError("invalid token: '{}' (line {})".format(token_type, lineno))
 
-            elif token_type == TokenType.VALUE:
-                return clj.Value(value, lineno=lineno)
-
-            elif token_type == TokenType.SYMBOL:
-
-                if value == '#':
-                    form = self.__next__()
-                    if not isinstance(form, clj.Form):
-                        raise SyntaxError("'#' requires a form to build a function (line {})".format(lineno))
-
-                    params = clj.Vector(_ParameterExtractor().extract_parameters(form))
-                    return clj.Form(['fn', params, form])
+            else:
+                raise StopIteration
+
+            # Hand the form to the enclosing bracket or prefix
+            while len(stack) > 0 and stack[-1][2] is None:
+                prefix, lineno, _ = stack.pop()
+                form = self._apply_prefix(prefix, form, lineno)
+            if len(stack) > 0:
+                stack[-1][2].append(form)
+            else:
+                return form
+
+    def _read_number_vector(self, pos: int, lineno: int):
+        """
+        Reads a vector of numbers such as `[1.5 -2 3e4]` as a whole, right after its opening bracket at `pos`. The
+        numbers are not turned into individual tokens and forms, which makes reading long data vectors much faster.
+        Returns `None` (and leaves the lexer unchanged) if the vector contains anything other than numbers.
+        """
+        m = _number_vector.match(self.text, pos + 1)
+        if m is None:
+            return None
+        text = m.group()
+        numbers = _number_items.findall(text)
+        if '.' in text or 'e' in text or 'E' in text:
+            values = [float(n) if '.' in n or 'e' in n or 'E' in n else int(n) for n in numbers]
+        else:
+            values = list(map(int, numbers))
+        self.lexer.source._pos = m.end()
+        return clj.Vector(None, lineno=lineno, values=values)
+
+    def _make_collection(self, left: str, token, items: list, lineno: int):
+        right = token[2] if token is not None else '<EOF>'
+        if not token[1] == TokenType.RIGHT_BRACKET:
+            raise SyntaxError("expected right parentheses or bracket instead of '{}' (line {})".format(
+                right, self.lexer.get_line_from_pos(token[0])
+            ))
+        if left == '(' and right == ')':
+            return clj.Form(items, lineno=lineno)
+
+        elif left == '[' and right == ']':
+            return clj.Vector(items, lineno=lineno)
+
+        elif left == '{' and right == '}':
+            if len(items) % 2 != 0:
+                raise SyntaxError("map requires an even number of elements ({} given)".format(len(items)))
+            return clj.Map(items, lineno=lineno)
 
-                elif value == '@':
-                    form = self.__next__()
-                    return clj.Form([clj.Symbol('deref', lineno=lineno), form], lineno=lineno)
+        else:
+            raise SyntaxError("mismatched parentheses: '{}' amd '{}' (line {})".format(
+                left, right, lineno
+            ))
 
-                elif value == '\'':
-                    form = self.__next__()
-                    return clj.Form([clj.Symbol('quote', lineno=lineno), form], lineno=lineno)
+    def _apply_prefix(self, prefix: str, form, lineno: int):
+        if prefix == '#':
+            if not isinstance(form, clj.Form):
+                raise SyntaxError("'#' requires a form to build a function (line {})".format(lineno))
 
-                elif value == '#\'':
-                    form = self.__next__()
-                    return clj.Form([clj.Symbol('var', lineno=lineno), form], lineno=lineno)
+            params = clj.Vector(_ParameterExtractor().extract_parameters(form))
+            return clj.Form(['fn', params, form])
 
-                return clj.Symbol(value, lineno=lineno)
+        elif prefix == '@':
+            return clj.Form([clj.Symbol('deref', lineno=lineno), form], lineno=lineno)
 
-            else:
-                raise SyntaxError("invalid token: '{}' (line {})".format(token_type, lineno))
+        elif prefix == '\'':
+            return clj.Form([clj.Symbol('quote', lineno=lineno), form], lineno=lineno)
 
-        raise StopIteration
+        else:
+            return clj.Form([clj.Symbol('var', lineno=lineno), form], lineno=lineno)
 
 #######################################################################################################################
 
@@ -14,6 +14,11 @@ from .ppl_clojure_lexer import ClojureLexer
 #######################################################################################################################
 
 class ClojureParser(clj.Visitor):
+    """
+    Translates the forms into AST-nodes. Unlike the passes that transform the AST, the parser visits nested forms
+    recursively: the nesting depth of a program is thus limited by Python's recursion limit (with the default limit,
+    e.g., to about 160 `if`-forms nested in `let`-forms).
+    """
 
     __core_functions__ = {
         'append',
@@ -447,6 +452,8 @@ class ClojureParser(clj.Visitor):
         return AstValue(node.value)
 
     def visit_vector_form(self, node:clj.Vector):
+        if node.values is not None:
+            return AstValueVector(node.values)
         items = [item.visit(self) for item in node.items]
         return makeVector(items)
 
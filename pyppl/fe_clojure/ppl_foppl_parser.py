@@ -10,6 +10,7 @@ from ..fe_clojure import ppl_clojure_forms as clj
 from ..ppl_ast import *
 from .ppl_clojure_lexer import ClojureLexer
 from .ppl_clojure_parser import ClojureParser
+from ..ppl_pass_manager import count_nodes
 
 
 #######################################################################################################################
@@ -38,7 +39,11 @@ class FopplParser(ClojureParser):
 
 #######################################################################################################################
 
-def parse(source):
+def parse(source, pass_manager=None):
+    if pass_manager is not None:
+        clj_ast = pass_manager.run_stage('Lexer', lambda text: list(ClojureLexer(text)), source,
+                                         nodes_in=len(source), count_result=len)
+        return pass_manager.run_stage('Parser', FopplParser().visit, clj_ast, count_result=count_nodes)
     clj_ast = list(ClojureLexer(source))
     ppl_ast = FopplParser().visit(clj_ast)
     return ppl_ast
@@ -8,11 +8,42 @@
 #
 from ..ppl_ast import *
 from ..ppl_namespaces import namespace_from_module
+from ..ppl_pass_manager import count_nodes
 import ast
 
 
 _cl = ast.copy_location
 
+# Up to Python 3.8, indices and extended slices are wrapped in `ast.Index` and `ast.ExtSlice`-nodes, respectively.
+# Later versions use the expression or a tuple directly.
+_Index = getattr(ast, 'Index', ())
+_ExtSlice = getattr(ast, 'ExtSlice', ())
+
+def _unwrap_index(node):
+    return node.value if isinstance(node, _Index) else node
+
+def _get_number(node):
+    """
+    Returns the value of a numeric literal such as `2.5` or `-1`, or `None` if the node is not a numeric literal.
+    """
+    t = type(node)
+    if t is ast.UnaryOp and type(node.op) in (ast.UAdd, ast.USub) and type(node.operand) is ast.Constant:
+        value = _get_number(node.operand)
+        if value is not None and type(node.op) is ast.USub:
+            return -value
+        return value
+    elif t is ast.Constant and type(node.value) in (int, float):
+        return node.value
+    return None
+
+def _get_numbers(items: list):
+    """
+    Returns the values of a list of numeric literals, or `None` if any item is not a numeric literal. Data vectors
+    can thus be turned into an `AstValueVector` directly, without visiting each item separately.
+    """
+    result = [_get_number(item) for item in items]
+    return result if None not in result else None
+
 
 class _FunctionContext(object):
 
@@ -124,9 +155,9 @@ class PythonParser(ast.NodeVisitor):
                 return _cl(makeDef(tuple(t.id for t in target.elts), source), node)
 
             elif isinstance(target, ast.Subscript) and isinstance(target.value, ast.Name) and \
-                    isinstance(target.slice, ast.Index):
+                    not isinstance(_unwrap_index(target.slice), (ast.Slice, ast.Tuple, _ExtSlice)):
                 base = target.value.id
-                index = target.slice.value
+                index = _unwrap_index(target.slice)
                 return _cl(AstCall(AstSymbol('list.put'), [self.visit(base), self.visit(index), source],
                                    is_builtin=True), node)
 
@@ -354,6 +385,9 @@ class PythonParser(ast.NodeVisitor):
         return _cl(AstFunction(None, arg_names, body), node)
 
     def visit_List(self, node:ast.List):
+        values = _get_numbers(node.elts)
+        if values is not None:
+            return _cl(AstValueVector(values), node)
         items = [self.visit(item) for item in node.elts]
         return _cl(makeVector(items), node)
 
@@ -399,28 +433,39 @@ class PythonParser(ast.NodeVisitor):
 
     def visit_Subscript(self, node:ast.Subscript):
         base = self.visit(node.value)
-        if isinstance(node.slice, ast.Index):
-            index = self.visit(node.slice.value)
-            return _cl(AstSubscript(base, index), node)
-        elif isinstance(node.slice, ast.Slice) and node.slice.step is None:
-            start = self.visit(node.slice.lower)
-            stop = self.visit(node.slice.upper)
-            return _cl(AstSlice(base, start, stop), node)
-        elif isinstance(node.slice, ast.ExtSlice):
+        node_slice = _unwrap_index(node.slice)
+        if isinstance(node_slice, ast.Tuple) and any([isinstance(item, ast.Slice) for item in node_slice.elts]):
+            dims = node_slice.elts
+        elif isinstance(node_slice, _ExtSlice):
+            dims = node_slice.dims
+        else:
+            dims = None
+        if dims is not None:
             indices = []
-            for slice in node.slice.dims:
+            for slice in dims:
                 if isinstance(slice, ast.Slice) and slice.lower is slice.upper is slice.step is None:
                     indices.append(None)
-                elif isinstance(slice, ast.Index):
-                    indices.append(self.visit(slice.value))
+                elif not isinstance(slice, ast.Slice):
+                    indices.append(self.visit(_unwrap_index(slice)))
                 else:
                     indices = None
                     break
             if indices is not None:
                 return _cl(AstMultiSlice(base, indices), node)
+        elif isinstance(node_slice, ast.Slice):
+            if node_slice.step is None:
+                start = self.visit(node_slice.lower)
+                stop = self.visit(node_slice.upper)
+                return _cl(AstSlice(base, start, stop), node)
+        else:
+            index = self.visit(node_slice)
+            return _cl(AstSubscript(base, index), node)
         raise NotImplementedError("cannot compile subscript '{}'".format(ast.dump(node)))
 
     def visit_Tuple(self, node:ast.Tuple):
+        values = _get_numbers(node.elts)
+        if values is not None:
+            return _cl(AstValueVector(values), node)
         items = [self.visit(item) for item in node.elts]
         return _cl(makeVector(items), node)
 
@@ -443,7 +488,10 @@ class PythonParser(ast.NodeVisitor):
 
 #######################################################################################################################
 
-def parse(source):
+def parse(source, pass_manager=None):
+    if pass_manager is not None:
+        py_ast = pass_manager.run_stage('Lexer', ast.parse, source, nodes_in=len(source))
+        return pass_manager.run_stage('Parser', PythonParser().visit, py_ast, count_result=count_nodes)
     py_ast = ast.parse(source)
     ppl_ast = PythonParser().visit(py_ast)
     return ppl_ast
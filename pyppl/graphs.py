@@ -6,8 +6,10 @@
 # 20. Dec 2017, Tobias Kohn
 # 07. Jun 2018, Tobias Kohn
 #
+from array import array as _array
 from typing import Optional
 from . import distributions
+from .ppl_data import DataFile, as_data, get_data_shape
 
 
 class GraphNode(object):
@@ -116,6 +118,15 @@ class ConditionNode(GraphNode):
             if isinstance(a, Vertex):
                 a.add_dependent_condition(self)
 
+    @classmethod
+    def reset_bit_index_counter(cls, value: int=1):
+        """
+        Sets the counter used to assign bit indices to conditions and returns its previous value.
+        """
+        result = cls.__condition_node_counter
+        cls.__condition_node_counter = value
+        return result
+
     def __repr__(self):
         return self.create_repr("Condition", Condition=self.condition, Function=self.function, Op=self.op,
                                 CompareValue=self.compare_value)
@@ -139,14 +150,101 @@ class DataNode(GraphNode):
     """
     Data nodes do not carry out any computation, but provide the data. They are used to keep larger data set out
     of the code, as large lists are replaced by symbols.
+
+    External data nodes represent data that is passed to `compile_model` through its `data`-argument. The code of
+    the model does not contain the data itself, but reads the `value` of the node, so that new data can be bound
+    to the model without compiling it again (see `rebind`). If the external data is given as a file (see
+    `DataFile`), the `value` is the memory-mapped array, and only the `source` is kept when the node is pickled.
+
+    Packed data nodes hold a long data literal as an `array` (see `AstValueVector`), from which the model reads
+    the data directly. The code for the data (`data_code`) is only generated when actually needed, e.g., for `repr`.
+
+    Shared data nodes hold a subexpression used by several vertices or conditions (see `CommonSubexpressionEliminator`).
+    As they might depend on the values of vertices (their `ancestors`), they are computed anew by each method of the
+    model, whereas other data nodes are computed only once by `gen_prior_samples`.
+
+    Loop data nodes hold a deterministic loop, which is kept as a loop (see `can_keep_loop`). Their code is the
+    `for`-statement itself, which assigns the data nodes of the variables changed by the loop. The loop is shared
+    if it depends on any vertices or external data.
     """
 
-    def __init__(self, name: str, *, ancestors: Optional[set]=None, data: str):
+    external_name = None
+    loop = False
+    shared = False
+    source = None
+    value = None
+
+    def __init__(self, name: str, *, ancestors: Optional[set]=None, data: Optional[str],
+                 external_name: Optional[str]=None, value=None, shared: bool=False, loop: bool=False):
         super().__init__(name, ancestors)
-        self.data_code = data
+        self._data_code = data
+        self.external_name = external_name
+        self.loop = loop
+        self.shared = shared
+        self._set_value(value)
+        if external_name is not None:
+            self.shape = get_data_shape(self.value)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if self.source is not None:
+            state['value'] = None
+            state['_data_code'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.source is not None:
+            self.value = self.source.value
 
     def __repr__(self):
-        return self.create_repr("Data", Data=self.data_code)
+        return self.create_repr("Data", Data=self.data_code, External=self.external_name,
+                                Loop=True if self.loop else None, Shared=True if self.shared else None)
+
+    @property
+    def data_code(self):
+        if self._data_code is None and self.value is not None:
+            value = self.value
+            self._data_code = repr(value.tolist() if type(value) is _array else value)
+        return self._data_code
+
+    @data_code.setter
+    def data_code(self, code: str):
+        self._data_code = code
+
+    @property
+    def is_external(self):
+        return self.external_name is not None
+
+    @property
+    def is_packed(self):
+        return not self.is_external and type(self.value) is _array
+
+    def check_value(self, value):
+        """
+        Raises a `ValueError` if the given value cannot replace the current value of this external data node,
+        because it has a different shape, which would require a different graph.
+        """
+        if not self.is_external:
+            raise ValueError("data node '{}' is not external and cannot be rebound".format(self.name))
+        shape = get_data_shape(as_data(value, self.external_name))
+        if shape != self.shape:
+            raise ValueError("cannot rebind data '{}': the shape {} differs from the shape {} the model was "
+                             "compiled with".format(self.external_name, shape, self.shape))
+
+    def rebind(self, value):
+        value = as_data(value, self.external_name)
+        self.check_value(value)
+        self._set_value(value)
+        self.data_code = None
+
+    def _set_value(self, value):
+        if isinstance(value, DataFile):
+            self.source = value
+            self.value = value.value
+        else:
+            self.source = None
+            self.value = value
 
     def get_code(self):
         return self.data_code
@@ -189,7 +287,8 @@ class Vertex(GraphNode):
       The set of all conditions that depend on this vertex. In other words, all conditions which contain this
       vertex in their `get_all_ancestors`-set.
     `sample_size`:
-      The dimension of the samples drawn from this distribution.
+      The dimension of the samples drawn from this distribution. For an observation, this is the number of independent
+      values observed (the size of the plate), in which case the observation is a sequence of values.
     """
 
     def __init__(self, name: str, *,
@@ -289,9 +388,13 @@ class Vertex(GraphNode):
             return None
 
     def add_dependent_condition(self, cond: ConditionNode):
-        self.dependent_conditions.add(cond)
-        for a in self.ancestors:
-            a.add_dependent_condition(cond)
+        # The ancestors are walked on an explicit stack, as the chains of ancestors might be long
+        stack = [self]
+        while len(stack) > 0:
+            vertex = stack.pop()
+            if cond not in vertex.dependent_conditions:
+                vertex.dependent_conditions.add(cond)
+                stack += list(vertex.ancestors)
 
     @property
     def has_observation(self):
@@ -299,12 +402,14 @@ class Vertex(GraphNode):
 
     @property
     def get_all_ancestors(self):
-        result = []
-        for a in self.ancestors:
+        result = set()
+        stack = list(self.ancestors)
+        while len(stack) > 0:
+            a = stack.pop()
             if a not in result:
-                result.append(a)
-                result += list(a.get_all_ancestors())
-        return set(result)
+                result.add(a)
+                stack += list(a.ancestors)
+        return result
 
     @property
     def is_conditional(self):
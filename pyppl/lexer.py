@@ -6,7 +6,9 @@
 # 20. Feb 2018, Tobias Kohn
 # 22. Feb 2018, Tobias Kohn
 #
+import bisect
 import enum
+import re
 
 #######################################################################################################################
 
@@ -48,6 +50,7 @@ class CategoryCodes(object):
     """
 
     def __init__(self, char_range:int=128):
+        self.version = 0
         self.catcodes = [CatCode.INVALID for _ in range(char_range)]
         self.catcodes[ord('\t')] = CatCode.WHITESPACE
         self.catcodes[ord('\n')] = CatCode.NEWLINE
@@ -78,6 +81,7 @@ class CategoryCodes(object):
             raise TypeError("'{}' is not a valid character".format(item))
 
     def __setitem__(self, key, value):
+        self.version += 1
         if type(key) is str and len(key) == 1:
             key = ord(key)
             self.catcodes[key] = value
@@ -108,6 +112,7 @@ class CharacterStream(object):
         self.source = source # type:str
         self._pos = 0        # type:int
         self.default_char = '\u0000'  # type:str
+        self._line_offsets = None
 
     def __getitem__(self, item):
         if 0 <= item < len(self.source):
@@ -152,7 +157,13 @@ class CharacterStream(object):
         return self._pos >= len(self.source)
 
     def get_line_from_pos(self, pos):
-        return self.source.count('\n', 0, pos)
+        """
+        Returns the number of newlines before the given position, using a binary search on the positions of all
+        newlines in the source (which are computed once).
+        """
+        if self._line_offsets is None:
+            self._line_offsets = [m.start() for m in re.finditer('\n', self.source)]
+        return bisect.bisect_left(self._line_offsets, pos)
 
     def next(self):
         i = self._pos
@@ -266,6 +277,12 @@ class Lexer(object):
 
     NB: numbers starting with a digit 0, 1, ..., 9 or a sign `+`/`-` and a digit are always recognised as numbers,
     independent of any category codes.
+
+    When the first token is read, the category codes, string prefixes and the line comment are compiled into a single
+    regular expression, which recognises an entire token (or a run of whitespace and comments) with one match. The
+    expression is compiled anew whenever the category codes or string prefixes change. Anything the expression does
+    not cover (escape sequences, block comments, non-ASCII input) is read character by character in `read_token`,
+    which is also the reference for the behaviour of the lexer.
     """
 
     def __init__(self, source):
@@ -291,101 +308,255 @@ class Lexer(object):
         self.line_comment = None
         self.block_comment_start = None
         self.block_comment_end = None
+        self._tokenizer = None
+        self._tokenizer_key = None
         assert isinstance(source, CharacterStream)
 
     def __iter__(self):
         return self
 
     def __next__(self):
+        key = (self.catcodes, self.catcodes.version, len(self.string_prefix), self.line_comment,
+               self.block_comment_start)
+        if key != self._tokenizer_key:
+            self._tokenizer = self._compile_tokenizer()
+            self._tokenizer_key = key
+        if self._tokenizer is None:
+            return self.read_token()
+
         source = self.source
-        pos = source.current_pos
-        if source.eof():
-            raise StopIteration
+        text = source.source
+        catcodes = self.catcodes.catcodes
+        match = self._tokenizer
+        pos = source._pos
+        while True:
+            m = match(text, pos)
+            if m is None:
+                source._pos = pos
+                raise StopIteration
+            kind = m.lastgroup
+            end = m.end()
+            if kind == 'skip':
+                pos = end
+                continue
+
+            elif kind == 'number':
+                source._pos = end
+                return pos, TokenType.NUMBER, self._number_value(m.group(), m.start('dot') - pos)
+
+            elif kind == 'name':
+                name = m.group()
+                if end < len(text) and catcodes[ord(text[end])] == CatCode.STRING_DELIMITER and \
+                        name in self.string_prefix:
+                    source._pos = end
+                    return pos, TokenType.STRING, name + self.read_string()
+                source._pos = end
+                if name in self.constants:
+                    return pos, TokenType.VALUE, self.constants[name]
+                else:
+                    tt = TokenType.KEYWORD if name in self.keywords else TokenType.SYMBOL
+                    return pos, tt, name
+
+            elif kind == 'left':
+                source._pos = end
+                return pos, TokenType.LEFT_BRACKET, m.group()
+
+            elif kind == 'right':
+                source._pos = end
+                return pos, TokenType.RIGHT_BRACKET, m.group()
+
+            elif kind == 'string' or kind == 'pstring':
+                source._pos = end
+                return pos, TokenType.STRING, m.group()
+
+            elif kind == 'signed':
+                source._pos = end
+                number = self._number_value(m.group()[1:], m.start('sdot') - pos - 1)
+                return pos, TokenType.NUMBER, -number if m.group()[0] == '-' else number
+
+            elif kind == 'symbol':
+                source._pos = pos
+                return pos, TokenType.SYMBOL, self.read_symbol()
+
+            elif kind == 'newline' or kind == 'prefix':
+                source._pos = end
+                return pos, TokenType.NEWLINE if kind == 'newline' else TokenType.SYMBOL, m.group()
+
+            elif kind == 'invalid':
+                source._pos = pos
+                raise SyntaxError("invalid character in input stream: {}/'{}'".format(
+                    hex(ord(text[pos])), text[pos]
+                ))
 
-        if source.test(self.line_comment):
-            source.drop_while(lambda c: c != '\n')
-            return self.__next__()
-        if source.test(self.block_comment_start):
-            source.drop(len(self.block_comment_start))
-            while not source.eof() and not source.test(self.block_comment_end):
-                source.drop(1)
-            return self.__next__()
-
-        cc = self.catcodes[source.current]
-        if cc == CatCode.IGNORE:
-            source.drop(1)
-            return self.__next__()
-
-        elif cc == CatCode.INVALID:
-            raise SyntaxError("invalid character in input stream: {}/'{}'".format(
-                hex(ord(source.current)), source.current
-            ))
-
-        elif cc == CatCode.LINE_COMMENT:
-            source.drop_while(lambda c: c != '\n')
-            return self.__next__()
-
-        elif cc == CatCode.WHITESPACE:
-            source.drop_while(lambda c: self.catcodes[c] == CatCode.WHITESPACE)
-            return self.__next__()
-
-        # if + and - are just regular names (e.g., as in Clojure), we still want to parse numbers correctly
-        elif source.current in ['+', '-'] and '0' <= source.peek(1) <= '9':
-            sign = source.next()
-            number = self.read_number()
-            if sign == '-':
-                number = -number
-            return pos, TokenType.NUMBER, number
-
-        elif self.catcodes[source.peek(1)] == CatCode.STRING_DELIMITER and source.current in self.string_prefix:
-            prefix = source.next()
-            return pos, TokenType.STRING, prefix + self.read_string()
-
-        elif cc == CatCode.STRING_DELIMITER:
-            return pos, TokenType.STRING, self.read_string()
-
-        elif cc in [CatCode.SYMBOL, CatCode.DELIMITER]:
-            return pos, TokenType.SYMBOL, self.read_symbol()
-
-        elif cc in [CatCode.LEFT_BRACKET, CatCode.RIGHT_BRACKET]:
-            tt = TokenType.LEFT_BRACKET if cc == CatCode.LEFT_BRACKET else TokenType.RIGHT_BRACKET
-            return pos, tt, source.next()
-
-        elif '0' <= source.current <= '9' or cc == CatCode.NUMERIC:
-            return pos, TokenType.NUMBER, self.read_number()
-
-        elif cc == CatCode.ALPHA:
-            name = self.read_name()
-            if self.catcodes[source.current] == CatCode.STRING_DELIMITER and name in self.string_prefix:
-                return pos, TokenType.STRING, name + self.read_string()
-            elif name in self.constants:
-                return pos, TokenType.VALUE, self.constants[name]
-            else:
-                tt = TokenType.KEYWORD if name in self.keywords else TokenType.SYMBOL
-                return pos, tt, name
-
-        elif cc == CatCode.NEWLINE:
-            return pos, TokenType.NEWLINE, source.next()
-
-        elif cc == CatCode.ESCAPE:
-            result = self.read_escape()
-            if result is None:
-                return self.__next__()
-            elif type(result) is tuple and len(result) == 2:
-                return pos, result[0], result[1]
             else:
-                return pos, TokenType.SYMBOL, result
+                source._pos = pos
+                return self.read_token()
+
+    def _compile_tokenizer(self):
+        """
+        Compiles the current configuration into a regular expression with one named group per kind of token, and
+        returns its `match`-method. Returns `None` if the input must be read character by character.
+        """
+        source = self.source.source
+        codes = self.catcodes.catcodes
+        if not source.isascii() or len(codes) < 128 or codes[0] != CatCode.INVALID or \
+                self.block_comment_start is not None or self.line_comment == '':
+            return None
+
+        def chars(*catcodes):
+            return ''.join([re.escape(chr(i)) for i in range(128) if codes[i] in catcodes])
+
+        def char_class(*catcodes):
+            c = chars(*catcodes)
+            return '[{}]'.format(c) if c != '' else None
+
+        alnum = char_class(CatCode.ALPHA, CatCode.NUMERIC) or '(?!)'
+        term = char_class(CatCode.WHITESPACE, CatCode.RIGHT_BRACKET, CatCode.NEWLINE, CatCode.DELIMITER) or '(?!)'
+
+        def number(dot: str):
+            return r'(?:0[xX][0-9a-fA-F]*|0[oO][0-7]*|0[bB][01]*|' \
+                   r'[0-9]+(?:\.[0-9]+)?(?P<{}>\.(?={}))?(?:[eE][+\-]?[0-9]+)?)'.format(dot, term)
+
+        delimiters = [chr(i) for i in range(128) if codes[i] == CatCode.STRING_DELIMITER]
+        string = '|'.join([r'{0}(?:[^{0}\\\x00]|\\[\s\S]?)*{0}?'.format(re.escape(d)) for d in delimiters])
+        prefixes = ''.join([re.escape(p) for p in self.string_prefix if len(p) == 1])
+
+        skip = [char_class(CatCode.IGNORE), char_class(CatCode.WHITESPACE)]
+        skip = ['{}+'.format(c) for c in skip if c is not None]
+        if char_class(CatCode.LINE_COMMENT) is not None:
+            skip.append(char_class(CatCode.LINE_COMMENT) + r'[^\n]*')
+        if self.line_comment is not None:
+            skip.insert(0, re.escape(self.line_comment) + r'[^\n]*')
+
+        # The order of the alternatives follows the order of the tests in `read_token`
+        groups = [
+            ('skip', '|'.join(skip) if len(skip) > 0 else None),
+            ('invalid', char_class(CatCode.INVALID)),
+            ('signed', r'[+\-](?=[0-9])' + number('sdot')),
+            ('pstring', '[{}](?:{})'.format(prefixes, string) if prefixes != '' and string != '' else None),
+            ('string', string if string != '' else None),
+            ('symbol', char_class(CatCode.SYMBOL, CatCode.DELIMITER)),
+            ('left', char_class(CatCode.LEFT_BRACKET)),
+            ('right', char_class(CatCode.RIGHT_BRACKET)),
+            ('number', number('dot')),
+            ('numeric', char_class(CatCode.NUMERIC)),
+            ('name', char_class(CatCode.ALPHA) + alnum + '*' if char_class(CatCode.ALPHA) is not None else None),
+            ('newline', char_class(CatCode.NEWLINE)),
+            ('prefix', '(?:{}){}*'.format('|'.join([re.escape(chr(i)) + '+' for i in range(128)
+                                                   if codes[i] == CatCode.PREFIX]), alnum)
+                       if char_class(CatCode.PREFIX) is not None else None),
+            ('escape', char_class(CatCode.ESCAPE)),
+        ]
+        pattern = '|'.join(['(?P<{}>{})'.format(name, regex) for name, regex in groups if regex is not None])
+        return re.compile(pattern).match
+
+    @staticmethod
+    def _number_value(text: str, dot: int):
+        # `dot` is the index of a trailing decimal point (as in `1.`), which is completed to `1.0`
+        if text[:2] in ('0x', '0X', '0b', '0B', '0o', '0O'):
+            return int(text[2:], { 'x': 16, 'o': 8, 'b': 2 }[text[1].lower()])
+        if dot >= 0:
+            text = text[:dot+1] + '0' + text[dot+1:]
+        if text.isdigit():
+            return int(text)
+        else:
+            return float(text)
 
-        elif cc == CatCode.PREFIX:
-            char = source.current
-            result = source.take_while(lambda c: c == char)
-            result += source.take_while(lambda c: self.catcodes[c] in [CatCode.ALPHA, CatCode.NUMERIC])
-            return pos, TokenType.SYMBOL, result
+    def read_token(self):
+        """
+        Reads the next token character by character, according to the category codes.
+        """
+        source = self.source
+        # Comments and whitespace are skipped in a loop rather than through recursion
+        while True:
+            pos = source.current_pos
+            if source.eof():
+                raise StopIteration
+
+            if source.test(self.line_comment):
+                source.drop_while(lambda c: c != '\n')
+                continue
+            if source.test(self.block_comment_start):
+                source.drop(len(self.block_comment_start))
+                while not source.eof() and not source.test(self.block_comment_end):
+                    source.drop(1)
+                continue
+
+            cc = self.catcodes[source.current]
+            if cc == CatCode.IGNORE:
+                source.drop(1)
+                continue
+
+            elif cc == CatCode.INVALID:
+                raise SyntaxError("invalid character in input stream: {}/'{}'".format(
+                    hex(ord(source.current)), source.current
+                ))
+
+            elif cc == CatCode.LINE_COMMENT:
+                source.drop_while(lambda c: c != '\n')
+                continue
+
+            elif cc == CatCode.WHITESPACE:
+                source.drop_while(lambda c: self.catcodes[c] == CatCode.WHITESPACE)
+                continue
+
+            # if + and - are just regular names (e.g., as in Clojure), we still want to parse numbers correctly
+            elif source.current in ['+', '-'] and '0' <= source.peek(1) <= '9':
+                sign = source.next()
+                number = self.read_number()
+                if sign == '-':
+                    number = -number
+                return pos, TokenType.NUMBER, number
+
+            elif self.catcodes[source.peek(1)] == CatCode.STRING_DELIMITER and source.current in self.string_prefix:
+                prefix = source.next()
+                return pos, TokenType.STRING, prefix + self.read_string()
+
+            elif cc == CatCode.STRING_DELIMITER:
+                return pos, TokenType.STRING, self.read_string()
+
+            elif cc in [CatCode.SYMBOL, CatCode.DELIMITER]:
+                return pos, TokenType.SYMBOL, self.read_symbol()
+
+            elif cc in [CatCode.LEFT_BRACKET, CatCode.RIGHT_BRACKET]:
+                tt = TokenType.LEFT_BRACKET if cc == CatCode.LEFT_BRACKET else TokenType.RIGHT_BRACKET
+                return pos, tt, source.next()
+
+            elif '0' <= source.current <= '9' or cc == CatCode.NUMERIC:
+                return pos, TokenType.NUMBER, self.read_number()
+
+            elif cc == CatCode.ALPHA:
+                name = self.read_name()
+                if self.catcodes[source.current] == CatCode.STRING_DELIMITER and name in self.string_prefix:
+                    return pos, TokenType.STRING, name + self.read_string()
+                elif name in self.constants:
+                    return pos, TokenType.VALUE, self.constants[name]
+                else:
+                    tt = TokenType.KEYWORD if name in self.keywords else TokenType.SYMBOL
+                    return pos, tt, name
+
+            elif cc == CatCode.NEWLINE:
+                return pos, TokenType.NEWLINE, source.next()
+
+            elif cc == CatCode.ESCAPE:
+                result = self.read_escape()
+                if result is None:
+                    continue
+                elif type(result) is tuple and len(result) == 2:
+                    return pos, result[0], result[1]
+                else:
+                    return pos, TokenType.SYMBOL, result
+
+            elif cc == CatCode.PREFIX:
+                char = source.current
+                result = source.take_while(lambda c: c == char)
+                result += source.take_while(lambda c: self.catcodes[c] in [CatCode.ALPHA, CatCode.NUMERIC])
+                return pos, TokenType.SYMBOL, result
 
-        else:
-            raise SyntaxError("invalid character in input stream: {}/'{}'".format(
-                hex(ord(source.current)), source.current
-            ))
+            else:
+                raise SyntaxError("invalid character in input stream: {}/'{}'".format(
+                    hex(ord(source.current)), source.current
+                ))
 
     def read_escape(self):
         escapes = self.escapes.keys()
@@ -9,23 +9,18 @@
 from typing import Optional
 
 from .transforms import (ppl_new_simplifier, ppl_raw_simplifier, ppl_functions_inliner,
-                         ppl_symbol_simplifier, ppl_static_assignments)
+                         ppl_symbol_simplifier, ppl_static_assignments, ppl_common_subexpressions,
+                         ppl_dead_code)
 from . import ppl_ast
 from .fe_clojure import ppl_foppl_parser
 from .fe_python import ppl_python_parser
-from .backend.ppl_code_generator import generate_code as _gen_code
+from .ppl_pass_manager import FixedPoint, PassManager
 
 
 ##### Used for debugging: #####
 
 _print_debug_steps = False
 
-def _print_debug(letter, code):
-    if _print_debug_steps:
-        print("=" * 30, letter, "=" * 30)
-        print(_gen_code(code), flush=True)
-        print("-" * 63, flush=True)
-
 
 def _detect_language(s:str):
     for char in s:
@@ -52,45 +47,75 @@ supported_languages = {
 }
 
 
-def parse(source:str, *, simplify:bool=True, language:Optional[str]=None, namespace:Optional[dict]=None):
+def get_passes(namespace: Optional[dict]=None, *, simplify: bool=True, data: Optional[dict]=None,
+               unroll_threshold: Optional[int]=None):
+    """
+    Returns the list of passes (as tuples `(name, transform)`) applied to the AST after parsing.
+
+    The simplification is iterated until the AST does not change any more (see `FixedPoint`), and passes are
+    skipped if they have nothing to do, so that a model gets only as many passes as it actually needs. The iterated
+    group consists of the `Simplifier` and the dead code elimination, as removing dead code can leave more to
+    simplify. The `SymbolSimplifier` runs only once afterwards: it renames the variables, whereas the `Simplifier`
+    keeps track of them by name across iterations.
+
+    The files loaded by the program through `load_data(...)` are added to the dictionary `data`, if given.
+
+    Loops over more than `unroll_threshold` items (default: `DEFAULT_UNROLL_THRESHOLD`), which neither sample nor
+    observe anything, are not unrolled but kept as loops (see `can_keep_loop`).
+    """
+    if namespace is None:
+        namespace = {}
+    raw_sim = ppl_raw_simplifier.RawSimplifier(namespace, data)
+    if simplify:
+        return [
+            ('RawSimplifier', raw_sim),
+            ('FunctionInliner', ppl_functions_inliner.FunctionInliner()),
+            ('RawSimplifier', raw_sim),
+            ('StaticAssignments', ppl_static_assignments.StaticAssignments(unroll_threshold)),
+            ('Simplification', FixedPoint([
+                ('Simplifier', ppl_new_simplifier.Simplifier(unroll_threshold)),
+                ('DeadCodeElimination', ppl_dead_code.DeadCodeEliminator()),
+            ])),
+            ('SymbolSimplifier', ppl_symbol_simplifier.SymbolSimplifier()),
+            ('CommonSubexpressions', ppl_common_subexpressions.CommonSubexpressionEliminator()),
+        ]
+    else:
+        return [
+            ('RawSimplifier', raw_sim),
+            ('SymbolSimplifier', ppl_symbol_simplifier.SymbolSimplifier()),
+        ]
+
+
+def parse(source:str, *, simplify:bool=True, language:Optional[str]=None, namespace:Optional[dict]=None,
+          pass_manager:Optional[PassManager]=None, data:Optional[dict]=None, unroll_threshold:Optional[int]=None):
+    if pass_manager is None:
+        pass_manager = PassManager(collect_statistics=False, debug=_print_debug_steps)
     result = None
     if type(source) is str and str != '':
         lang = _detect_language(source) if language is None else language.lower()
         if lang in ['py', 'python']:
-            result = ppl_python_parser.parse(source)
+            result = ppl_python_parser.parse(source, pass_manager)
 
         elif lang in ['clj', 'clojure']:
-            result = ppl_foppl_parser.parse(source)
+            result = ppl_foppl_parser.parse(source, pass_manager)
 
         elif lang == 'foppl':
-            result = ppl_foppl_parser.parse(source)
+            result = ppl_foppl_parser.parse(source, pass_manager)
 
     if type(result) is list:
         result = ppl_ast.makeBody(result)
 
-    if result is not None:
-        if namespace is None:
-            namespace = {}
-        raw_sim = ppl_raw_simplifier.RawSimplifier(namespace)
-        result = raw_sim.visit(result)
-        _print_debug("A", result)
-        if simplify:
-            result = ppl_functions_inliner.FunctionInliner().visit(result)
-            result = raw_sim.visit(result)
-            _print_debug("B", result)
-
-    if simplify and result is not None:
-        result = ppl_static_assignments.StaticAssignments().visit(result)
-        _print_debug("C", result)
-        result = ppl_new_simplifier.Simplifier().visit(result)
-        _print_debug("D", result)
-
-    result = ppl_symbol_simplifier.SymbolSimplifier().visit(result)
-    _print_debug("E", result)
-    return result
-
-
-def parse_from_file(filename: str, *, simplify:bool=True, language:Optional[str]=None, namespace:Optional[dict]=None):
+    if result is None:
+        return None
+
+    return pass_manager.run(result, get_passes(namespace, simplify=simplify, data=data,
+                                                   unroll_threshold=unroll_threshold))
+
+
+def parse_from_file(filename: str, *, simplify:bool=True, language:Optional[str]=None, namespace:Optional[dict]=None,
+                    pass_manager:Optional[PassManager]=None, data:Optional[dict]=None,
+                    unroll_threshold:Optional[int]=None):
     with open(filename) as f:
         source = ''.join(f.readlines())
-    return parse(source, simplify=simplify, language=language, namespace=namespace)
+    return parse(source, simplify=simplify, language=language, namespace=namespace, pass_manager=pass_manager,
+                 data=data, unroll_threshold=unroll_threshold)
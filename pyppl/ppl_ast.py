@@ -7,26 +7,269 @@
 # 27. Jun 2018, Tobias Kohn
 #
 from typing import Optional
+from array import array as _array
 import enum
 from ast import copy_location as _cl
 import inspect as _inspect
+from types import GeneratorType as _GeneratorType
+
+
+# Maps `(visitor class, node class, visitor key)` to the names of the methods to call in `AstNode.visit`
+_dispatch_cache = {}
+
+def clear_dispatch_cache():
+    """
+    Clears the cache of visit-methods used by `AstNode.visit`. This is only necessary if methods are added to or
+    removed from a visitor class after it has been used.
+    """
+    _dispatch_cache.clear()
+
+
+def _is_slot_set(node, name: str):
+    """
+    Returns `True` if the attribute `name` has actually been set on the node (as opposed to providing a default).
+    """
+    try:
+        object.__getattribute__(node, name)
+        return True
+    except AttributeError:
+        return False
+
+
+def _hashable(value):
+    """
+    Converts the value of a field into something hashable, in accordance with how `AstNode.equals` compares fields.
+    """
+    if isinstance(value, AstNode):
+        return value
+    t = type(value)
+    if t is list or t is tuple:
+        return tuple([_hashable(item) for item in value])
+    elif t is set or t is frozenset:
+        return frozenset(value)
+    elif t is dict:
+        return frozenset([(key, _hashable(value[key])) for key in value])
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return t
+
+
+def _value_key(value):
+    """
+    Returns a key for a (possibly nested) list of plain values, which distinguishes between different types, i.e.
+    `[1, 2]`, `[1.0, 2.0]` and `[True, 2]` all have different keys. This is necessary because, although they compare
+    equal in Python, the resulting code and data are not the same.
+    """
+    t = type(value)
+    if t is _array:
+        return t, value.typecode, value.tobytes()
+    if t is list or t is tuple:
+        if any([type(item) in (list, tuple) for item in value]):
+            return t, tuple([_value_key(item) for item in value])
+        else:
+            return t, tuple(map(type, value)), tuple(value)
+    return t, value
+
+
+# Maps the AST-classes to the names of the arguments of their constructors (used by `AstNode.clone`)
+_clone_plans = {}
+
+def _get_clone_plan(cls):
+    try:
+        return _clone_plans[cls]
+    except KeyError:
+        spec = _inspect.getfullargspec(cls.__init__)
+        result = tuple([arg for arg in spec.args if arg != 'self'] + list(spec.kwonlyargs))
+        _clone_plans[cls] = result
+        return result
+
+
+def _begin_visit(visitor, node):
+    """
+    Calls the `visit_XXX`-method of the visitor for the given node, together with `enter_XXX` (see `AstNode.visit`).
+    Returns a tuple `(generator, result, leave)`. If the visit-method is a generator, `generator` is the running
+    generator and `leave` is the `leave_XXX`-method to call once it has finished (if any); otherwise, `generator` is
+    `None` and `result` is the value returned by the visit-method.
+    """
+    visitor_class = type(visitor)
+    key = (visitor_class, node.__class__, node.get_visitor_key())
+    dispatch = _dispatch_cache.get(key, None)
+    if dispatch is None:
+        dispatch = node._resolve_dispatch(visitor_class)
+        _dispatch_cache[key] = dispatch
+    if dispatch is False:
+        result = node._visit_uncached(visitor)
+        if type(result) is _GeneratorType:
+            return result, None, None
+        return None, result, None
+
+    method_name, env_names, visit_children_first, track_lines = dispatch
+    method = getattr(visitor, method_name)
+    if node.verbose is True or getattr(visitor, 'verbose', False) is True:
+        print("calling {}".format(method))
+    lineno = getattr(node, 'lineno', None) if track_lines else None
+    if env_names is not None:
+        if lineno is not None:
+            visitor.set_current_line_number(lineno)
+        getattr(visitor, env_names[0])(node)
+        leave = getattr(visitor, env_names[1])
+        try:
+            if visit_children_first:
+                node.visit_children(visitor)
+            if lineno is not None:
+                visitor.set_current_line_number(lineno)
+            result = method(node)
+        except BaseException:
+            leave(node)
+            raise
+        if type(result) is _GeneratorType:
+            return result, None, leave
+        leave(result if isinstance(result, node.__class__) else node)
+        return None, result, None
+    else:
+        if visit_children_first:
+            node.visit_children(visitor)
+        if lineno is not None:
+            visitor.set_current_line_number(lineno)
+        result = method(node)
+        if type(result) is _GeneratorType:
+            return result, None, None
+        return None, result, None
+
+
+def _visit_sequence(items):
+    result = []
+    for item in items:
+        result.append((yield item))
+    return result if type(items) is list else tuple(result)
+
+def _visit_mapping(items: dict):
+    result = {}
+    for key in items:
+        result[key] = yield items[key]
+    return result
+
+
+def _run_visits(visitor, generator, node, leave):
+    """
+    Runs the generator returned by a visit-method to completion on an explicit stack. Whenever the generator yields
+    a child, the child's visit-method is called: if it is again a generator, it is put on the stack, otherwise its
+    result is sent back right away. Exceptions are propagated through the generators on the stack.
+    """
+    walk_default = getattr(type(visitor), 'visit', None) is Visitor.visit
+    stack = [(generator, node, leave)]
+    value = None
+    error = None
+    while True:
+        generator, node, leave = stack[-1]
+        try:
+            if error is not None:
+                e, error = error, None
+                child = generator.throw(e)
+            else:
+                child = generator.send(value)
+        except StopIteration as e:
+            stack.pop()
+            value = e.value
+            if leave is not None:
+                try:
+                    leave(value if isinstance(value, node.__class__) else node)
+                except BaseException as e:
+                    if len(stack) == 0:
+                        raise
+                    error = e
+            if len(stack) == 0:
+                return value
+            continue
+        except BaseException as e:
+            stack.pop()
+            if leave is not None:
+                leave(node)
+            if len(stack) == 0:
+                raise
+            error = e
+            continue
+
+        value = None
+        try:
+            if not walk_default:
+                value = visitor.visit(child)
+            elif isinstance(child, AstNode):
+                generator, value, leave = _begin_visit(visitor, child)
+                if generator is not None:
+                    stack.append((generator, child, leave))
+                    value = None
+            elif type(child) in (list, tuple):
+                stack.append((_visit_sequence(child), child, None))
+            elif type(child) is dict:
+                stack.append((_visit_mapping(child), child, None))
+            else:
+                value = Visitor.visit(visitor, child)
+        except BaseException as e:
+            error = e
+
+
+def walk(node):
+    """
+    Iterates over all AST-nodes in the given tree (or list of trees) in pre-order, using an explicit stack.
+    """
+    stack = [node]
+    while len(stack) > 0:
+        item = stack.pop()
+        if isinstance(item, AstNode):
+            yield item
+            children = item.get_ast_children()
+            children.reverse()
+            stack.extend(children)
+        elif type(item) in (list, tuple):
+            stack.extend(reversed(item))
+
 
 class AstNode(object):
     """
     The `AstNode` is the base-class for all AST-nodes. You will typically not instantiate an object of this class,
     but derive a specific AST-node from it.
+
+    Each AST-node class declares its fields statically in `_fields` and uses `__slots__`, so that the nodes do not
+    carry an instance dictionary. Attributes that are not set for every node (`lineno`, `col_offset`,
+    `original_name`, `tag` and the type `__type__`) are declared here. Of these, `original_name` and `tag` default
+    to `None`, while the others are simply missing (use `getattr(node, name, default)`) if they have not been set.
+
+    AST-nodes are hashable: the structural hash is computed from the fields (see `get_hash_key`) and cached in the
+    node, so that it is only computed once for each subtree. Structurally equal nodes have the same hash, which
+    allows using nodes as keys in dictionaries, and lets `==` reject different nodes quickly. Once a node has been
+    hashed, its fields must not be modified in place anymore (use `clone` instead).
+
+    Similarly, the type inferred for a node is cached in `_type_cache` (see `TypeInferencer`). Neither the hash nor
+    the inferred type are copied by `clone` or `with_fields`, so that a transformed node is always inferred anew.
     """
 
+    __slots__ = ('lineno', 'col_offset', 'original_name', 'tag', '__type__', '_hash', '_type_cache')
+    _optional_attributes = ('lineno', 'col_offset', 'original_name', 'tag', '__type__')
+    _fields = ()
     _attributes = { 'col_offset', 'lineno' }
-    original_name = None
-    tag = None
+    _defaults = { 'original_name': None, 'tag': None }
+    verbose = False
+
+    def __getattr__(self, name):
+        # Only called if the attribute is not set; provides the default values for the optional attributes
+        try:
+            return AstNode._defaults[name]
+        except KeyError:
+            raise AttributeError(name) from None
 
     def get_fields(self):
-        fields = set(self.__dict__).difference(set(AstNode.__dict__))
-        fields = [name for name in fields if len(name) > 0 and not name.startswith('_')]
-        return fields
+        """
+        Returns the names of the fields of this node, i.e. the declared fields as well as the line number and column
+        offset, if these are set.
+        """
+        return list(self._fields) + [name for name in ('lineno', 'col_offset') if _is_slot_set(self, name)]
 
     def set_field_values(self, source):
+        self.clear_hash()
+        self.clear_type_cache()
         if isinstance(source, self.__class__):
             for field in self.get_fields():
                 setattr(self, field, getattr(source, field))
@@ -52,7 +295,7 @@ class AstNode(object):
             else:
                 return False
 
-        return [item for item in self.get_fields() if is_valid(item)]
+        return [item for item in self._fields if is_valid(item)]
 
     def get_ast_children(self):
         """
@@ -61,7 +304,7 @@ class AstNode(object):
         :return: A (possibly empty) list of `AstNode`-objects.
         """
         result = []
-        for name in self.get_fields():
+        for name in self._fields:
             field = getattr(self, name, None)
             if isinstance(field, AstNode):
                 result.append(field)
@@ -108,6 +351,16 @@ class AstNode(object):
             result = ['visit_' + name, 'visit_' + name.lower(), 'visit_' + name2]
         return result
 
+    def get_visitor_key(self):
+        """
+        Returns a hashable key, which, together with the class of the node, fully determines the names returned by
+        `get_visitor_names()`. The visit-methods are cached based on this key (see `visit`). Any class that overrides
+        `get_visitor_names()` must override this method accordingly.
+
+        :return:  A hashable value, usually `None`.
+        """
+        return None
+
     def __get_envelop_method_names(self):
         """
         Returns a list of two names `enter_XXX` and `leave_XXX`, where the `XXX` stands for the name of the class.
@@ -136,9 +389,43 @@ class AstNode(object):
         are called right before, and right after, respectively, the `visit_XXX`-method itself is called. They do not
         replace but supplement the `visit_XXX`-method.
 
+        The methods to call are resolved once for each combination of visitor class and node class, and then cached
+        (see `get_visitor_key()`). Visitors, which add or replace their visit-methods dynamically on the instance,
+        can opt out of this caching by setting the class attribute `__dispatch_cache__ = False`.
+
+        A `visit_XXX`-method may be written as a generator, which yields the children to visit instead of calling
+        `visitor.visit(child)`, i.e. `value = yield node.value`. Such methods are run on an explicit stack (see
+        `_run_visits`), so that the depth of the AST is not limited by Python's recursion limit. Lists, tuples and
+        dictionaries of children can be yielded as well.
+
         :param visitor: An object with a `visit_XXX`-method.
         :return:        The result returned by the `visit_XXX`-method of the visitor.
         """
+        generator, result, leave = _begin_visit(visitor, self)
+        if generator is not None:
+            return _run_visits(visitor, generator, self, leave)
+        return result
+
+    def _resolve_dispatch(self, visitor_class):
+        """
+        Resolves the methods to call by `visit` for the given visitor class, and returns them as a tuple
+        `(method_name, env_names, visit_children_first, track_lines)`, or `False` if the visit cannot be cached (the
+        visitor might then be a callable object without any visit-methods).
+        """
+        if getattr(visitor_class, '__dispatch_cache__', True) is False:
+            return False
+        method_names = self.get_visitor_names() + ['visit_node', 'generic_visit']
+        method_names = [name for name in method_names if getattr(visitor_class, name, None) is not None]
+        if len(method_names) == 0:
+            return False
+        env_names = [name for name in self.__get_envelop_method_names()
+                     if getattr(visitor_class, name, None) is not None]
+        return (method_names[0],
+                tuple(env_names) if len(env_names) == 2 else None,
+                getattr(visitor_class, '__visit_children_first__', False) is True,
+                getattr(visitor_class, 'set_current_line_number', None) is not None)
+
+    def _visit_uncached(self, visitor):
         visit_children_first = getattr(visitor, '__visit_children_first__', False) is True
         lm_method = getattr(visitor, 'set_current_line_number', None)
         method_names = self.get_visitor_names() + ['visit_node', 'generic_visit']
@@ -187,7 +474,7 @@ class AstNode(object):
         :return:        A list with the values returned by the called `visit_XXX`-methods.
         """
         result = []
-        for name in self.get_fields():
+        for name in self._fields:
             item = getattr(self, name, None)
             if isinstance(item, AstNode) or type(item) in (list, tuple):
                 result.append(visitor.visit(item))
@@ -197,12 +484,14 @@ class AstNode(object):
         """
         Sets an attribute on each node in the AST, based on the provided visitor (see `visit`-method above).
 
+        Since the AST-nodes use `__slots__`, the attribute must be declared by the node classes (such as `tag`).
+
         :param visitor:    An object with `visit_XXX`-methods to be called.
         :param attr_name:  The name of the attribute to set, must be a string.
         :return:           The value of the attribute set.
         """
         assert type(attr_name) is str
-        for name in self.get_fields():
+        for name in self._fields:
             item = getattr(self, name, default)
             if isinstance(item, AstNode):
                 item.visit_attribute(visitor, attr_name)
@@ -232,11 +521,13 @@ class AstNode(object):
 
     def equals(self, node):
         try:
-            for attr in self.get_fields():
+            for attr in self._fields:
                 if attr in self._attributes: continue
                 attr_a = getattr(self, attr)
                 attr_b = getattr(node, attr)
                 if type(attr_a) in (list, tuple) and type(attr_b) in (list, tuple):
+                    if len(attr_a) != len(attr_b):
+                        return False
                     for a, b in zip(attr_a, attr_b):
                         if a != b:
                             return False
@@ -247,25 +538,107 @@ class AstNode(object):
             return False
 
     def __eq__(self, other):
-        return self.equals(other) if isinstance(other, self.__class__) else False
+        if self is other:
+            return True
+        elif isinstance(other, self.__class__):
+            return hash(self) == hash(other) and self.equals(other)
+        else:
+            return False
+
+    def __hash__(self):
+        try:
+            return object.__getattribute__(self, '_hash')
+        except AttributeError:
+            result = hash((self.__class__, self.get_hash_key()))
+            self._hash = result
+            return result
+
+    def __getstate__(self):
+        # The cached hash depends on the process (string hashing is randomised) and must not be pickled or copied
+        return None, { name: getattr(self, name) for name in self._fields + self._optional_attributes
+                       if _is_slot_set(self, name) }
+
+    def get_hash_key(self):
+        """
+        Returns a hashable value representing the structure of this node, from which the structural hash is
+        computed. Nodes that are equal (see `equals`) must return keys with the same hash. Nodes that override
+        `equals` therefore also override this method.
+        """
+        return tuple([_hashable(getattr(self, name, None)) for name in self._fields])
+
+    def clear_hash(self):
+        """
+        Clears the cached structural hash of this node. This is only necessary if a field of the node is modified in
+        place; note that the hashes of the ancestors of the node are not cleared.
+        """
+        try:
+            del self._hash
+        except AttributeError:
+            pass
+
+    def clear_type_cache(self):
+        """
+        Clears the type cached by the type inference (see `TypeInferencer`). As with `clear_hash`, this is only
+        necessary if a field of the node is modified in place.
+        """
+        try:
+            del self._type_cache
+        except AttributeError:
+            pass
 
     def clone(self, **kwargs):
-        init_method = getattr(self, '__init__', None)
-        if init_method is not None:
-            args = { arg: getattr(self, arg, None) for arg in _inspect.getfullargspec(init_method).args if arg != 'self' }
-            for arg in args:
-                if arg in kwargs:
-                    args[arg] = kwargs[arg]
-            result = self.__class__(**args)
-        else:
-            result = self.__class__()
-        fields = set(self.__dict__).difference(set(result.__dict__))
-        for field in fields:
-            setattr(result, field, getattr(self, field))
+        """
+        Creates a copy of this node by calling the constructor with the current values of its arguments, where
+        the values given in `kwargs` replace the current ones. Any fields or attributes that are not arguments of
+        the constructor are set after creating the node.
+
+        The names of the constructor's arguments are determined once for each class (see `_get_clone_plan`).
+        """
+        args = { arg: kwargs[arg] if arg in kwargs else getattr(self, arg, None)
+                 for arg in _get_clone_plan(self.__class__) }
+        result = self.__class__(**args)
+        # The declared fields are set by `__init__`, but the optional attributes have to be copied
+        for field in AstNode._optional_attributes:
+            try:
+                value = object.__getattribute__(self, field)
+            except AttributeError:
+                continue
+            if not _is_slot_set(result, field):
+                setattr(result, field, value)
         for key in kwargs:
             setattr(result, key, kwargs[key])
         return result
 
+    def with_fields(self, **fields):
+        """
+        Returns a copy of this node, in which the given fields are replaced by new values. In contrast to `clone`,
+        the constructor is not called, but all fields and attributes are copied directly, so that the new values
+        are not checked or normalised. Fields derived from other fields (such as `index_n` of a subscript) are
+        updated by `update_derived_fields`.
+
+        :param fields:  The fields to replace, e.g., `node.with_fields(left=left, right=right)`.
+        :return:        A new node of the same class.
+        """
+        cls = self.__class__
+        result = cls.__new__(cls)
+        for name in cls._fields + AstNode._optional_attributes:
+            try:
+                value = object.__getattribute__(self, name)
+            except AttributeError:
+                continue
+            setattr(result, name, value)
+        for key in fields:
+            setattr(result, key, fields[key])
+        result.update_derived_fields()
+        return result
+
+    def update_derived_fields(self):
+        """
+        Recomputes the fields that are derived from other fields of the node (called by `with_fields`). Classes
+        with such fields override this method.
+        """
+        pass
+
 
 class Visitor(object):
     """
@@ -301,6 +674,14 @@ class Visitor(object):
 #######################################################################################################################
 
 class Scope(object):
+    """
+    A scope holds the bindings of one level of nesting, and refers to the enclosing scope through `prev`.
+
+    All scopes of a chain share one flat environment `env`, which maps each name to the stack of scopes that bind (or
+    protect) the name, with the innermost scope last. Resolving a name is therefore a dictionary lookup rather than a
+    walk along the `prev`-chain. When a scope is left, it must be closed (see `close`), so that its names are removed
+    from the shared environment again. A closed scope still resolves names by walking its `prev`-chain.
+    """
 
     def __init__(self, prev, name:Optional[str]=None, lineno:Optional[int]=None):
         self.prev = prev
@@ -311,24 +692,60 @@ class Scope(object):
         assert prev is None or isinstance(prev, Scope)
         assert name is None or type(name) is str
         assert lineno is None or type(lineno) is int
+        if prev is not None:
+            self.level = prev.level + 1
+            self.env = prev.env if prev.is_open else None
+        else:
+            self.level = 1
+            self.env = {}
+        self.is_open = self.env is not None
+
+    def _register(self, name:str):
+        stack = self.env.get(name)
+        if stack is None:
+            self.env[name] = [self]
+        elif stack[-1].level < self.level:
+            stack.append(self)
+        else:
+            # Defining a name in an enclosing scope (e.g., globally) while inner scopes are still open
+            i = len(stack)
+            while i > 0 and stack[i-1].level > self.level:
+                i -= 1
+            stack.insert(i, self)
 
     def define(self, name:str, value):
         assert type(name) is str and str != '' and str != '_'
+        if self.is_open and name not in self.bindings and name not in self.protected_names:
+            self._register(name)
         self.bindings[name] = value
 
     def define_protected(self, name:str):
         assert type(name) is str and str != '' and str != '_'
+        if self.is_open and name not in self.bindings and name not in self.protected_names:
+            self._register(name)
         self.protected_names.add(name)
 
     def resolve(self, name:str):
-        if name in self.protected_names:
+        if not self.is_open:
+            scope = self
+            while scope is not None:
+                if name in scope.protected_names:
+                    return None
+                elif name in scope.bindings:
+                    return scope.bindings[name]
+                scope = scope.prev
             return None
-        elif name in self.bindings:
-            return self.bindings[name]
-        elif self.prev is not None:
-            return self.prev.resolve(name)
-        else:
+        stack = self.env.get(name)
+        if stack is None:
             return None
+        scope = stack[-1]
+        if scope.level > self.level:
+            for scope in reversed(stack):
+                if scope.level <= self.level:
+                    break
+            else:
+                return None
+        return scope.resolve_locally(name)
 
     def resolve_locally(self, name:str):
         if name in self.protected_names:
@@ -336,13 +753,24 @@ class Scope(object):
         else:
             return self.bindings.get(name, None)
 
+    def close(self):
+        """
+        Removes the names of this scope from the shared environment. Call this when leaving the scope.
+        """
+        if self.is_open:
+            self.is_open = False
+            env = self.env
+            for name in set.union(set(self.bindings), self.protected_names):
+                stack = env[name]
+                if stack[-1] is self:
+                    stack.pop()
+                else:
+                    stack.remove(self)
+                if len(stack) == 0:
+                    del env[name]
+
     def depth(self):
-        result = 1
-        p = self.prev
-        while p is not None:
-            result += 1
-            p = p.prev
-        return result
+        return self.level
 
 
 class ScopeContext(object):
@@ -362,20 +790,23 @@ class ScopeContext(object):
 
 
 class ScopedVisitor(Visitor):
+    """
+    Scopes may be nested arbitrarily deep: names are resolved through the flat environment shared by all open scopes
+    (see `Scope`), so that the time for resolving a name does not depend on the depth.
+    """
 
     def __init__(self):
         self.scope = Scope(None)
         self.global_scope = self.scope
-        self.MAX_SCOPE_DEPTH = 100
 
     def enter_scope(self, name:Optional[str]=None):
-        if self.scope.depth() >= self.MAX_SCOPE_DEPTH:
-            raise RuntimeError("exceeding max scope depth")
         self.scope = Scope(self.scope, name)
 
     def leave_scope(self):
-        self.scope = self.scope.prev
+        scope = self.scope
+        self.scope = scope.prev
         assert(self.scope is not None)
+        scope.close()
 
     def create_scope(self, name:Optional[str]=None):
         self.enter_scope(name)
@@ -426,13 +857,13 @@ class ScopedVisitor(Visitor):
 #######################################################################################################################
 
 class AstControl(AstNode):
-    pass
+    __slots__ = ()
 
 class AstLeaf(AstNode):
-    pass
+    __slots__ = ()
 
 class AstOperator(AstNode):
-    pass
+    __slots__ = ()
 
 #######################################################################################################################
 
@@ -446,6 +877,9 @@ class BodyContext(enum.Enum):
 
 class AstAttribute(AstNode):
 
+    _fields = ('base', 'attr')
+    __slots__ = _fields
+
     def __init__(self, base:AstNode, attr:str):
         self.base = base
         self.attr = attr
@@ -458,6 +892,9 @@ class AstAttribute(AstNode):
 
 class AstBinary(AstOperator):
 
+    _fields = ('left', 'op', 'right')
+    __slots__ = _fields
+
     __binary_ops = {
         '+':  ('add',  lambda x, y: x + y),
         '-':  ('sub',  lambda x, y: x - y),
@@ -485,6 +922,9 @@ class AstBinary(AstOperator):
     def __repr__(self):
         return "({} {} {})".format(repr(self.left), self.op, repr(self.right))
 
+    def get_visitor_key(self):
+        return self.op
+
     def get_visitor_names(self):
         name = 'visit_binary_' + self.op_name
         return [name] + super(AstBinary, self).get_visitor_names()
@@ -498,16 +938,19 @@ class AstBinary(AstOperator):
         return self.__binary_ops[self.op][0]
 
     def equals(self, node):
-        if self.op == node.op:
-            if self.left == node.left and self.right == node.right:
-                return True
-            elif self.op in ('+', '*', 'and', 'or') and self.left == node.right and self.right == node.left:
-                return True
-        return False
+        # The operands are compared in order: `+` is not commutative for strings and lists, and `and`/`or`
+        # evaluate their right operand only depending on the left one
+        return self.op == node.op and self.left == node.left and self.right == node.right
+
+    def get_hash_key(self):
+        return self.op, self.left, self.right
 
 
 class AstBody(AstNode):
 
+    _fields = ('items', 'context')
+    __slots__ = _fields
+
     def __init__(self, items:Optional[list], context:BodyContext=None):
         if items is None:
             items = []
@@ -545,6 +988,9 @@ class AstBody(AstNode):
         else:
             return False
 
+    def get_hash_key(self):
+        return tuple(self.items)
+
     @property
     def is_empty(self):
         return len(self.items) == 0
@@ -563,6 +1009,9 @@ class AstBody(AstNode):
 
 class AstBreak(AstNode):
 
+    _fields = ()
+    __slots__ = _fields
+
     def __repr__(self):
         return "break"
 
@@ -572,9 +1021,15 @@ class AstBreak(AstNode):
     def equals(self, _):
         return True
 
+    def get_hash_key(self):
+        return None
+
 
 class AstCall(AstNode):
 
+    _fields = ('function', 'args', 'keywords', 'is_builtin')
+    __slots__ = _fields
+
     def __init__(self, function:AstNode, args:list, keywords:Optional[list]=None, is_builtin:bool=False):
         if keywords is None:
             keywords = []
@@ -594,6 +1049,13 @@ class AstCall(AstNode):
         args = [a + b for a, b in zip(keywords, args)]
         return "{}({})".format(repr(self.function), ', '.join(args))
 
+    def get_visitor_key(self):
+        name = self.function_name
+        if name is not None:
+            return name, self.is_builtin, self.function_module
+        else:
+            return None
+
     def get_visitor_names(self):
         name = self.function_name
         if name is not None:
@@ -675,6 +1137,9 @@ class AstCall(AstNode):
         else:
             return False
 
+    def get_hash_key(self):
+        return self.function, tuple(self.args), tuple(self.keywords)
+
     def add_keywords_to_args(self, args: list):
         if len(self.keywords) > 0:
             kw = [''] * (len(args) - len(self.keywords)) + [item+'=' for item in self.keywords]
@@ -698,6 +1163,9 @@ class AstCall(AstNode):
 
 class AstCompare(AstOperator):
 
+    _fields = ('left', 'op', 'right', 'second_op', 'second_right')
+    __slots__ = _fields
+
     __cmp_ops = {
         '==': ('eq', lambda x, y: x == y, '!='),
         '!=': ('ne', lambda x, y: x != y, '=='),
@@ -734,6 +1202,9 @@ class AstCompare(AstOperator):
         else:
             return "({} {} {})".format(repr(self.left), self.op, repr(self.right))
 
+    def get_visitor_key(self):
+        return self.op, self.second_op
+
     def get_visitor_names(self):
         if self.second_op is not None:
             name = 'visit_ternary_' + self.op_name + '_' + self.op_name_2
@@ -768,6 +1239,9 @@ class AstCompare(AstOperator):
 
 class AstDef(AstNode):
 
+    _fields = ('name', 'value', 'global_context')
+    __slots__ = _fields
+
     _attributes = {'col_offset', 'lineno', 'original_name'}
 
     def __init__(self, name:str, value:AstNode, global_context:bool=True, original_name:Optional[str]=None):
@@ -792,6 +1266,9 @@ class AstDef(AstNode):
 
 class AstDict(AstNode):
 
+    _fields = ('items',)
+    __slots__ = _fields
+
     def __init__(self, items:dict):
         self.items = items
         assert type(items) is dict
@@ -814,9 +1291,15 @@ class AstDict(AstNode):
         else:
             return False
 
+    def get_hash_key(self):
+        return _hashable(self.items)
+
 
 class AstFor(AstControl):
 
+    _fields = ('target', 'source', 'body', 'original_target')
+    __slots__ = _fields
+
     def __init__(self, target:str, source:AstNode, body:AstNode, original_target:Optional[str]=None):
         self.target = target
         self.source = source
@@ -832,6 +1315,9 @@ class AstFor(AstControl):
 
 class AstFunction(AstNode):
 
+    _fields = ('name', 'parameters', 'body', 'vararg', 'defaults', 'doc_string', 'param_names', 'f_locals')
+    __slots__ = _fields
+
     def __init__(self, name:Optional[str], parameters:list, body:AstNode, *, vararg:Optional[str]=None,
                  defaults:Optional[list]=None, doc_string:Optional[str]=None, f_locals:Optional[set]=None):
         if name is None:
@@ -846,7 +1332,7 @@ class AstFunction(AstNode):
         self.vararg = vararg
         self.defaults = defaults
         self.doc_string = doc_string
-        self.param_names = set(parameters + [vararg] if vararg is not None else parameters)
+        self.update_derived_fields()
         self.f_locals = f_locals
         assert type(name) is str and name != ''
         assert type(parameters) is list and all([type(p) is str for p in parameters])
@@ -863,6 +1349,9 @@ class AstFunction(AstNode):
             params.append('*' + self.vararg)
         return "{}({}): ({})".format(self.name, ', '.join(params), repr(self.body))
 
+    def update_derived_fields(self):
+        self.param_names = set(self.parameters + [self.vararg] if self.vararg is not None else self.parameters)
+
     def order_arguments(self, arguments: list, keywords: list):
         parameters = self.parameters
         arg_count = len(arguments)
@@ -920,6 +1409,9 @@ class AstFunction(AstNode):
 
 class AstIf(AstControl):
 
+    _fields = ('test', 'if_node', 'else_node', 'cond_name')
+    __slots__ = _fields
+
     def __init__(self, test:AstNode, if_node:AstNode, else_node:Optional[AstNode]=None, cond_name:Optional[str]=None):
         if else_node is None:
             else_node = AstValue(None)
@@ -988,6 +1480,9 @@ class AstIf(AstControl):
 
 class AstImport(AstNode):
 
+    _fields = ('module_name', 'imported_names', 'alias')
+    __slots__ = _fields
+
     def __init__(self, module_name:str, imported_names:Optional[list]=None, alias:Optional[str]=None):
         self.module_name = module_name
         self.imported_names = imported_names
@@ -1008,6 +1503,9 @@ class AstImport(AstNode):
 
 class AstLet(AstNode):
 
+    _fields = ('target', 'source', 'body', 'original_target')
+    __slots__ = _fields
+
     def __init__(self, target:str, source:AstNode, body:AstNode, original_target:Optional[str]=None):
         self.target = target
         self.source = source
@@ -1030,6 +1528,9 @@ class AstLet(AstNode):
 
 class AstListFor(AstNode):
 
+    _fields = ('target', 'source', 'expr', 'test', 'original_target')
+    __slots__ = _fields
+
     def __init__(self, target:str, source:AstNode, expr:AstNode, test:Optional[AstNode]=None,
                  original_target:Optional[str]=None):
         self.target = target
@@ -1051,6 +1552,9 @@ class AstListFor(AstNode):
 
 class AstMultiSlice(AstNode):
 
+    _fields = ('base', 'indices')
+    __slots__ = _fields
+
     def __init__(self, base:AstNode, indices:list):
         self.base = base
         self.indices = indices
@@ -1069,6 +1573,9 @@ class AstMultiSlice(AstNode):
 
 class AstNamespace(AstNode):
 
+    _fields = ('name', 'bindings')
+    __slots__ = _fields
+
     def __init__(self, name: str, bindings: dict):
         self.name = name
         self.bindings = bindings
@@ -1084,19 +1591,36 @@ class AstNamespace(AstNode):
 
 class AstObserve(AstNode):
 
-    def __init__(self, dist:AstNode, value:AstNode):
+    """
+    Observes the `value` as a sample from the distribution `dist`. If a `size` is given, the observe-statement
+    represents a plate: the `value` is then a sequence of `size` independent observations from the same
+    distribution, which is compiled into a single vertex instead of `size` individual vertices.
+    """
+
+    _fields = ('dist', 'value', 'size')
+    __slots__ = _fields
+
+    def __init__(self, dist:AstNode, value:AstNode, size:Optional[AstNode]=None):
         self.dist = dist
         self.value = value
+        self.size = size
         assert isinstance(self.dist, AstNode)
         assert isinstance(self.value, AstNode)
+        assert size is None or isinstance(size, AstNode)
 
     def __repr__(self):
-        return "observe({}, {})".format(repr(self.dist), repr(self.value))
+        if self.size is None:
+            return "observe({}, {})".format(repr(self.dist), repr(self.value))
+        else:
+            return "observe({}, {}, size={})".format(repr(self.dist), repr(self.value), repr(self.size))
 
 
 
 class AstReturn(AstNode):
 
+    _fields = ('value',)
+    __slots__ = _fields
+
     def __init__(self, value:AstNode):
         if value is None:
             value = AstValue(None)
@@ -1112,6 +1636,9 @@ class AstReturn(AstNode):
 
 class AstSample(AstNode):
 
+    _fields = ('dist', 'size')
+    __slots__ = _fields
+
     def __init__(self, dist: AstNode, size: Optional[AstNode]=None):
         self.dist = dist
         self.size = size
@@ -1127,6 +1654,9 @@ class AstSample(AstNode):
 
 class AstSlice(AstNode):
 
+    _fields = ('base', 'start', 'stop')
+    __slots__ = _fields
+
     def __init__(self, base:AstNode, start:Optional[AstNode], stop:Optional[AstNode]):
         self.base = base
         self.start = start
@@ -1159,14 +1689,14 @@ class AstSlice(AstNode):
 
 class AstSubscript(AstNode):
 
+    _fields = ('base', 'index', 'default', 'index_n')
+    __slots__ = _fields
+
     def __init__(self, base:AstNode, index:AstNode, default:Optional[AstNode]=None):
         self.base = base
         self.index = index
         self.default = default
-        if isinstance(index, AstValue):
-            self.index_n = int(index.value) if type(index.value) in [int, bool] else None
-        else:
-            self.index_n = None
+        self.update_derived_fields()
         assert isinstance(base, AstNode)
         assert isinstance(index, AstNode)
         assert default is None or isinstance(default, AstNode)
@@ -1177,6 +1707,12 @@ class AstSubscript(AstNode):
         else:
             return "{}[{}]".format(repr(self.base), repr(self.index))
 
+    def update_derived_fields(self):
+        if isinstance(self.index, AstValue):
+            self.index_n = int(self.index.value) if type(self.index.value) in [int, bool] else None
+        else:
+            self.index_n = None
+
     @property
     def index_as_int(self):
         if isinstance(self.index, AstValue):
@@ -1187,6 +1723,9 @@ class AstSubscript(AstNode):
 
 class AstSymbol(AstLeaf):
 
+    _fields = ('name', 'import_source', 'protected', 'symbol', 'node', 'predef')
+    __slots__ = _fields
+
     def __init__(self, name:str, import_source:Optional[str]=None, protected:bool=False, node=None, predef=False,
                  original_name:Optional[str]=None):
         if original_name is None:
@@ -1212,6 +1751,9 @@ class AstSymbol(AstLeaf):
     def equals(self, node):
         return self.name == node.name
 
+    def get_hash_key(self):
+        return self.name
+
     @property
     def is_readonly(self):
         if self.symbol is not None:
@@ -1229,6 +1771,9 @@ class AstSymbol(AstLeaf):
 
 class AstUnary(AstOperator):
 
+    _fields = ('op', 'item')
+    __slots__ = _fields
+
     __unary_ops = {
         '+':   ('plus',  lambda x: x),
         '-':   ('minus', lambda x: -x),
@@ -1244,6 +1789,9 @@ class AstUnary(AstOperator):
     def __repr__(self):
         return "{}{}".format(self.op, repr(self.item))
 
+    def get_visitor_key(self):
+        return self.op
+
     def get_visitor_names(self):
         name = 'visit_unary_' + self.op_name
         return [name] + super(AstUnary, self).get_visitor_names()
@@ -1259,6 +1807,9 @@ class AstUnary(AstOperator):
 
 class AstValue(AstLeaf):
 
+    _fields = ('value',)
+    __slots__ = _fields
+
     def __init__(self, value):
         self.value = value
         assert value is None or type(value) in [bool, complex, float, int, str]
@@ -1267,12 +1818,33 @@ class AstValue(AstLeaf):
         return repr(self.value)
 
     def equals(self, other):
-        return self.value == other.value
+        # `1`, `1.0` and `True` compare equal in Python, but are not interchangeable in the generated code
+        return type(self.value) is type(other.value) and self.value == other.value
+
+    def get_hash_key(self):
+        return type(self.value), self.value
 
 
 class AstValueVector(AstLeaf):
+    """
+    A vector of plain values, i.e. a data literal such as `[1.5, 2.0, 3.25]`.
 
-    def __init__(self, items:list):
+    Long vectors, whose items are either all floats or all integers, are packed into an `array` with typecode
+    `'d'` or `'q'`, respectively (see `pack_values`). Packed vectors keep the data in a single buffer, which can be
+    handed on to the graph's `DataNode` as it is, without creating an object for each element.
+    """
+
+    _fields = ('items',)
+    __slots__ = _fields
+
+    # The minimal length of a vector to be packed; shorter vectors remain lists
+    packing_threshold = 64
+
+    def __init__(self, items):
+        if type(items) is list and len(items) >= self.packing_threshold:
+            items = pack_values(items)
+        elif type(items) is _array and len(items) < self.packing_threshold:
+            items = items.tolist()
         self.items = items
 
         def is_value_vector(v):
@@ -1281,10 +1853,12 @@ class AstValueVector(AstLeaf):
             else:
                 return type(v) in [bool, complex, float, int, str]
 
-        assert type(items) is list and is_value_vector(items)
+        assert (type(items) is _array and items.typecode in ('d', 'q')) or \
+               (type(items) is list and is_value_vector(items))
 
     def __getitem__(self, item):
-        return AstValue(self.items[item])
+        result = self.items[item]
+        return AstValue(result.tolist() if type(result) is _array else result)
 
     def __len__(self):
         return len(self.items)
@@ -1293,13 +1867,13 @@ class AstValueVector(AstLeaf):
         return (AstValue(item) for item in self.items)
 
     def __repr__(self):
-        return repr(self.items)
+        return repr(self.value)
 
     def conj(self, element):
         if type(element) in [bool, complex, float, int, str]:
-            return AstValueVector(self.items + [element])
+            return AstValueVector(self.value + [element])
         elif isinstance(element, AstValue):
-            return AstValueVector(self.items + [element.value])
+            return AstValueVector(self.value + [element.value])
         elif isinstance(element, AstNode):
             return AstVector([AstValue(item) for item in self.items] + [element])
         else:
@@ -1307,16 +1881,19 @@ class AstValueVector(AstLeaf):
 
     def cons(self, element):
         if type(element) in [bool, complex, float, int, str]:
-            return AstValueVector([element] + self.items)
+            return AstValueVector([element] + self.value)
         elif isinstance(element, AstValue):
-            return AstValueVector([element.value] + self.items)
+            return AstValueVector([element.value] + self.value)
         elif isinstance(element, AstNode):
             return AstVector([AstValue(element)] + [AstValue(item) for item in self.items])
         else:
             return AstCall(AstSymbol('cons'), [element, self])
 
     def equals(self, other):
-        return all([i == j for i, j in zip(self.items, other.items)])
+        return _value_key(self.items) == _value_key(other.items)
+
+    def get_hash_key(self):
+        return _value_key(self.items)
 
     def to_vector(self):
         return AstVector([AstValue(item) for item in self.items])
@@ -1325,17 +1902,40 @@ class AstValueVector(AstLeaf):
     def is_empty(self):
         return len(self.items) == 0
 
+    @property
+    def is_packed(self):
+        return type(self.items) is _array
+
     @property
     def non_empty(self):
         return len(self.items) != 0
 
     @property
     def value(self):
-        return self.items
+        return self.items.tolist() if type(self.items) is _array else self.items
+
+
+def pack_values(values: list):
+    """
+    Packs a list of numbers into an `array` with typecode `'d'` if all numbers are floats, or `'q'` if all numbers
+    are integers (that fit into 64 bits). Any other list is returned unchanged.
+    """
+    types = set(map(type, values))
+    if types == {float}:
+        return _array('d', values)
+    elif types == {int}:
+        try:
+            return _array('q', values)
+        except OverflowError:
+            pass
+    return values
 
 
 class AstVector(AstNode):
 
+    _fields = ('items',)
+    __slots__ = _fields
+
     def __init__(self, items:list):
         self.items = items
         assert type(items) is list and all([isinstance(item, AstNode) for item in items])
@@ -1379,6 +1979,9 @@ class AstVector(AstNode):
 
 class AstWhile(AstControl):
 
+    _fields = ('test', 'body')
+    __slots__ = _fields
+
     def __init__(self, test:AstCompare, body:AstNode):
         self.test = test
         self.body = body
@@ -1391,6 +1994,50 @@ class AstWhile(AstControl):
 
 #######################################################################################################################
 
+class InternTable(object):
+    """
+    An (optional) table for hash-consing AST-nodes: `intern` returns a canonical node for every structure, so that
+    structurally equal subtrees share one object and can be compared by identity.
+
+    Note that "structurally equal" follows `==`, i.e. `b + a` is replaced by `a + b` if the latter was interned
+    first. Attributes such as the line number are taken from the first node with a given structure.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def clear(self):
+        self.nodes.clear()
+
+    def intern(self, node):
+        if not isinstance(node, AstNode):
+            return node
+        result = self.nodes.get(node)
+        if result is not None:
+            return result
+        changes = {}
+        for name in node._fields:
+            field = getattr(node, name, None)
+            if isinstance(field, AstNode):
+                item = self.intern(field)
+                if item is not field:
+                    changes[name] = item
+            elif type(field) in (list, tuple):
+                items = [self.intern(item) for item in field]
+                if any([a is not b for a, b in zip(items, field)]):
+                    changes[name] = type(field)(items)
+        if len(changes) > 0:
+            node = node.clone(**changes)
+        self.nodes[node] = node
+        return node
+
+
 _temp_var_counter = 1000
 
 def generate_cond_var():
@@ -1403,6 +2050,21 @@ def generate_temp_var():
     _temp_var_counter += 1
     return "__tmp_{}__".format(_temp_var_counter)
 
+def is_temp_var(name: str):
+    """
+    Checks whether the name is a temporary variable created by `generate_temp_var`.
+    """
+    return name.startswith('__tmp_') and name.endswith('__') and name[6:-2].isdigit()
+
+def reset_temp_var_counter(value: int=1000):
+    """
+    Sets the counter used to generate temporary names and returns its previous value.
+    """
+    global _temp_var_counter
+    result = _temp_var_counter
+    _temp_var_counter = value
+    return result
+
 
 def makeBody(*items):
     b_items = []
@@ -1563,7 +2225,10 @@ def makeLet(targets:list, sources:list, body:AstNode, original_target:Optional[s
         return AstLet(targets[0], sources[0], body, original_target=original_target)
 
     else:
-        return makeLet(targets[:-1], sources[:-1], AstLet(targets[-1], sources[-1], body))
+        # The bindings are nested from the innermost one outwards in a loop, as there might be many of them
+        for target, source in zip(reversed(targets[1:]), reversed(sources[1:])):
+            body = AstLet(target, source, body)
+        return makeLet(targets[:1], sources[:1], body)
 
 
 def makeListFor(target, source, expr, test=None):
@@ -147,91 +147,101 @@ class NodeInfo(object):
 
 
 class InfoAnnotator(Visitor):
+    """
+    The visit-methods are generators (see `AstNode.visit`), so that the information can be collected for deeply
+    nested ASTs.
+    """
 
     def visit_node(self, node:AstNode):
         return NodeInfo()
 
     def visit_attribute(self, node: AstAttribute):
-        return NodeInfo(base=self.visit(node.base), free_vars={node.attr})
+        return NodeInfo(base=(yield node.base), free_vars={node.attr})
 
     def visit_binary(self, node: AstBinary):
-        return NodeInfo(base=(self.visit(node.left), self.visit(node.right)))
+        return NodeInfo(base=((yield node.left), (yield node.right)))
 
     def visit_body(self, node: AstBody):
-        return NodeInfo(base=[self.visit(item) for item in node.items])
+        return NodeInfo(base=(yield node.items))
 
     def visit_break(self, _):
         return NodeInfo(has_break=True)
 
     def visit_call(self, node: AstCall):
-        base = [self.visit(node.function)]
-        args = [self.visit(arg) for arg in node.args]
-        return NodeInfo(base=base + args)
+        base = [(yield node.function)]
+        args = yield node.args
+        result = NodeInfo(base=base + args)
+        name = get_modified_list(node)
+        if name is not None:
+            result = result.change_var(name)
+        return result
 
     def visit_compare(self, node: AstCompare):
-        return NodeInfo(base=[self.visit(node.left), self.visit(node.right), self.visit(node.second_right)])
+        return NodeInfo(base=[(yield node.left), (yield node.right), (yield node.second_right)])
 
     def visit_def(self, node: AstDef):
-        result = self.visit(node.value)
+        result = yield node.value
         return result.change_var(node.name)
 
     def visit_dict(self, node: AstDict):
-        return NodeInfo(base=[self.visit(node.items[key]) for key in node.items])
+        items = yield node.items
+        return NodeInfo(base=[items[key] for key in items])
 
     def visit_for(self, node: AstFor):
-        source = self.visit(node.source)
-        body = self.visit(node.body).bind_var(node.target)
+        source = yield node.source
+        body = (yield node.body).bind_var(node.target)
         return NodeInfo(base=[body, source])
 
     def visit_function(self, node: AstFunction):
-        body = self.visit(node.body)
+        body = yield node.body
         return body.bind_var(node.parameters).bind_var(node.vararg)
 
     def visit_if(self, node: AstIf):
         if node.has_else:
-            base = [self.visit(node.if_node), self.visit(node.else_node)]
+            base = [(yield node.if_node), (yield node.else_node)]
         else:
-            base = [self.visit(node.if_node)]
+            base = [(yield node.if_node)]
         cond_vars = set.union(*[item.changed_vars for item in base])
-        return NodeInfo(base=base + [self.visit(node.test)], cond_vars=cond_vars, has_cond=True)
+        return NodeInfo(base=base + [(yield node.test)], cond_vars=cond_vars, has_cond=True)
 
     def visit_import(self, _):
         return NodeInfo()
 
     def visit_let(self, node: AstLet):
-        result = self.visit(node.body).bind_var(node.target)
-        result = result.union(self.visit(node.source))
+        result = (yield node.body).bind_var(node.target)
+        result = result.union((yield node.source))
         return result
 
     def visit_list_for(self, node: AstListFor):
-        source = self.visit(node.source)
-        expr = self.visit(node.expr).bind_var(node.target)
-        return NodeInfo(base=[expr, source])
+        source = yield node.source
+        expr = (yield node.expr).bind_var(node.target)
+        test = (yield node.test).bind_var(node.target) if node.test is not None else None
+        return NodeInfo(base=[expr, source, test])
 
     def visit_observe(self, node: AstObserve):
-        return NodeInfo(base=[self.visit(node.dist), self.visit(node.value)], has_observe=True)
+        return NodeInfo(base=[(yield node.dist), (yield node.value)], has_observe=True)
 
     def visit_return(self, node: AstReturn):
-        return NodeInfo(base=self.visit(node.value), has_return=True, return_count=1)
+        return NodeInfo(base=(yield node.value), has_return=True, return_count=1)
 
     def visit_sample(self, node: AstSample):
-        return NodeInfo(base=self.visit(node.dist), has_sample=True)
+        return NodeInfo(base=(yield node.dist), has_sample=True)
 
     def visit_slice(self, node: AstSlice):
-        base = [self.visit(node.base),
-                self.visit(node.start),
-                self.visit(node.stop)]
+        base = [(yield node.base),
+                (yield node.start),
+                (yield node.stop)]
         return NodeInfo(base=base)
 
     def visit_subscript(self, node: AstSubscript):
-        base = [self.visit(node.base), self.visit(node.index)]
+        base = [(yield node.base), (yield node.index)]
         return NodeInfo(base=base)
 
     def visit_symbol(self, node: AstSymbol):
         return NodeInfo(free_vars={node.name})
 
     def visit_unary(self, node: AstUnary):
-        return self.visit(node.item)
+        return (yield node.item)
 
     def visit_value(self, _):
         return NodeInfo()
@@ -240,10 +250,10 @@ class InfoAnnotator(Visitor):
         return NodeInfo()
 
     def visit_vector(self, node: AstVector):
-        return NodeInfo(base=[self.visit(item) for item in node.items])
+        return NodeInfo(base=(yield node.items))
 
     def visit_while(self, node: AstWhile):
-        base = [self.visit(node.test), self.visit(node.body)]
+        base = [(yield node.test), (yield node.body)]
         return NodeInfo(base=base, has_side_effects=True)
 
 
@@ -273,4 +283,74 @@ def get_info(ast:AstNode) -> NodeInfo:
 def count_variable_usage(name:str, ast:AstNode):
     vcv = VarCountVisitor(name)
     vcv.visit(ast)
-    return vcv.count
\ No newline at end of file
+    return vcv.count
+
+def get_plate_observe(target:str, body:AstNode) -> Optional[AstObserve]:
+    """
+    Checks whether a loop `for target in ...: body` is a plate, i.e. whether its iterations are independent
+    observations of the loop variable from one and the same distribution. The body must consist of an observe-statement
+    `observe(dist, target)`, possibly preceded by definitions of (temporary) variables used inside `dist`. Neither
+    the distribution nor the definitions may depend on the loop variable, sample anything or have side effects.
+
+    Returns the observe-statement if the loop is a plate, and `None` otherwise.
+    """
+    items = body.items if isinstance(body, AstBody) else [body]
+    if len(items) == 0:
+        return None
+    observe = items[-1]
+    if not (isinstance(observe, AstObserve) and observe.size is None and
+            isinstance(observe.value, AstSymbol) and observe.value.name == target):
+        return None
+    for item in items[:-1]:
+        if not isinstance(item, AstDef) or item.name == target:
+            return None
+    for item in items[:-1] + [observe.dist]:
+        info = get_info(item.value if isinstance(item, AstDef) else item)
+        if not info.can_embed or target in info.free_vars:
+            return None
+    return observe
+
+
+# Deterministic loops over more items than this are not unrolled, but kept as loops (see `can_keep_loop`)
+DEFAULT_UNROLL_THRESHOLD = 1000
+
+def can_keep_loop(loop:AstNode, size:int, threshold:int) -> bool:
+    """
+    Checks whether a loop over `size` items can be kept as a loop, rather than being unrolled. This is the case for
+    loops over more than `threshold` items, which neither sample nor observe anything, and thus do not contribute
+    any vertices to the graph. Conditionals are excluded as well, since they would require nodes of their own.
+
+    The variables assigned by a `for`-statement, other than its targets, carry their values from one iteration to
+    the next and out of the loop (see `get_loop_vars`).
+    """
+    if size is None or size <= threshold:
+        return False
+    return is_deterministic_loop(loop)
+
+def is_deterministic_loop(loop:AstNode) -> bool:
+    """
+    Checks whether the loop neither samples nor observes anything, and contains neither conditionals nor a `return`.
+    """
+    info = get_info(loop)
+    return not (info.has_sample or info.has_observe or info.has_cond or info.has_return)
+
+def get_loop_vars(loop:AstFor) -> set:
+    """
+    Returns the names of the variables assigned (or modified as lists) by the body of the loop, except for the
+    targets of the loop and temporary variables (see `generate_temp_var`), which are always defined before they
+    are used.
+    """
+    return set([name for name in get_info(loop).changed_vars if not is_temp_var(name)])
+
+
+# Methods of lists, which modify the list given as their first argument
+_list_modifiers = ('list.append', 'list.extend', 'list.insert', 'list.remove')
+
+def get_modified_list(node:AstNode) -> Optional[str]:
+    """
+    Returns the name of the list modified by a call such as `xs.append(x)`, and `None` if the node is not such a call.
+    """
+    if isinstance(node, AstCall) and isinstance(node.function, AstSymbol) and \
+            node.function.name in _list_modifiers and len(node.args) > 0 and isinstance(node.args[0], AstSymbol):
+        return node.args[0].name
+    return None
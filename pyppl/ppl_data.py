@@ -0,0 +1,181 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+import os
+import struct
+import zipfile
+from typing import Optional
+from .ppl_ast import AstSymbol
+from .types import ppl_types
+
+# NumPy is only needed to load data from `.npy`- and `.npz`-files, but not for the compiler itself.
+try:
+    import numpy as _np
+except ModuleNotFoundError:
+    _np = None
+
+
+def load_data(filename: str, name: Optional[str]=None):
+    """
+    Opens the array stored in a NumPy `.npy`-file, or the array `name` in an `.npz`-archive, as a read-only memory-
+    mapped array. The data is thus only read from disk when it is actually accessed, and several processes using
+    the same file share the same pages. Arrays inside compressed archives cannot be mapped and are read entirely.
+
+    If `name` is not found in an archive, which contains a single array, that array is returned instead.
+    """
+    if _np is None:
+        raise ImportError("loading data from '{}' requires numpy".format(filename))
+    filename = os.fspath(filename)
+    if filename.endswith('.npy'):
+        return _np.load(filename, mmap_mode='r')
+
+    elif filename.endswith('.npz'):
+        with zipfile.ZipFile(filename) as archive:
+            members = [item for item in archive.namelist() if item.endswith('.npy')]
+            if name is not None and name + '.npy' in members:
+                member = name + '.npy'
+            elif len(members) == 1:
+                member = members[0]
+            else:
+                raise KeyError("'{}' is not an array in '{}'".format(name, filename))
+            info = archive.getinfo(member)
+            if info.compress_type == zipfile.ZIP_STORED:
+                result = _map_archive_member(filename, info)
+                if result is not None:
+                    return result
+            with archive.open(member) as f:
+                return _np.lib.format.read_array(f)
+
+    else:
+        raise ValueError("cannot load data from '{}': expected a '.npy'- or '.npz'-file".format(filename))
+
+
+def _map_archive_member(filename: str, info: zipfile.ZipInfo):
+    """
+    Maps an uncompressed array inside an `.npz`-archive into memory, or returns `None` if that is not possible.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(info.header_offset)
+        header = f.read(30)
+        if len(header) != 30 or header[:4] != b'PK\x03\x04':
+            return None
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+        version = _np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = _np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = _np.lib.format.read_array_header_2_0(f)
+        else:
+            return None
+        offset = f.tell()
+    if dtype.hasobject or 0 in shape:
+        return None
+    return _np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape,
+                      order='F' if fortran_order else 'C')
+
+
+class DataFile(object):
+    """
+    Refers to external data stored in a file (see `load_data`). The file is opened when the value is needed for the
+    first time. When pickled, e.g., to send a model to another process or to store it in the cache, only the name
+    of the file is kept, and the receiving process maps the file into memory again.
+    """
+
+    def __init__(self, filename: str, name: Optional[str]=None):
+        self.filename = os.fspath(filename)
+        self.name = name
+        self._value = None
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'name': self.name, '_value': None}
+
+    def __repr__(self):
+        if self.name is not None:
+            return "DataFile({!r}, {!r})".format(self.filename, self.name)
+        else:
+            return "DataFile({!r})".format(self.filename)
+
+    @property
+    def value(self):
+        if self._value is None:
+            self._value = load_data(self.filename, self.name)
+        return self._value
+
+
+def as_data(value, name: Optional[str]=None):
+    """
+    Returns a `DataFile` if the value is the name of a file, or the value itself otherwise. For `.npz`-archives,
+    the `name` of the data selects the array inside the archive.
+    """
+    if isinstance(value, (str, os.PathLike)):
+        return DataFile(value, name)
+    else:
+        return value
+
+
+def prepare_data(data: Optional[dict]):
+    """
+    Replaces the names of files in a dictionary of external data by `DataFile`s (see `as_data`).
+    """
+    if data is not None:
+        return {key: as_data(data[key], key) for key in data}
+    else:
+        return None
+
+
+def get_data_shape(value):
+    """
+    Returns the shape of a (possibly nested) data value as a tuple. Scalars have the shape `()`, a list of five
+    numbers has the shape `(5,)`, etc. For lists whose items have different shapes, the second element of the
+    shape is a tuple with the shapes of all items.
+
+    The shape of external data is fixed at compile time, because loops over the data are unrolled.
+    """
+    if isinstance(value, DataFile):
+        value = value.value
+    if hasattr(value, 'shape') and not isinstance(value, (list, tuple)):
+        return tuple(value.shape)
+    elif type(value) in (list, tuple):
+        shapes = [get_data_shape(item) for item in value]
+        if len(shapes) == 0 or all([s == shapes[0] for s in shapes]):
+            return (len(value),) + (shapes[0] if len(shapes) > 0 else ())
+        else:
+            return len(value), tuple(shapes)
+    else:
+        return ()
+
+
+_dtype_kinds = {
+    'b': ppl_types.Boolean,
+    'i': ppl_types.Integer,
+    'u': ppl_types.Integer,
+    'f': ppl_types.Float,
+}
+
+def get_data_type(value):
+    if isinstance(value, DataFile):
+        value = value.value
+    kind = getattr(getattr(value, 'dtype', None), 'kind', None)
+    if kind in _dtype_kinds and hasattr(value, 'shape'):
+        # Derive the type from the shape of the array, without converting (and thus reading) the entire array
+        result = _dtype_kinds[kind]
+        for size in reversed(tuple(value.shape)):
+            result = ppl_types.List[result][size]
+        return result
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+    return ppl_types.from_python(value)
+
+
+def make_data_symbol(name: str, value):
+    """
+    Creates the symbol that represents the external data `name` during compilation. The symbol carries the type
+    (including the size) of the data, so that loops over the data can be unrolled, but the values themselves are
+    not inlined into the program.
+    """
+    result = AstSymbol(name, predef=True)
+    result.__type__ = get_data_type(value)
+    return result
@@ -0,0 +1,144 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+import hashlib
+import os
+import pickle
+import tempfile
+from typing import Optional
+from .ppl_data import get_data_shape, get_data_type
+
+
+# Increase this number whenever the layout of the stored entries changes.
+CACHE_FORMAT_VERSION = 1
+
+# The environment variable used as the default cache directory, if no explicit directory is given.
+CACHE_DIR_VARIABLE = 'PYPPL_CACHE_DIR'
+
+_compiler_digest = None
+
+
+def _get_compiler_digest():
+    """
+    Returns a hash over the sources of the compiler itself. Including this hash in the cache key ensures that
+    models compiled by an older version of the compiler are never restored after an update.
+    """
+    global _compiler_digest
+    if _compiler_digest is None:
+        h = hashlib.sha256()
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        for path, dirs, files in sorted(os.walk(base_path)):
+            dirs.sort()
+            for filename in sorted(files):
+                if filename.endswith('.py'):
+                    h.update(os.path.relpath(os.path.join(path, filename), base_path).encode('utf-8'))
+                    with open(os.path.join(path, filename), 'rb') as f:
+                        h.update(f.read())
+        _compiler_digest = h.hexdigest()
+    return _compiler_digest
+
+
+def get_default_cache_dir():
+    """
+    Returns the cache directory specified through the environment variable `PYPPL_CACHE_DIR`, or `None`.
+    """
+    return os.environ.get(CACHE_DIR_VARIABLE, None)
+
+
+class ModelCache(object):
+    """
+    A persistent, content-addressed cache for compiled models.
+
+    Each entry is stored as a separate file, whose name is the hash over all inputs to the compiler (see `make_key`).
+    An entry holds the generated code of the model-class, together with the vertices, arcs, data and conditionals
+    of the graph. Restoring a model from the cache therefore only requires executing the stored code, but none of
+    the frontends or transforms.
+
+    Entries are written atomically, so that several processes might safely share the same cache directory. Entries
+    that cannot be read are treated as missing.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = os.path.expanduser(cache_dir)
+
+    @staticmethod
+    def make_key(source: str, *,
+                 language: Optional[str]=None,
+                 imports: Optional[str]=None,
+                 base_class: Optional[str]=None,
+                 namespace: Optional[dict]=None,
+                 data: Optional[dict]=None,
+                 class_name: str='Model'):
+        """
+        Returns the key for a compiled model. External data (see `compile_model`) only contributes its shape and type to
+        the key, since the values can be bound to the model after restoring it from the cache.
+        """
+        h = hashlib.sha256()
+        h.update('v{}\0{}\0'.format(CACHE_FORMAT_VERSION, _get_compiler_digest()).encode('utf-8'))
+        if namespace is not None:
+            namespace = sorted([(repr(key), repr(namespace[key])) for key in namespace])
+        if data is not None:
+            data = sorted([(key, get_data_shape(data[key]), repr(get_data_type(data[key]))) for key in data])
+        for item in (source, language, imports, base_class, namespace, data, class_name):
+            h.update(repr(item).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def _get_filename(self, key: str):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def load(self, key: str):
+        """
+        Returns the tuple `(code, class_name, vertices, arcs, data, conditionals)` stored for the given key, or
+        `None` if there is no (readable) entry.
+        """
+        try:
+            with open(self._get_filename(key), 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError, KeyError, TypeError,
+                ValueError):
+            return None
+        if type(entry) is not dict or entry.get('version', None) != CACHE_FORMAT_VERSION:
+            return None
+        vertices, arcs, data, conditionals = entry['graph']
+        # Data files are mapped into memory again when restoring the entry, and might have changed in the meantime
+        if any([node.source is not None and get_data_shape(node.value) != node.shape for node in data]):
+            return None
+        return entry['code'], entry['class_name'], vertices, arcs, data, conditionals
+
+    def store(self, key: str, code: str, class_name: str, vertices: set, arcs: set, data: set, conditionals: set):
+        """
+        Stores a compiled model under the given key. Returns `False` if the model could not be written to the cache,
+        e.g., because the directory is not writable, or because some part of the graph cannot be pickled.
+        """
+        entry = {
+            'version': CACHE_FORMAT_VERSION,
+            'code': code,
+            'class_name': class_name,
+            'graph': (vertices, arcs, data, conditionals),
+        }
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        except OSError:
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, self._get_filename(key))
+            return True
+        except (OSError, pickle.PicklingError, AttributeError, TypeError, RecursionError):
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            return False
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+        if os.path.isdir(self.cache_dir):
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.pickle'):
+                    os.remove(os.path.join(self.cache_dir, filename))
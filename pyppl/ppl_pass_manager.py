@@ -0,0 +1,250 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+import time
+import tracemalloc
+from typing import Optional
+from .ppl_ast import walk
+
+
+def count_nodes(ast):
+    """
+    Returns the number of AST-nodes in the given tree (or list of trees).
+    """
+    result = 0
+    for _ in walk(ast):
+        result += 1
+    return result
+
+
+class PassStatistics(object):
+    """
+    The statistics recorded for a single pass or stage of the compiler.
+
+    `nodes_in` and `nodes_out` give the size of the AST before and after the pass (or other measures of size for
+    stages that do not work on the AST). `peak_memory` is the peak of memory allocated during the pass in bytes, as
+    reported by `tracemalloc`. `changed` is `None` if it does not apply to the respective stage.
+    """
+
+    def __init__(self, name: str, wall_time: float, *,
+                 nodes_in: Optional[int]=None,
+                 nodes_out: Optional[int]=None,
+                 peak_memory: Optional[int]=None,
+                 changed: Optional[bool]=None):
+        self.name = name
+        self.wall_time = wall_time
+        self.nodes_in = nodes_in
+        self.nodes_out = nodes_out
+        self.peak_memory = peak_memory
+        self.changed = changed
+
+    def __repr__(self):
+        return "{}: {:.6f}s, nodes {} -> {}, peak memory {}, changed {}".format(
+            self.name, self.wall_time, self.nodes_in, self.nodes_out, self.peak_memory, self.changed)
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'wall_time': self.wall_time,
+            'nodes_in': self.nodes_in,
+            'nodes_out': self.nodes_out,
+            'peak_memory': self.peak_memory,
+            'changed': self.changed,
+        }
+
+
+class FixedPoint(object):
+    """
+    A group of passes, which the pass manager runs repeatedly until the AST does not change any more (a fixed point),
+    or the maximal number of iterations is exhausted. If `max_iterations` is `None`, the pass manager's budget is used.
+
+    Quiescence is detected by the convention that a transform returns the very same node if it does not change
+    anything, so that there is no need to compare trees or generate code. Transforms that rename variables on
+    every run (such as the `FunctionInliner`) never reach a fixed point and should not be part of such a group.
+    """
+
+    def __init__(self, passes: list, *, max_iterations: Optional[int]=None):
+        self.passes = passes
+        self.max_iterations = max_iterations
+
+    def __repr__(self):
+        return "FixedPoint({})".format(', '.join([name for name, _ in self.passes]))
+
+
+class PassManager(object):
+    """
+    The pass manager runs a sequence of transforms on the AST and records statistics for each pass: the wall time,
+    the number of AST-nodes before and after the pass, the peak memory allocated during the pass, and whether the
+    pass has changed the tree at all.
+
+    A pass is given as a tuple `(name, transform)`, where `transform` is either a visitor (an object with a `visit`-
+    method), or a function taking the AST and returning the transformed AST. The `transform` can also be a
+    `FixedPoint`-group of passes, which are iterated until the AST does not change any more, or until `max_iterations`
+    is exhausted. Other stages of the compiler, such as the graph generation, can be recorded through `run_stage`.
+
+    A pass is skipped if it has already left exactly this AST unchanged. A transform can declare through the
+    attribute `__idempotent__` that running it on its own output never changes anything: the pass is then also
+    skipped if the AST is still the result of its last run.
+
+    If `collect_statistics` is `False`, the passes are simply executed one after the other without any overhead.
+    Measuring the memory requires `tracemalloc`, which slows down the compilation considerably; it can be switched
+    off through `trace_memory`.
+    """
+
+    def __init__(self, *, collect_statistics: bool=True, trace_memory: bool=True, debug: bool=False,
+                 max_iterations: int=8):
+        self.collect_statistics = collect_statistics
+        self.trace_memory = trace_memory
+        self.debug = debug
+        self.max_iterations = max_iterations
+        self.statistics = []
+
+    def _print_debug(self, name: str, ast):
+        if self.debug:
+            from .backend.ppl_code_generator import generate_code
+            print("=" * 30, name, "=" * 30)
+            print(generate_code(ast), flush=True)
+            print("-" * (62 + len(name)), flush=True)
+
+    def _start_tracing(self):
+        if not self.trace_memory:
+            return False
+        if tracemalloc.is_tracing():
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            return False
+        tracemalloc.start()
+        return True
+
+    def _stop_tracing(self, started: bool):
+        if not self.trace_memory:
+            return None
+        peak = tracemalloc.get_traced_memory()[1]
+        if started:
+            tracemalloc.stop()
+        return peak
+
+    def run_pass(self, name: str, transform, ast):
+        """
+        Runs a single pass on the AST and returns the transformed AST.
+        """
+        function = transform.visit if hasattr(transform, 'visit') else transform
+        if not self.collect_statistics:
+            result = function(ast)
+            self._print_debug(name, result)
+            return result
+
+        nodes_in = count_nodes(ast)
+        started = self._start_tracing()
+        start_time = time.perf_counter()
+        try:
+            result = function(ast)
+        finally:
+            wall_time = time.perf_counter() - start_time
+            peak_memory = self._stop_tracing(started)
+        nodes_out = count_nodes(result)
+        changed = result is not ast and (nodes_in != nodes_out or result != ast)
+        self.statistics.append(PassStatistics(name, wall_time, nodes_in=nodes_in, nodes_out=nodes_out,
+                                              peak_memory=peak_memory, changed=changed))
+        self._print_debug(name, result)
+        return result
+
+    def _run_unless_quiescent(self, name: str, transform, ast, quiescent: dict):
+        """
+        Runs the pass unless it has already left exactly this AST unchanged (or, for idempotent passes, produced it).
+        The dictionary `quiescent` maps the id of each transform to the AST on which it is known to be quiescent.
+        """
+        if quiescent.get(id(transform)) is ast:
+            return ast
+        result = self.run_pass(name, transform, ast)
+        if result is ast or getattr(transform, '__idempotent__', False) is True:
+            quiescent[id(transform)] = result
+        else:
+            quiescent.pop(id(transform), None)
+        return result
+
+    def run_fixed_point(self, name: str, group: FixedPoint, ast, quiescent: Optional[dict]=None):
+        """
+        Runs the passes of the group repeatedly until a full iteration leaves the AST unchanged, and returns the
+        resulting AST.
+        """
+        if quiescent is None:
+            quiescent = {}
+        max_iterations = group.max_iterations if group.max_iterations is not None else self.max_iterations
+        for iteration in range(max(max_iterations, 1)):
+            start_ast = ast
+            for pass_name, transform in group.passes:
+                if iteration > 0:
+                    pass_name = "{}#{}".format(pass_name, iteration + 1)
+                ast = self._run_unless_quiescent(pass_name, transform, ast, quiescent)
+            if ast is start_ast:
+                break
+        return ast
+
+    def run(self, ast, passes: list):
+        """
+        Runs all the passes given as a list of tuples `(name, transform)` in order and returns the resulting AST.
+
+        A pass is skipped if the AST has not changed since the same transform was last run and left it unchanged.
+        """
+        quiescent = {}
+        for name, transform in passes:
+            if isinstance(transform, FixedPoint):
+                ast = self.run_fixed_point(name, transform, ast, quiescent)
+            else:
+                ast = self._run_unless_quiescent(name, transform, ast, quiescent)
+        return ast
+
+    def run_stage(self, name: str, function, *args, nodes_in: Optional[int]=None, count_result=None):
+        """
+        Runs and records an arbitrary stage of the compiler, such as the graph generation. The stage is executed as
+        `function(*args)` and its result returned. Since the result of such a stage is usually not an AST, you may
+        provide a function `count_result`, which determines the size of the result.
+        """
+        if not self.collect_statistics:
+            return function(*args)
+
+        started = self._start_tracing()
+        start_time = time.perf_counter()
+        try:
+            result = function(*args)
+        finally:
+            wall_time = time.perf_counter() - start_time
+            peak_memory = self._stop_tracing(started)
+        nodes_out = count_result(result) if count_result is not None else None
+        self.statistics.append(PassStatistics(name, wall_time, nodes_in=nodes_in, nodes_out=nodes_out,
+                                              peak_memory=peak_memory))
+        return result
+
+    def clear(self):
+        self.statistics = []
+
+    def get_total_time(self):
+        return sum([item.wall_time for item in self.statistics])
+
+    def get_statistics(self):
+        """
+        Returns the recorded statistics as a list of dictionaries, suitable for JSON or CSV.
+        """
+        return [item.as_dict() for item in self.statistics]
+
+    def get_report(self):
+        """
+        Returns the recorded statistics as a table in human-readable form.
+        """
+        def fmt(value):
+            return '-' if value is None else str(value)
+
+        name_len = max([len(item.name) for item in self.statistics] + [5])
+        line = "{:" + str(name_len) + "}  {:>12}  {:>9}  {:>9}  {:>12}  {:>7}"
+        result = [line.format('Pass', 'Time [ms]', 'Nodes in', 'Nodes out', 'Peak memory', 'Changed')]
+        for item in self.statistics:
+            result.append(line.format(item.name, '{:.3f}'.format(item.wall_time * 1000), fmt(item.nodes_in),
+                                      fmt(item.nodes_out), fmt(item.peak_memory), fmt(item.changed)))
+        result.append(line.format('Total', '{:.3f}'.format(self.get_total_time() * 1000), '', '', '', ''))
+        return '\n'.join(result)
+
+    def print_report(self):
+        print(self.get_report())
@@ -0,0 +1,187 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+from ast import copy_location as _cl
+from ..ppl_ast import *
+from ..ppl_ast_annotators import get_info
+from .. import distributions
+
+
+SHARED_TAG = 'shared'
+
+# Nodes that bind variables of their own: expressions inside them are not shared
+_binding_nodes = (AstFor, AstFunction, AstLet, AstListFor, AstWhile)
+
+# Nodes that are cheap enough to be recomputed wherever they occur
+_trivial_nodes = (AstAttribute, AstSymbol, AstValue, AstValueVector)
+
+_torch_compare_functions = {'torch.eq', 'torch.ge', 'torch.gt', 'torch.le', 'torch.lt', 'torch.ne'}
+
+
+def is_shared_def(node: AstNode):
+    """
+    Checks whether the node is the definition of a shared subexpression (see `CommonSubexpressionEliminator`).
+    """
+    return isinstance(node, AstDef) and node.tag == SHARED_TAG
+
+
+def _run_nested(generator):
+    """
+    Runs a generator, which yields the generators of its nested calls instead of calling them, on an explicit stack,
+    so that deeply nested ASTs do not run into the recursion limit. Returns the value returned by the generator.
+    """
+    stack = [generator]
+    value = None
+    while True:
+        try:
+            call = stack[-1].send(value)
+        except StopIteration as e:
+            stack.pop()
+            if len(stack) == 0:
+                return e.value
+            value = e.value
+            continue
+        stack.append(call)
+        value = None
+
+
+class CommonSubexpressionEliminator(object):
+    """
+    Replaces pure subexpressions that occur more than once in the (straight-line) AST by a temporary variable. The
+    definition of that variable is inserted right before the first statement using it and tagged as shared (see
+    `is_shared_def`), so that the graph generator computes it once as a node of its own, instead of substituting it
+    back into every distribution and condition.
+
+    A subexpression is pure if it neither samples nor observes anything and does not change any variables (see
+    `NodeInfo.can_embed`). Distributions and comparisons are never shared, since the graph generator needs them to
+    create vertices and conditions, respectively. Moreover, a subexpression is only shared if the statement it first
+    occurs in evaluates it unconditionally, i.e. outside the branches of an `if`.
+
+    Subexpressions are counted by their structure (see `AstNode.__hash__`), which compares the operands in order, so
+    that, e.g., `ys + xs` is never replaced by a shared `xs + ys`.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        self.first_index = {}
+        self.unconditional = set()
+        self.def_counts = {}
+        self.candidates = set()
+        self.names = {}
+        self.defs = []
+
+    def visit(self, ast: AstNode):
+        items = ast.items if isinstance(ast, AstBody) else [ast]
+        self.counts = {}
+        self.first_index = {}
+        self.unconditional = set()
+        self.def_counts = {}
+        for index, item in enumerate(items):
+            _run_nested(self._count(item, index, False))
+
+        mutable_vars = set([name for name in self.def_counts if self.def_counts[name] > 1])
+        self.candidates = set()
+        for node in self.unconditional:
+            if self.counts[node] > 1:
+                info = get_info(node)
+                if info.can_embed and len(set.intersection(info.free_vars, mutable_vars)) == 0:
+                    self.candidates.add(node)
+        if len(self.candidates) == 0:
+            return ast
+
+        self.names = {}
+        result = []
+        for item in items:
+            self.defs = []
+            item = _run_nested(self._rewrite(item, 1))
+            result += self.defs
+            result.append(item)
+        self.defs = []
+        return _cl(makeBody(result), ast)
+
+    def _count(self, node: AstNode, index: int, conditional: bool):
+        """
+        Counts the occurrences of all subexpressions that might be shared, and returns whether `node` is such an
+        expression. The `index` is the index of the statement containing the node. This is a generator to be run by
+        `_run_nested`.
+        """
+        if node is None or isinstance(node, _trivial_nodes):
+            return True
+        elif isinstance(node, _binding_nodes):
+            # Variables changed inside loops, etc., cannot be relied upon to keep their values
+            for name in get_info(node).changed_vars:
+                self.def_counts[name] = 2
+            return False
+        elif isinstance(node, AstIf):
+            yield self._count(node.test, index, conditional)
+            yield self._count(node.if_node, index, True)
+            yield self._count(node.else_node, index, True)
+            return False
+        elif isinstance(node, AstBinary) and node.op in ('and', 'or'):
+            result = yield self._count(node.left, index, conditional)
+            result = (yield self._count(node.right, index, True)) and result
+        elif isinstance(node, AstCall):
+            result = True
+            for arg in node.args:
+                result = (yield self._count(arg, index, conditional)) and result
+            name = node.function_name
+            if name is None or name in _torch_compare_functions or \
+                    distributions.get_distribution_for_name(name) is not None:
+                return False
+        else:
+            if isinstance(node, AstDef):
+                self.def_counts[node.name] = self.def_counts.get(node.name, 0) + 1
+            result = True
+            for item in node.get_ast_children():
+                result = (yield self._count(item, index, conditional)) and result
+            if isinstance(node, (AstBody, AstCompare, AstDef, AstObserve, AstSample)):
+                return False
+
+        if result:
+            self.counts[node] = self.counts.get(node, 0) + 1
+            if node not in self.first_index:
+                self.first_index[node] = index
+            if not conditional and self.first_index[node] == index:
+                self.unconditional.add(node)
+        return result
+
+    def _rewrite(self, node, outer_count: int):
+        """
+        Replaces the shared subexpressions in `node`. A subexpression inside a shared expression is itself only
+        shared if it also occurs elsewhere, i.e. more often than the enclosing expression (`outer_count`). This is a
+        generator to be run by `_run_nested`.
+        """
+        if node in self.candidates and self.counts[node] > outer_count:
+            name = self.names.get(node)
+            if name is None:
+                value = yield self._rewrite_children(node, self.counts[node])
+                name = generate_temp_var()
+                self.names[node] = name
+                shared = _cl(AstDef(name, value), node)
+                shared.tag = SHARED_TAG
+                self.defs.append(shared)
+            return _cl(AstSymbol(name), node)
+        return (yield self._rewrite_children(node, outer_count))
+
+    def _rewrite_children(self, node: AstNode, outer_count: int):
+        if isinstance(node, _binding_nodes) or isinstance(node, _trivial_nodes):
+            return node
+        fields = {}
+        for name in node.get_children():
+            field = getattr(node, name)
+            if isinstance(field, AstNode):
+                item = yield self._rewrite(field, outer_count)
+                if item is not field:
+                    fields[name] = item
+            else:
+                items = []
+                for item in field:
+                    items.append((yield self._rewrite(item, outer_count)))
+                if any([a is not b for a, b in zip(items, field)]):
+                    fields[name] = type(field)(items)
+        if len(fields) > 0:
+            return node.with_fields(**fields)
+        else:
+            return node
@@ -0,0 +1,139 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+import math
+from typing import Optional
+from ..ppl_ast import *
+
+
+# Pure functions, which are evaluated by the compiler if all arguments are constant numbers
+_evaluated_functions = {
+    'math.' + name: getattr(math, name)
+    for name in ('acos', 'acosh', 'asin', 'asinh', 'atan', 'atan2', 'atanh', 'ceil', 'cos', 'cosh', 'degrees',
+                 'erf', 'erfc', 'exp', 'expm1', 'fabs', 'factorial', 'floor', 'fsum', 'gamma', 'hypot', 'lgamma',
+                 'log', 'log10', 'log1p', 'log2', 'pow', 'radians', 'sin', 'sinh', 'sqrt', 'tan', 'tanh', 'trunc')
+}
+
+# Pure functions, which create new data (such as tensors) that the compiler cannot represent as values of its own
+_data_functions = set(
+    ['torch.' + name for name in ('arange', 'eye', 'full', 'linspace', 'ones', 'zeros',
+                                  'tensor', 'Tensor', 'FloatTensor', 'IntTensor', 'DoubleTensor', 'HalfTensor',
+                                  'ByteTensor', 'ShortTensor', 'LongTensor')] +
+    ['numpy.' + name for name in ('arange', 'array', 'eye', 'full', 'linspace', 'ones', 'zeros')]
+)
+
+
+def register_pure_function(name: str, function=None):
+    """
+    Registers the function with the given (fully qualified) name as pure, i.e. without side effects and always
+    returning the same value for the same arguments, so that calls with constant arguments can be folded.
+
+    If `function` is given, the compiler evaluates calls with constant numeric arguments and replaces them by the
+    result (see `fold_call`). Otherwise, the result is data, which is computed only once when the model samples
+    from the prior, instead of anew in every evaluation of the log-pdf (see `ConstantDataChecker`).
+
+    :param name:      The name of the function as used in calls, e.g., `torch.ones` or `math.sqrt`.
+    :param function:  A Python function to evaluate the calls, or `None`.
+    """
+    unregister_pure_function(name)
+    if function is not None:
+        _evaluated_functions[name] = function
+    else:
+        _data_functions.add(name)
+
+
+def unregister_pure_function(name: str):
+    """
+    Removes the function from the registry of pure functions (see `register_pure_function`), so that all calls
+    are evaluated at runtime.
+    """
+    _evaluated_functions.pop(name, None)
+    _data_functions.discard(name)
+
+
+def is_pure_function(name: Optional[str]):
+    return name in _evaluated_functions or name in _data_functions
+
+
+def fold_call(node: AstCall) -> Optional[AstNode]:
+    """
+    Evaluates the call of a registered function with constant numeric arguments, and returns the result as a value.
+    If the call cannot be evaluated, or the result is not a finite number, `None` is returned.
+    """
+    function = _evaluated_functions.get(node.function_name, None)
+    if function is None or node.has_keyword_args:
+        return None
+    args = []
+    for arg in node.args:
+        if is_number(arg) or is_boolean(arg):
+            args.append(arg.value)
+        elif isinstance(arg, AstValueVector) and all([type(item) in (bool, int, float) for item in arg.items]):
+            args.append(list(arg.items))
+        else:
+            return None
+    try:
+        result = function(*args)
+    except (ArithmeticError, TypeError, ValueError):
+        return None
+    if type(result) in (bool, int) or (type(result) is float and math.isfinite(result)):
+        return AstValue(result)
+    return None
+
+
+class ConstantDataChecker(object):
+    """
+    Checks whether an expression computes constant data, i.e. whether it calls a pure function creating data (see
+    `register_pure_function`) with constant arguments, or does arithmetic on such data. Whether a symbol is
+    constant (data) is determined by the function `is_constant_symbol` given to the constructor.
+
+    `check` returns `True` for constant data, `False` for constant expressions without any data (which are left to
+    the simplifier), and `None` if the expression is not constant. The results are cached for each node.
+    """
+
+    def __init__(self, is_constant_symbol):
+        self.is_constant_symbol = is_constant_symbol
+        self.cache = {}
+
+    def check(self, node: AstNode) -> Optional[bool]:
+        if node is None or isinstance(node, (AstValue, AstValueVector)):
+            return False
+        elif isinstance(node, AstSymbol):
+            return self.is_constant_symbol(node)
+        key = id(node)
+        if key in self.cache:
+            return self.cache[key][1]
+        result = self._check(node)
+        # The node is kept alongside the result, so that its id cannot be reused
+        self.cache[key] = (node, result)
+        return result
+
+    def _check_all(self, items):
+        result = False
+        for item in items:
+            item_result = self.check(item)
+            if item_result is None:
+                return None
+            result = result or item_result
+        return result
+
+    def _check(self, node: AstNode) -> Optional[bool]:
+        if isinstance(node, AstCall):
+            name = node.function_name
+            if not is_pure_function(name):
+                return None
+            result = self._check_all(node.args)
+            if result is not None and name in _data_functions:
+                return True
+            return result
+        elif isinstance(node, AstBinary):
+            return self._check_all([node.left, node.right])
+        elif isinstance(node, AstUnary):
+            return self.check(node.item)
+        elif isinstance(node, AstSubscript):
+            return self._check_all([node.base, node.index])
+        elif isinstance(node, AstVector):
+            return self._check_all(node.items)
+        else:
+            return None
@@ -0,0 +1,74 @@
+#
+# This file is part of PyPPLCompiler, a compiler for probabilistic programming to create graphical models.
+#
+# License: GNU GPL 3 (see LICENSE.txt)
+#
+from ast import copy_location as _cl
+from ..ppl_ast import *
+from ..ppl_ast_annotators import get_modified_list
+
+
+def _scan(node: AstNode):
+    """
+    Returns a tuple `(names, defined_names, has_effect)` for the given statement: the names of all symbols used, the
+    names of all variables defined (or lists modified) anywhere inside the statement, and whether the statement
+    samples or observes anything. Variables bound by loops, etc., are not distinguished from free variables, so that
+    `names` might contain more names than necessary, but never misses a name. The AST is walked on an explicit stack.
+    """
+    names = set()
+    defined_names = set()
+    has_effect = False
+    stack = [node]
+    while len(stack) > 0:
+        item = stack.pop()
+        if isinstance(item, AstSymbol):
+            names.add(item.name)
+            continue
+        elif isinstance(item, (AstSample, AstObserve)):
+            has_effect = True
+        elif isinstance(item, AstDef):
+            defined_names.add(item.name)
+        elif isinstance(item, AstCall) and get_modified_list(item) is not None:
+            defined_names.add(get_modified_list(item))
+        stack += item.get_ast_children()
+    return names, defined_names, has_effect
+
+
+class DeadCodeEliminator(object):
+    """
+    Removes all statements from the (straight-line) AST, which do not contribute to any vertex or condition of the
+    graph. A statement is needed if it samples or observes something, or if it defines a variable, which is used by
+    a statement that is needed. This includes the conditions of `if`-statements containing samples or observations.
+    Any other definitions, together with expressions whose values are not used at all (such as the result at the end
+    of a program), are dead code.
+
+    The liveness of the variables is determined in a single backward pass over the statements, so that the time
+    taken is linear in the size of the AST.
+    """
+
+    __idempotent__ = True
+
+    def visit(self, ast: AstNode):
+        items = ast.items if isinstance(ast, AstBody) else [ast]
+        live = set()
+        result = []
+        for item in reversed(items):
+            if isinstance(item, AstImport):
+                result.append(item)
+                continue
+            names, defined_names, has_effect = _scan(item)
+            if isinstance(item, AstDef):
+                # Functions only sample or observe anything when called, i.e. if they are used at all
+                if not (item.name in live or (has_effect and not item.is_function_def)):
+                    continue
+                # A definition at the top level overwrites the variable: the earlier value is not needed anymore
+                live.discard(item.name)
+            elif not (has_effect or len(set.intersection(defined_names, live)) > 0):
+                continue
+            live.update(names)
+            result.append(item)
+
+        if len(result) == len(items):
+            return ast
+        result.reverse()
+        return _cl(makeBody(result), ast)
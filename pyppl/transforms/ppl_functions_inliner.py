@@ -6,22 +6,249 @@
 # 20. Mar 2018, Tobias Kohn
 # 02. Jul 2018, Tobias Kohn
 #
+import re
+from ast import copy_location as _cl
 from ..ppl_ast import *
 from ..aux.ppl_transform_visitor import TransformVisitor
 from ..types import ppl_types, ppl_type_inference
 
 
+_temp_var_pattern = re.compile(r'__tmp_(\d+)__')
+
+def _temp_var_number(name: str):
+    return int(_temp_var_pattern.fullmatch(name).group(1))
+
+
+class _InlineTemplate(object):
+    """
+    The body of a function inlined once with placeholders for all its parameters. The names introduced while inlining
+    the body contain temporary names in the range `first` to `last` (see `generate_temp_var`), which are replaced by
+    fresh names for every instance of the template. `paths` maps the ids of all nodes, which contain such names, to
+    the fields leading to them, so that all other nodes can be shared between the instances. `defined_names` holds
+    all names defined inside the body, including parameters that are reassigned.
+
+    The template depends on the names resolved in the context of the call site (`dependencies`), such as the
+    functions called from inside the body. It can only be reused where all these names resolve to the same symbols or
+    functions.
+    """
+
+    def __init__(self, tmp: str, scope: Scope):
+        self.tmp = tmp
+        self.scope = scope
+        self.first = _temp_var_number(tmp)
+        self.last = None
+        self.body = None
+        self.paths = {}
+        self.defined_names = set()
+        self.dependencies = {}
+        self.is_reusable = True
+
+    def add_dependency(self, name: str, value):
+        if name not in self.dependencies and self.scope.resolve(name) is value:
+            self.dependencies[name] = _resolution_key(value)
+
+    def can_substitute(self, param: str, arg: AstNode):
+        """
+        Checks whether the placeholder of the parameter can be replaced by the argument itself, which is the case for
+        symbols, unless the body assigns a new value to the parameter.
+        """
+        return isinstance(arg, AstSymbol) and (param + self.tmp) not in self.defined_names
+
+    def is_renamed(self, name: str):
+        for m in _temp_var_pattern.finditer(name):
+            if self.first <= int(m.group(1)) <= self.last:
+                return True
+        return False
+
+    def complete(self, body: AstNode, last: str):
+        self.body = body
+        self.last = _temp_var_number(last)
+        self.scope = None
+        # Collect the paths to all nodes with names to be replaced by a post-order walk on an explicit stack. For
+        # each node on a path, we store the names of the fields leading to further nodes on a path.
+        paths = self.paths
+        stack = [(body, False)]
+        while len(stack) > 0:
+            node, done = stack.pop()
+            if done:
+                if isinstance(node, AstSymbol):
+                    is_path = self.is_renamed(node.name)
+                elif isinstance(node, AstDef):
+                    self.defined_names.add(node.name)
+                    is_path = self.is_renamed(node.name)
+                elif isinstance(node, AstLet):
+                    self.defined_names.add(node.target)
+                    is_path = self.is_renamed(node.target)
+                else:
+                    is_path = False
+                fields = [name for name in node._fields
+                          if any([id(item) in paths for item in _field_items(node, name)])]
+                if is_path or len(fields) > 0:
+                    paths[id(node)] = fields
+            else:
+                stack.append((node, True))
+                for name in node._fields:
+                    stack += [(item, False) for item in _field_items(node, name)]
+
+    def rename(self, name: str, temp_names: dict):
+        """
+        Replaces the temporary names in the range of this template by the fresh names in `temp_names`, which are
+        created as needed.
+        """
+        def replace(m):
+            n = int(m.group(1))
+            if self.first <= n <= self.last:
+                if n not in temp_names:
+                    temp_names[n] = generate_temp_var()
+                return temp_names[n]
+            return m.group(0)
+        return _temp_var_pattern.sub(replace, name)
+
+
+def _field_items(node: AstNode, name: str):
+    # In contrast to `get_ast_children`, this includes the values of dictionaries
+    field = getattr(node, name, None)
+    if isinstance(field, AstNode):
+        return [field]
+    elif isinstance(field, dict):
+        return [item for item in field.values() if isinstance(item, AstNode)]
+    elif isinstance(field, (list, tuple)):
+        return [item for item in field if isinstance(item, AstNode)]
+    else:
+        return []
+
+
+def _resolution_key(value):
+    if isinstance(value, AstSymbol):
+        return value.name
+    elif isinstance(value, AstFunction):
+        return id(value)
+    else:
+        return None
+
+
 class FunctionInliner(TransformVisitor):
+    """
+    `visit_call`, `visit_def` and `visit_let` are generators (see `AstNode.visit`), since inlining functions and
+    let-expressions often leads to long chains of nested nodes.
+
+    The body of a function is only inlined once for each context (see `_InlineTemplate`). Further calls of the same
+    function instantiate the resulting template by replacing the placeholders of the parameters with the arguments,
+    and all temporary names with fresh ones.
+    """
 
     def __init__(self):
         super().__init__()
         self.type_inferencer = ppl_type_inference.TypeInferencer(self)
         self._let_counter = 0
+        self._templates = {}
+        self._active_templates = []
+        self._inlined_functions = []
 
     def get_type(self, node: AstNode):
         result = self.type_inferencer.visit(node)
         return result
 
+    def resolve(self, name: str):
+        result = self.scope.resolve(name)
+        for template in self._active_templates:
+            template.add_dependency(name, result)
+        return result
+
+    def _set_context_dependent(self):
+        # The result depends on the context in more ways than tracked by the dependencies, e.g. on types
+        for template in self._active_templates:
+            template.is_reusable = False
+
+    def _find_template(self, function: AstFunction):
+        for template in self._templates.get(id(function), (None, ()))[1]:
+            if all([_resolution_key(self.resolve(name)) == key for name, key in template.dependencies.items()]):
+                return template
+        return None
+
+    def _build_template(self, function: AstFunction, params: list):
+        # The body is inlined without evaluating any conditions, so that a recursive function would be inlined
+        # infinitely often
+        if any([f is function for f in self._inlined_functions]):
+            raise RuntimeError("cannot inline the recursive function '{}' [line {}]".format(
+                function.name, getattr(function, 'lineno', '?')))
+        tmp = generate_temp_var()
+        template = _InlineTemplate(tmp, self.scope)
+        self._active_templates.append(template)
+        self._inlined_functions.append(function)
+        try:
+            with self.create_scope(tmp):
+                for p in params:
+                    if p != '_':
+                        self.define(p, AstSymbol(p + tmp))
+                body = yield function.body
+        finally:
+            self._active_templates.remove(template)
+            self._inlined_functions.pop()
+        template.complete(body, generate_temp_var())
+        if template.is_reusable:
+            # The function is kept alongside its templates, so that its id cannot be reused
+            if id(function) not in self._templates:
+                self._templates[id(function)] = (function, [])
+            self._templates[id(function)][1].append(template)
+        return template
+
+    def _instantiate(self, template: _InlineTemplate, params: list, args: list):
+        """
+        Returns a tuple `(tmp, body)` with a fresh instance of the template's body for the given arguments.
+        """
+        temp_names = {}
+        names = {}
+        symbols = {}
+        for p, a in zip(params, args):
+            if p != '_' and template.can_substitute(p, a):
+                symbols[p + template.tmp] = a
+
+        def rename(name: str):
+            result = names.get(name)
+            if result is None:
+                result = template.rename(name, temp_names)
+                names[name] = result
+            return result
+
+        tmp = rename(template.tmp)
+        paths = template.paths
+
+        # The nodes on the paths are rebuilt bottom-up (on an explicit stack, as the body might be deeply nested)
+        result = {}
+        stack = [(template.body, False)]
+        while len(stack) > 0:
+            node, done = stack.pop()
+            fields = paths.get(id(node))
+            if fields is None or id(node) in result:
+                continue
+            elif isinstance(node, AstSymbol):
+                if node.name in symbols:
+                    result[id(node)] = symbols[node.name]
+                else:
+                    result[id(node)] = node.with_fields(name=rename(node.name))
+            elif not done:
+                stack.append((node, True))
+                for field_name in fields:
+                    stack += [(item, False) for item in _field_items(node, field_name)]
+            else:
+                new_fields = {}
+                for field_name in fields:
+                    field = getattr(node, field_name)
+                    if isinstance(field, AstNode):
+                        new_fields[field_name] = result.get(id(field), field)
+                    elif isinstance(field, dict):
+                        new_fields[field_name] = {key: result.get(id(field[key]), field[key]) for key in field}
+                    else:
+                        new_fields[field_name] = type(field)([result.get(id(item), item) for item in field])
+                if isinstance(node, AstDef):
+                    new_fields['name'] = rename(node.name)
+                elif isinstance(node, AstLet):
+                    new_fields['target'] = rename(node.target)
+                result[id(node)] = node.with_fields(**new_fields)
+
+        return tmp, result.get(id(template.body), template.body)
+
     def visit_call(self, node: AstCall):
         if isinstance(node.function, AstSymbol):
             function = self.resolve(node.function.name)
@@ -30,26 +257,21 @@ class FunctionInliner(TransformVisitor):
         else:
             function = None
         if isinstance(function, AstFunction):
-            args = [self.visit(arg) for arg in node.args]
-            tmp = generate_temp_var()
+            args = yield node.args
             params = function.parameters[:]
             if function.vararg is not None:
                 params.append(function.vararg)
             args = function.order_arguments(args, node.keywords)
+            template = self._find_template(function)
+            if template is None:
+                template = yield from self._build_template(function, params)
+            tmp, result = self._instantiate(template, params, args)
             arguments = []
             for p, a in zip(params, args):
-                if p != '_' and not isinstance(a, AstSymbol):
+                if p != '_' and not template.can_substitute(p, a):
                     arguments.append(AstDef(p + tmp, a))
                 elif not isinstance(a, AstSymbol):
                     arguments.append(a)
-            with self.create_scope(tmp):
-                for p, a in zip(params, args):
-                    if p != '_':
-                        if isinstance(a, AstSymbol):
-                            self.define(p, a)
-                        else:
-                            self.define(p, AstSymbol(p + tmp))
-                result = self.visit(function.body)
 
             if isinstance(result, AstReturn):
                 return makeBody(arguments, result.value)
@@ -67,7 +289,7 @@ class FunctionInliner(TransformVisitor):
                 else:
                     return makeBody(arguments, result.items[-1].value)
 
-        return super().visit_call(node)
+        return (yield from super().visit_call(node))
 
     def visit_call_map(self, node: AstCall):
         if node.arg_count > 1:
@@ -95,6 +317,7 @@ class FunctionInliner(TransformVisitor):
                     result.append(makeVector([arg[i] for arg in seq_args]))
                 return self.visit(makeVector(result))
             else:
+                self._set_context_dependent()
                 arg_types = [self.get_type(arg) for arg in seq_args]
                 arg_sizes = [arg.size if isinstance(arg, ppl_types.SequenceType) else None for arg in arg_types]
                 if all(arg_sizes):
@@ -107,23 +330,25 @@ class FunctionInliner(TransformVisitor):
 
     def visit_def(self, node: AstDef):
         if isinstance(node.value, AstFunction):
+            self._set_context_dependent()
             self.define(node.name, node.value, globally=node.global_context)
             return node
 
         elif not node.global_context:
             tmp = self.scope.name
             if tmp is not None and tmp != '':
-                value = self.visit(node.value)
+                value = yield node.value
                 name = node.name + tmp
                 self.define(node.name, AstSymbol(name))
                 return node.clone(name=name, value=value)
 
         else:
-            value = self.visit(node.value)
+            value = yield node.value
             if isinstance(value, (AstValue, AstValueVector, AstVector)):
+                self._set_context_dependent()
                 self.define(node.name, value, globally=True)
 
-        return super().visit_def(node)
+        return (yield from super().visit_def(node))
 
     def visit_let(self, node: AstLet):
         self._let_counter += 1
@@ -132,14 +357,14 @@ class FunctionInliner(TransformVisitor):
             if tmp is None:
                 tmp = '__'
             tmp += 'L{}'.format(self._let_counter)
-            source = self.visit(node.source)
+            source = yield node.source
             with self.create_scope(tmp):
                 self.define(node.target, AstSymbol(node.target + tmp))
-                body = self.visit(node.body)
+                body = yield node.body
             return AstLet(node.target + tmp, source, body)
 
         else:
-            return super().visit_let(node)
+            return (yield from super().visit_let(node))
 
     def visit_symbol(self, node: AstSymbol):
         sym = self.resolve(node.name)
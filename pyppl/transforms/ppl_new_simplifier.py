@@ -10,14 +10,26 @@ from ast import copy_location as _cl
 from ..ppl_ast_annotators import *
 from ..aux.ppl_transform_visitor import TransformVisitor
 from ..types import ppl_types, ppl_type_inference
+from .ppl_constant_folding import fold_call
 
 
 class Simplifier(TransformVisitor):
+    """
+    Loops are unrolled, except for plates (see `get_plate_observe`), and for loops over more than `unroll_threshold`
+    items, which do not contribute to the structure of the graph (see `can_keep_loop`). The variables assigned by such
+    a loop (see `get_loop_vars`) are held in `loop_vars`: their definitions are kept, instead of being substituted.
 
-    def __init__(self):
+    All visit-methods and the helpers `_visit_plate`, `_visit_loop_body` and `_visit_rolled_for` are generators (see
+    `AstNode.visit`), which yield the nodes to simplify next.
+    """
+
+    def __init__(self, unroll_threshold:Optional[int]=None):
         super().__init__()
         self.type_inferencer = ppl_type_inference.TypeInferencer(self)
         self.bindings = {}
+        self.bound_defs = {}
+        self.loop_vars = set()
+        self.unroll_threshold = unroll_threshold if unroll_threshold is not None else DEFAULT_UNROLL_THRESHOLD
 
     def get_type(self, node: AstNode):
         result = self.type_inferencer.visit(node)
@@ -36,8 +48,8 @@ class Simplifier(TransformVisitor):
                         node.op in ('-', '/', '//') and node.left.name == node.right.name:
             return AstValue(0 if node.op == '-' else 1)
 
-        left = self.visit(node.left)
-        right = self.visit(node.right)
+        left = yield node.left
+        right = yield node.right
         op = node.op
         if is_number(left) and is_number(right):
             return AstValue(node.op_function(left.value, right.value))
@@ -46,7 +58,7 @@ class Simplifier(TransformVisitor):
             return _cl(AstValue(left.value + right.value), node)
 
         elif op == '+' and isinstance(left, AstValueVector) and isinstance(right, AstValueVector):
-            return _cl(AstValueVector(left.items + right.items), node)
+            return _cl(AstValueVector(left.value + right.value), node)
 
         elif op == '*' and (is_string(left) and is_integer(right)) or (is_integer(left) and is_string(right)):
             return _cl(AstValue(left.value * right.value), node)
@@ -63,7 +75,7 @@ class Simplifier(TransformVisitor):
                 if op in ('+', '|', '^'):
                     return right
                 elif op == '-':
-                    return self.visit(_cl(AstUnary('-', right), node))
+                    return (yield _cl(AstUnary('-', right), node))
                 elif op in ('*', '/', '//', '%', '&', '<<', '>>', '**'):
                     return left
 
@@ -73,20 +85,20 @@ class Simplifier(TransformVisitor):
 
             elif value == -1:
                 if op == '*':
-                    return self.visit(_cl(AstUnary('-', right), node))
+                    return (yield _cl(AstUnary('-', right), node))
 
             if isinstance(right, AstBinary) and is_number(right.left):
                 r_value = right.left.value
                 if op == right.op and op in ('+', '-', '*', '&', '|'):
-                    return self.visit(_cl(AstBinary(AstValue(node.op_function(value, r_value)),
+                    return (yield _cl(AstBinary(AstValue(node.op_function(value, r_value)),
                                      '+' if op == '-' else op,
                                      right.right), node))
 
                 elif op == right.op and op == '/':
-                    return self.visit(_cl(AstBinary(AstValue(value / r_value), '*', right.right), node))
+                    return (yield _cl(AstBinary(AstValue(value / r_value), '*', right.right), node))
 
                 elif op in ['+', '-'] and right.op in ['+', '-']:
-                    return self.visit(_cl(AstBinary(AstValue(node.op_function(value, r_value)), '-', right.right), node))
+                    return (yield _cl(AstBinary(AstValue(node.op_function(value, r_value)), '-', right.right), node))
 
         elif is_number(right):
             value = right.value
@@ -104,7 +116,7 @@ class Simplifier(TransformVisitor):
 
             elif value == -1:
                 if op in ('*', '/'):
-                    return self.visit(_cl(AstUnary('-', right), node))
+                    return (yield _cl(AstUnary('-', right), node))
 
             if op == '-':
                 op = '+'
@@ -118,16 +130,16 @@ class Simplifier(TransformVisitor):
             if isinstance(left, AstBinary) and is_number(left.right):
                 l_value = left.right.value
                 if op == left.op and op in ('+', '*', '|', '&'):
-                    return self.visit(_cl(AstBinary(left.left, op, AstValue(node.op_function(l_value, value))), node))
+                    return (yield _cl(AstBinary(left.left, op, AstValue(node.op_function(l_value, value))), node))
 
                 elif op == left.op and op == '-':
-                    return self.visit(_cl(AstBinary(left.left, '-', AstValue(l_value + value)), node))
+                    return (yield _cl(AstBinary(left.left, '-', AstValue(l_value + value)), node))
 
                 elif op == left.op and op in ('/', '**'):
-                    return self.visit(_cl(AstBinary(left.left, '/', AstValue(l_value * value)), node))
+                    return (yield _cl(AstBinary(left.left, '/', AstValue(l_value * value)), node))
 
                 elif op in ['+', '-'] and left.op in ('+', '-'):
-                    return self.visit(_cl(AstBinary(left.left, left.op, AstValue(l_value - value)), node))
+                    return (yield _cl(AstBinary(left.left, left.op, AstValue(l_value - value)), node))
 
             if op in ('<<', '>>') and type(value) is int:
                 base = 2 if op == '<<' else 0.5
@@ -149,39 +161,50 @@ class Simplifier(TransformVisitor):
                 return left if not right.value else AstValue(True)
 
         if op == '-' and isinstance(right, AstUnary) and right.op == '-':
-            return self.visit(_cl(AstBinary(left, '+', right.item), node))
+            return (yield _cl(AstBinary(left, '+', right.item), node))
 
         if left is node.left and right is node.right:
             return node
         else:
             return _cl(AstBinary(left, op, right), node)
 
+    def visit_call(self, node: AstCall):
+        result = yield from super().visit_call(node)
+        if isinstance(result, AstCall):
+            # Calls of pure functions with constant arguments are evaluated right away (see `fold_call`)
+            value = fold_call(result)
+            if value is not None:
+                return _cl(value, node)
+        return result
+
     def visit_call_clojure_core_conj(self, node: AstCall):
-        args = [self.visit(arg) for arg in node.args]
+        args = yield node.args
         if is_vector(args[0]):
             result = args[0]
             for a in args[1:]:
                 result = result.conj(a)
             return result
+        elif all([a is b for a, b in zip(args, node.args)]):
+            return node
         else:
             return node.clone(args=args)
 
     def visit_call_len(self, node: AstCall):
         if node.arg_count == 1:
-            arg = self.visit(node.args[0])
+            arg = yield node.args[0]
             if is_vector(arg):
                 return AstValue(len(arg))
             arg_type = self.get_type(arg)
             if isinstance(arg_type, ppl_types.SequenceType):
                 if arg_type.size is not None:
                     return AstValue(arg_type.size)
-        return self.visit_call(node)
+        return (yield from self.visit_call(node))
 
     #def visit_call_map(self, node: AstCall):
     #    pass
 
     def visit_call_range(self, node:AstCall):
-        args = [self.visit(arg) for arg in node.args]
+        args = yield node.args
         if 1 <= len(args) <= 2 and all([is_integer(arg) for arg in args]):
             if len(args) == 1:
                 result = range(args[0].value)
@@ -189,12 +212,12 @@ class Simplifier(TransformVisitor):
                 result = range(args[0].value, args[1].value)
             return _cl(AstValueVector(list(result)), node)
 
-        return self.visit_call(node)
+        return (yield from self.visit_call(node))
 
     def visit_compare(self, node:AstCompare):
-        left = self.visit(node.left)
-        right = self.visit(node.right)
-        second_right = self.visit(node.second_right)
+        left = yield node.left
+        right = yield node.right
+        second_right = yield node.second_right
 
         if second_right is None:
             if is_unary_neg(left) and is_unary_neg(right):
@@ -205,10 +228,10 @@ class Simplifier(TransformVisitor):
                 right, left = AstValue(-left.value), right.item
 
             if is_binary_add_sub(left) and is_number(right):
-                left = self.visit(AstBinary(left, '-', right))
+                left = yield AstBinary(left, '-', right)
                 right = AstValue(0)
             elif is_binary_add_sub(right) and is_number(left):
-                right = self.visit(AstBinary(right, '-', left))
+                right = yield AstBinary(right, '-', left)
                 left = AstValue(0)
 
         if is_number(left) and is_number(right):
@@ -227,23 +250,98 @@ class Simplifier(TransformVisitor):
                     return AstValue(True if op == 'in' else False)
             return AstValue(False if op == 'in' else True)
 
+        if left is node.left and right is node.right and second_right is node.second_right:
+            return node
         return _cl(AstCompare(left, node.op, right, node.second_op, second_right), node)
 
     def visit_def(self, node: AstDef):
-        value = self.visit(node.value)
+        value = yield node.value
         if isinstance(value, AstSample):
+            if value is node.value:
+                return node
+            return node.clone(value=value)
+        if node.name in self.loop_vars:
+            if value is node.value:
+                return node
             return node.clone(value=value)
         self.define_name(node.name, value)
+        if value is node.value:
+            self.bound_defs[node.name] = node
         return AstBody([])
 
+    def _visit_plate(self, node: AstFor, source: AstNode, size: int):
+        """
+        Returns a single observe-statement over the entire `source` if the loop is a plate (see `get_plate_observe`),
+        and `None` if the loop needs to be unrolled.
+        """
+        if size < 2 or get_plate_observe(node.target, node.body) is None:
+            return None
+        binding = self.bindings.pop(node.target, None)
+        try:
+            body = yield node.body
+        finally:
+            if binding is not None:
+                self.bindings[node.target] = binding
+        if isinstance(body, AstBody) and len(body.items) != 1:
+            return None
+        observe = get_plate_observe(node.target, body)
+        if observe is None:
+            return None
+        return _cl(AstObserve(observe.dist, source, size=AstValue(size)), node)
+
+    def _visit_loop_body(self, node, body: AstNode):
+        """
+        Visits the body (or expression) of a loop, which is kept as a loop. The loop variable is not bound to any
+        value inside the body, and the definitions inside the body do not leak out of the loop.
+        """
+        bindings = self.bindings
+        self.bindings = bindings.copy()
+        for target in (node.target if type(node.target) is tuple else (node.target,)):
+            self.bindings.pop(target, None)
+        try:
+            return (yield body)
+        finally:
+            self.bindings = bindings
+
+    def _visit_rolled_for(self, node: AstFor, source: AstNode):
+        # The variables of the loop are defined before the loop, as the loop cannot refer to their bindings
+        loop_vars = get_loop_vars(node)
+        prefix = []
+        for name in sorted(loop_vars):
+            value = self.bindings.pop(name, None)
+            if value is None:
+                continue
+            definition = self.bound_defs.get(name)
+            if definition is not None and definition.value is value:
+                # Keep the original definition, so that the AST does not change once it has been simplified
+                prefix.append(definition)
+            else:
+                prefix.append(_cl(AstDef(name, value), node))
+        outer_loop_vars = self.loop_vars
+        self.loop_vars = set.union(outer_loop_vars, loop_vars)
+        try:
+            body = yield from self._visit_loop_body(node, node.body)
+        finally:
+            self.loop_vars = outer_loop_vars
+        if source is node.source and body is node.body:
+            result = node
+        else:
+            result = node.clone(source=source, body=body)
+        return makeBody(prefix, result) if len(prefix) > 0 else result
+
     def visit_for(self, node: AstFor):
-        source = self.visit(node.source)
+        source = yield node.source
         if is_vector(source):
+            plate = yield from self._visit_plate(node, source, len(source))
+            if plate is not None:
+                return plate
+            if can_keep_loop(node, len(source), self.unroll_threshold):
+                return (yield from self._visit_rolled_for(node, source))
             items = []
             for item in source:
                 items.append(AstDef(node.target, item))
                 items.append(node.body)
-            return self.visit(makeBody(items))
+            return (yield makeBody(items))
 
         if is_call(source, "zip"):
             lengths = []
@@ -260,34 +358,41 @@ class Simplifier(TransformVisitor):
                     items.append(AstDef(node.target, makeSubscript(src_name, i)))
                     items.append(node.body)
                 x = makeBody(items)
-                return self.visit(x)
+                return (yield x)
 
         src_type = self.get_type(source)
         if isinstance(src_type, ppl_types.SequenceType) and src_type.size is not None:
+            plate = yield from self._visit_plate(node, source, src_type.size)
+            if plate is not None:
+                return plate
+            if can_keep_loop(node, src_type.size, self.unroll_threshold):
+                return (yield from self._visit_rolled_for(node, source))
             items = []
             for i in range(src_type.size):
                 items.append(AstDef(node.target, makeSubscript(source, i)))
                 items.append(node.body)
-            return self.visit(makeBody(items))
+            return (yield makeBody(items))
 
         raise RuntimeError("cannot unroll the for-loop [line {}]".format(getattr(node, 'lineno', '?')))
 
     def visit_if(self, node: AstIf):
-        test = self.visit(node.test)
+        test = yield node.test
         if isinstance(test, AstValue):
             if test.value is True:
-                return self.visit(node.if_node)
+                return (yield node.if_node)
             if test.value is False or test.value is None:
-                return self.visit(node.else_node)
+                return (yield node.else_node)
 
-        if_node = self.visit(node.if_node)
-        else_node = self.visit(node.else_node)
+        if_node = yield node.if_node
+        else_node = yield node.else_node
         if is_empty(if_node) and is_empty(else_node):
             return test
+        if test is node.test and if_node is node.if_node and else_node is node.else_node:
+            return node
         return node.clone(test=test, if_node=if_node, else_node=else_node)
 
     def visit_list_for(self, node:AstListFor):
-        source = self.visit(node.source)
+        source = yield node.source
         if is_vector(source):
             src_len = len(source)
         else:
@@ -297,34 +402,44 @@ class Simplifier(TransformVisitor):
             else:
                 src_len = None
 
+        if node.test is None and node.target == '_' and src_len is not None and \
+                isinstance(node.expr, AstSample) and node.expr.size is None:
+            return (yield node.expr.clone(size=AstValue(src_len)))
+
+        if can_keep_loop(node, src_len, self.unroll_threshold):
+            expr = yield from self._visit_loop_body(node, node.expr)
+            test = yield from self._visit_loop_body(node, node.test)
+            if source is node.source and expr is node.expr and test is node.test:
+                return node
+            return node.clone(source=source, expr=expr, test=test)
+
         if node.test is None:
             if node.target == '_' and src_len is not None:
-                if isinstance(node.expr, AstSample) and node.expr.size is None:
-                    return self.visit(node.expr.clone(size=AstValue(src_len)))
-                else:
-                    return self.visit(_cl(makeVector([node.expr for _ in range(src_len)]), node))
+                return (yield _cl(makeVector([node.expr for _ in range(src_len)]), node))
 
             if is_vector(source):
                 items = []
                 for item in source:
                     items.append(AstDef(node.target, item))
                     items.append(node.expr)
-                return self.visit(makeVector(items))
+                return (yield makeVector(items))
 
             elif src_len is not None:
                 items = []
                 for i in range(src_len):
                     items.append(AstDef(node.target, makeSubscript(source, i)))
                     items.append(node.expr)
-                return self.visit(makeVector(items))
+                return (yield makeVector(items))
 
         raise RuntimeError("cannot unroll the for-loop [line {}]".format(getattr(node, 'lineno', '?')))
 
     def visit_subscript(self, node: AstSubscript):
-        base = self.visit(node.base)
-        index = self.visit(node.index)
+        base = yield node.base
+        index = yield node.index
         if is_vector(base) and is_integer(index):
             return base[index.value]
+        elif base is node.base and index is node.index:
+            return node
         else:
             return node.clone(base=base, index=index)
 
@@ -338,24 +453,24 @@ class Simplifier(TransformVisitor):
     def visit_unary(self, node:AstUnary):
         op = node.op
         if op == '+':
-            return self.visit(node.item)
+            return (yield node.item)
 
         if op == 'not':
-            item = node.item._visit_expr(self)
+            item = yield node.item
             if isinstance(item, AstCompare) and item.second_right is None:
-                return self.visit(_cl(AstCompare(item.left, item.neg_op, item.right), node))
+                return (yield _cl(AstCompare(item.left, item.neg_op, item.right), node))
 
             if isinstance(item, AstBinary) and item.op in ('and', 'or'):
-                return self.visit(_cl(AstBinary(AstUnary('not', item.left), 'and' if item.op == 'or' else 'or',
+                return (yield _cl(AstBinary(AstUnary('not', item.left), 'and' if item.op == 'or' else 'or',
                                                 AstUnary('not', item.right)), node))
 
             if is_boolean(item):
                 return _cl(AstValue(not item.value), node)
 
         if isinstance(node.item, AstUnary) and op == node.item.op:
-            return self.visit(node.item.item)
+            return (yield node.item.item)
 
-        item = self.visit(node.item)
+        item = yield node.item
         if is_number(item):
             if op == '-':
                 return _cl(AstValue(-item.value), node)
@@ -366,7 +481,7 @@ class Simplifier(TransformVisitor):
             return node.clone(item=item)
 
     def visit_vector(self, node:AstVector):
-        items = [self.visit(item) for item in node.items]
+        items = yield node.items
         if len(items) > 0 and all([isinstance(item, AstSample) and item.size is None for item in items]) and \
                 all([item.dist == items[0].dist for item in items]):
             result = _cl(AstSample(items[0].dist, size=AstValue(len(items))), node)
@@ -374,4 +489,7 @@ class Simplifier(TransformVisitor):
             if original_name is not None:
                 result.original_name = original_name
             return result
-        return makeVector(items)
+        result = makeVector(items)
+        if type(result) is type(node) and all([a is b for a, b in zip(items, node.items)]):
+            return node
+        return result
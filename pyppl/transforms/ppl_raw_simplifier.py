@@ -9,16 +9,25 @@
 from ast import copy_location as _cl
 from ..ppl_ast import *
 from ..ppl_ast_annotators import get_info
+from ..ppl_data import DataFile, make_data_symbol
 from ..ppl_namespaces import namespace_from_module
 
 
 class RawSimplifier(ScopedVisitor):
+    """
+    The visit-methods are generators (see `AstNode.visit`), so that deeply nested ASTs do not run into the recursion
+    limit.
+    """
 
-    def __init__(self, symbols:dict):
+    __idempotent__ = True
+
+    def __init__(self, symbols:dict, data:Optional[dict]=None):
         super().__init__()
         self.imports = set()
+        self.data = data if data is not None else {}
         for key in symbols:
-            self.define(key, AstSymbol(symbols[key], predef=True))
+            value = symbols[key]
+            self.define(key, value if isinstance(value, AstNode) else AstSymbol(value, predef=True))
 
     def split_expr(self, node:AstNode):
         if node is None:
@@ -37,11 +46,11 @@ class RawSimplifier(ScopedVisitor):
             return [], node
 
     def _visit_expr(self, node:AstNode):
-        return self.split_expr(self.visit(node))
+        return self.split_expr((yield node))
 
 
     def visit_attribute(self, node:AstAttribute):
-        base = self.visit(node.base)
+        base = yield node.base
         if isinstance(base, AstNamespace):
             if node.attr in base.bindings:
                 return base.bindings[node.attr]
@@ -53,8 +62,8 @@ class RawSimplifier(ScopedVisitor):
             return node.clone(base=base)
 
     def visit_binary(self, node:AstBinary):
-        l_prefix, left = self._visit_expr(node.left)
-        r_prefix, right = self._visit_expr(node.right)
+        l_prefix, left = yield from self._visit_expr(node.left)
+        r_prefix, right = yield from self._visit_expr(node.right)
         prefix = l_prefix + r_prefix
 
         # Special case: make a long vector `[1, 2] * 3`
@@ -68,45 +77,65 @@ class RawSimplifier(ScopedVisitor):
             return _cl(makeBody(prefix), node)
 
     def visit_body(self, node:AstBody):
-        items = [self.visit(item) for item in node.items]
+        items = []
+        for item in node.items:
+            items.append((yield item))
 
         i = len(items)-1
         while i >= 0:
             item = items[i]
             if isinstance(item, AstIf):
                 if has_return(item.if_node) and not has_return(item.else_node):
-                    items[i] = self.visit(AstIf(item.test, item.if_node, makeBody(item.else_node, items[i+1:])))
+                    items[i] = yield AstIf(item.test, item.if_node, makeBody(item.else_node, items[i+1:]))
                     items = items[:i+1]
                 if has_return(item.else_node) and not has_return(item.if_node):
-                    items[i] = self.visit(AstIf(item.test, makeBody(item.if_node, items[i+1:]).item.else_node))
+                    items[i] = yield AstIf(item.test, makeBody(item.if_node, items[i+1:]).item.else_node)
                     items = items[:i+1]
             i -= 1
 
-        return _cl(makeBody(items), node)
+        result = makeBody(items)
+        if isinstance(result, AstBody) and len(result.items) == len(node.items) and \
+                all([a is b for a, b in zip(result.items, node.items)]):
+            return node
+        return _cl(result, node)
 
     def visit_call(self, node: AstCall):
+        if node.function_name == 'load_data' and self.resolve('load_data') is None and \
+                1 <= node.arg_count <= 2 and not node.has_keyword_args and all([is_string(arg) for arg in node.args]):
+            return self.visit_call_load_data(node)
         if node.arg_count > 0:
-            function = self.visit(node.function)
+            function = yield node.function
             prefix = []
             args = []
             for arg in node.args:
-                p, a = self._visit_expr(arg)
+                p, a = self.split_expr((yield arg))
                 prefix += p
                 args.append(a)
+            if len(prefix) == 0 and function is node.function and all([a is b for a, b in zip(args, node.args)]):
+                return node
             return makeBody(prefix, node.clone(function=function, args=args))
         else:
-            function = self.visit(node.function)
+            function = yield node.function
             if function is node.function:
                 return node
             else:
                 return node.clone(function=function)
 
+    def visit_call_load_data(self, node: AstCall):
+        # The data is bound to the model as external data, under the name of the file
+        filename = node.args[0].value
+        name = node.args[1].value if node.arg_count > 1 else None
+        external_name = filename if name is None else "{}:{}".format(filename, name)
+        if external_name not in self.data:
+            self.data[external_name] = DataFile(filename, name)
+        return _cl(make_data_symbol(external_name, self.data[external_name]), node)
+
     def visit_compare(self, node: AstCompare):
-        l_prefix, left = self._visit_expr(node.left)
-        r_prefix, right = self._visit_expr(node.right)
+        l_prefix, left = yield from self._visit_expr(node.left)
+        r_prefix, right = yield from self._visit_expr(node.right)
         prefix = l_prefix + r_prefix
         if node.second_right is not None:
-            s_prefix, sec_right = self._visit_expr(node.second_right)
+            s_prefix, sec_right = yield from self._visit_expr(node.second_right)
             prefix += s_prefix
         else:
             sec_right = None
@@ -120,9 +149,12 @@ class RawSimplifier(ScopedVisitor):
     def visit_def(self, node: AstDef):
         if getattr(node.value, 'original_name', None) is None:
             node.value.original_name = node.name
-        value = self.visit(node.value)
+        value = yield node.value
         if isinstance(value, (AstValue, AstValueVector)):
             self.define(node.name, value)
+        elif self.resolve(node.name) is not None:
+            # The variable no longer holds the constant value
+            self.define(node.name, None)
         if value is node.value:
             return node
         else:
@@ -133,7 +165,7 @@ class RawSimplifier(ScopedVisitor):
             prefix = []
             result = {}
             for key in node.items:
-                p, i = self.visit(node.items[key])
+                p, i = yield node.items[key]
                 prefix += p
                 result[key] = i
             return _cl(makeBody(prefix, AstDict(result)), node)
@@ -141,8 +173,13 @@ class RawSimplifier(ScopedVisitor):
             return node
 
     def visit_for(self, node: AstFor):
-        prefix, source = self._visit_expr(node.source)
-        body = self.visit(node.body)
+        prefix, source = yield from self._visit_expr(node.source)
+        # The loop variable and the variables changed by the body do not hold any constant values inside the body
+        targets = node.target if type(node.target) is tuple else (node.target,)
+        for name in set.union(set(targets), get_info(node.body).changed_vars):
+            if name != '_' and self.resolve(name) is not None:
+                self.define(name, None)
+        body = yield node.body
         target = node.target if node.target in get_info(body).free_vars else '_'
         if isinstance(source, AstCall):
             src_var = generate_temp_var()
@@ -155,16 +192,22 @@ class RawSimplifier(ScopedVisitor):
 
     def visit_function(self, node: AstFunction):
         with self.create_scope():
-            body = self.visit(node.body)
+            body = yield node.body
         if body is node.body:
             return node
         else:
             return node.clone(body=body)
 
     def visit_if(self, node: AstIf):
-        prefix, test = self._visit_expr(node.test)
-        if_node = self.visit(node.if_node)
-        else_node = self.visit(node.else_node)
+        prefix, test = yield from self._visit_expr(node.test)
+        # The constants assigned in either branch do not hold in the other branch, nor after the `if`
+        with self.create_scope():
+            if_node = yield node.if_node
+        with self.create_scope():
+            else_node = yield node.else_node
+        for name in set.union(get_info(if_node).changed_vars, get_info(else_node).changed_vars):
+            if self.resolve(name) is not None:
+                self.define(name, None)
 
         if isinstance(if_node, AstReturn):
             if isinstance(else_node, AstReturn):
@@ -216,16 +259,16 @@ class RawSimplifier(ScopedVisitor):
         return node # AstBody([]) # _cl(AstImport(module_name), node)
 
     def visit_let(self, node: AstLet):
-        prefix, source = self._visit_expr(node.source)
-        body = self.visit(node.body)
+        prefix, source = self.split_expr((yield node.source))
+        body = yield node.body
         if source is node.source and body is node.body:
             return node
         else:
             return _cl(makeBody(prefix, AstLet(node.target, source, body, original_target=node.original_target)), node)
 
     def visit_list_for(self, node: AstListFor):
-        prefix, source = self._visit_expr(node.source)
-        expr = self.visit(node.expr)
+        prefix, source = yield from self._visit_expr(node.source)
+        expr = yield node.expr
         target = node.target if node.target in get_info(expr).free_vars else '_'
         if target is node.target and source is node.source and expr is node.expr:
             return node
@@ -233,8 +276,8 @@ class RawSimplifier(ScopedVisitor):
             return makeBody(prefix, node.clone(target=target, source=source, expr=expr))
 
     def visit_observe(self, node: AstObserve):
-        d_prefix, dist = self._visit_expr(node.dist)
-        v_prefix, value = self._visit_expr(node.value)
+        d_prefix, dist = yield from self._visit_expr(node.dist)
+        v_prefix, value = yield from self._visit_expr(node.value)
         # keep it from being over-zealous
         if len(d_prefix) == 1 and isinstance(d_prefix[0], AstDef) and isinstance(dist, AstSymbol) and \
                         d_prefix[0].name == dist.name and isinstance(d_prefix[0].value, AstCall):
@@ -246,20 +289,20 @@ class RawSimplifier(ScopedVisitor):
             return makeBody(prefix, node.clone(dist=dist, value=value))
 
     def visit_return(self, node: AstReturn):
-        prefix, value = self._visit_expr(node.value)
+        prefix, value = yield from self._visit_expr(node.value)
         if value is node.value:
             return node
         else:
             return _cl(makeBody(prefix, AstReturn(value)), node)
 
     def visit_sample(self, node: AstSample):
-        prefix, dist = self._visit_expr(node.dist)
+        prefix, dist = yield from self._visit_expr(node.dist)
         # keep it from being over zealous
         if len(prefix) == 1 and isinstance(prefix[0], AstDef) and isinstance(dist, AstSymbol) and \
                         prefix[0].name == dist.name and isinstance(prefix[0].value, AstCall):
             prefix, dist = [], prefix[0].value
         if node.size is not None:
-            s_prefix, size = self._visit_expr(node.size)
+            s_prefix, size = yield from self._visit_expr(node.size)
             prefix += s_prefix
         else:
             size = None
@@ -269,9 +312,9 @@ class RawSimplifier(ScopedVisitor):
             return makeBody(prefix, node.clone(dist=dist, size=size))
 
     def visit_slice(self, node: AstSlice):
-        prefix, base = self._visit_expr(node.base)
-        a_prefix, a = self._visit_expr(node.start)
-        b_prefix, b = self._visit_expr(node.stop)
+        prefix, base = yield from self._visit_expr(node.base)
+        a_prefix, a = yield from self._visit_expr(node.start)
+        b_prefix, b = yield from self._visit_expr(node.stop)
         prefix += a_prefix
         prefix += b_prefix
         if base is node.base and a is node.start and b is node.stop:
@@ -280,8 +323,8 @@ class RawSimplifier(ScopedVisitor):
             return _cl(makeBody(prefix, AstSlice(base, a, b)), node)
 
     def visit_subscript(self, node: AstSubscript):
-        base_prefix, base = self._visit_expr(node.base)
-        index_prefix, index = self._visit_expr(node.index)
+        base_prefix, base = yield from self._visit_expr(node.base)
+        index_prefix, index = yield from self._visit_expr(node.index)
         if base is node.base and index is node.index:
             return node
         else:
@@ -298,8 +341,8 @@ class RawSimplifier(ScopedVisitor):
         # when applying an unary operator twice, it usually cancels, so we can get rid of it entirely
         if isinstance(node.item, AstUnary) and node.op == node.item.op:
             if node.op in ('not', '+', '-'):
-                return self.visit(node.item.item)
-        prefix, item = self._visit_expr(node.item)
+                return (yield node.item.item)
+        prefix, item = yield from self._visit_expr(node.item)
         if item is node.item:
             return node
         else:
@@ -317,10 +360,13 @@ class RawSimplifier(ScopedVisitor):
         prefix = []
         items = []
         for item in node.items:
-            p, i = self._visit_expr(item)
+            p, i = yield from self._visit_expr(item)
             prefix += p
             items.append(i)
-        return _cl(makeBody(prefix, makeVector(items)), node)
+        result = makeVector(items)
+        if len(prefix) == 0 and type(result) is type(node) and all([a is b for a, b in zip(items, node.items)]):
+            return node
+        return _cl(makeBody(prefix, result), node)
 
     def visit_while(self, node: AstWhile):
         return self.visit_node(node)
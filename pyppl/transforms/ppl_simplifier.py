@@ -105,7 +105,7 @@ class Simplifier(BranchScopeVisitor):
             return _cl(AstValue(left.value + right.value), node)
 
         elif op == '+' and isinstance(left, AstValueVector) and isinstance(right, AstValueVector):
-            return _cl(AstValueVector(left.items + right.items), node)
+            return _cl(AstValueVector(left.value + right.value), node)
 
         elif op == '*' and (is_string(left) and is_integer(right)) or (is_integer(left) and is_string(right)):
             return _cl(AstValue(left.value * right.value), node)
@@ -589,7 +589,7 @@ class Simplifier(BranchScopeVisitor):
         if dist is node.dist and value is node.value:
             return node
         else:
-            return _cl(AstObserve(dist, value), node)
+            return _cl(AstObserve(dist, value, node.size), node)
 
     def visit_return(self, node:AstReturn):
         value = self.visit(node.value)
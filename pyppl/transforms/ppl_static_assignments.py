@@ -7,6 +7,8 @@
 # 03. Jul 2018, Tobias Kohn
 #
 from ..ppl_ast import *
+from ..ppl_ast_annotators import get_plate_observe, can_keep_loop, is_deterministic_loop, get_loop_vars, \
+    DEFAULT_UNROLL_THRESHOLD
 from ..aux.ppl_transform_visitor import TransformVisitor
 from ast import copy_location as _cl
 
@@ -37,20 +39,21 @@ class SymbolScope(object):
         self.is_loop = is_loop
 
     def get_current_symbol(self, name: str):
-        if name in self.bindings:
-            return self.bindings[name]
-        elif self.prev is not None:
-            return self.prev.get_current_symbol(name)
-        else:
-            return name
+        # The scopes are searched in a loop, as they might be deeply nested
+        scope = self
+        while scope is not None:
+            if name in scope.bindings:
+                return scope.bindings[name]
+            scope = scope.prev
+        return name
 
     def has_current_symbol(self, name: str):
-        if name in self.bindings:
-            return True
-        elif self.prev is not None:
-            return self.prev.has_current_symbol(name)
-        else:
-            return False
+        scope = self
+        while scope is not None:
+            if name in scope.bindings:
+                return True
+            scope = scope.prev
+        return False
 
     def set_current_symbol(self, name: str, instance_name: str):
         self.bindings[name] = instance_name
@@ -63,14 +66,127 @@ class SymbolScope(object):
             return False
 
 
+def _scan(node: AstNode):
+    """
+    Returns a tuple `(uses, has_if)` for the given node: the names of all symbols used, and whether the node contains
+    an `if`. The AST is walked on an explicit stack, as it might be deeply nested.
+    """
+    uses = set()
+    has_if = False
+    stack = [node]
+    while len(stack) > 0:
+        item = stack.pop()
+        if isinstance(item, AstSymbol):
+            uses.add(item.name)
+        elif item is not None:
+            has_if = has_if or isinstance(item, AstIf)
+            stack += item.get_ast_children()
+    return uses, has_if
+
+
+def _get_live_in(node: AstNode, live_out: set) -> set:
+    """
+    Returns the variables live before the statement, given the variables live after it.
+    """
+    if isinstance(node, AstBody):
+        live = live_out
+        for item in reversed(node.items):
+            live = _get_live_in(item, live)
+        return live
+    elif isinstance(node, AstIf):
+        return set.union(_scan(node.test)[0], _get_live_in(node.if_node, live_out),
+                         _get_live_in(node.else_node, live_out))
+    elif isinstance(node, AstDef):
+        return set.union(live_out - {node.name}, _scan(node.value)[0])
+    else:
+        return set.union(live_out, _scan(node)[0])
+
+
+class LiveNames(object):
+    """
+    Holds the live variables after each statement of a body, which contains an `if`, as determined by a backward
+    pass over the body, starting with the variables live after the body (`live_after`). Inside a loop, all names
+    used by the loop are live after the body, as it is executed again.
+
+    Only definitions at the level of the body and inside the branches of an `if` are taken into account, so that a
+    variable might be considered live although it is not (e.g., if it is redefined inside a loop), but never the
+    other way round.
+    """
+
+    def __init__(self, items: list, live_after: set):
+        self.items = items
+        self.index = -1
+        self.current = None
+        self.live_after = live_after
+        self.live_out = None
+
+    def _compute_live_out(self):
+        # Most bodies do not contain any `if`, so that the live variables are only computed when actually needed
+        self.live_out = {}
+        live = set(self.live_after)
+        items = self.items
+        for i in reversed(range(len(items))):
+            item = items[i]
+            if isinstance(item, AstIf):
+                self.live_out[i] = live
+                live = _get_live_in(item, live)
+                continue
+            uses, has_if = _scan(item)
+            if has_if:
+                self.live_out[i] = live
+                live = _get_live_in(item, live)
+            else:
+                if isinstance(item, AstDef):
+                    live.discard(item.name)
+                live.update(uses)
+
+    def next_item(self):
+        self.index += 1
+        self.current = self.items[self.index]
+
+    def get_live_after(self, node: AstNode) -> Optional[set]:
+        """
+        Returns the variables live after the given node, which must be part of the current statement. For a node
+        nested inside the statement, all names used by the statement are included. If the statement does not contain
+        an `if`, the result is `None`.
+        """
+        if self.live_out is None:
+            self._compute_live_out()
+        live = self.live_out.get(self.index, None)
+        if live is None or node is self.current:
+            return live
+        else:
+            return set.union(live, _scan(self.current)[0])
+
+
 class StaticAssignments(TransformVisitor):
+    """
+    The visit-methods are generators, which yield the nodes to visit (see `AstNode.visit`). The same holds for the
+    helpers `visit_and_split`, `visit_in_scope`, `_visit_call` and `_visit_sample`, which are called through
+    `yield from`.
 
-    def __init__(self):
+    The SSA form is pruned: at the end of an `if`, a new instance (phi-definition) is only created for the variables
+    assigned in either branch, which are still live after the `if` (see `LiveNames`).
+
+    A deterministic loop, which is not unrolled here, assigns one and the same instance of each of its variables
+    (see `get_loop_vars`) in all its iterations, so that the values are carried from one iteration to the next and
+    out of the loop. The instances are held in `loop_names`.
+    """
+
+    def __init__(self, unroll_threshold:Optional[int]=None):
         super().__init__()
         self.symbols = {}
         self.symbol_scope = SymbolScope(None)
+        self.live_names = None
+        self.body_depth = 0
+        self.loop_names = {}
+        self.unroll_threshold = unroll_threshold if unroll_threshold is not None else DEFAULT_UNROLL_THRESHOLD
 
     def new_symbol_instance(self, name: str):
+        if name in self.loop_names:
+            result = self.loop_names[name]
+            self.symbol_scope.set_current_symbol(name, result)
+            return result
         if name not in self.symbols:
             self.symbols[name] = Symbol(name)
         result = self.symbols[name].get_new_instance()
@@ -110,23 +226,63 @@ class StaticAssignments(TransformVisitor):
             return None, node
 
     def visit_and_split(self, node: AstNode):
-        return self.split_body(self.visit(node))
-
-    def visit_in_scope(self, node: AstNode, is_loop:bool=False):
-        items = []
-        self.begin_scope(items, is_loop)
-        if isinstance(node, AstBody):
-            for item in node.items:
-                items.append(self.visit(item))
+        return self.split_body((yield node))
+
+    def get_live_after(self, node: AstNode) -> Optional[set]:
+        """
+        Returns the variables live after the given node, or `None` if all variables need to be considered live.
+        """
+        if self.live_names is not None:
+            return self.live_names.get_live_after(node)
+        elif self.body_depth == 0:
+            # Nothing is live after the program
+            return set()
         else:
-            items.append(self.visit(node))
+            return None
+
+    def replace_current(self, node: AstNode, new_node: AstNode):
+        """
+        Called if the node is replaced by a new node, which is then visited instead, so that the live variables of
+        the node also hold for the new node.
+        """
+        if self.live_names is not None and self.live_names.current is node:
+            self.live_names.current = new_node
+
+    def get_live_in_loop(self, node: AstNode) -> Optional[set]:
+        # The body of the loop is executed again, so that all variables used by the loop are live after the body
+        live_after = self.get_live_after(node)
+        if live_after is not None:
+            return set.union(live_after, _scan(node)[0])
+        return None
+
+    def visit_items(self, items: list, live_after: Optional[set]):
+        live_names = self.live_names
+        self.live_names = LiveNames(items, live_after) if live_after is not None else None
+        self.body_depth += 1
+        try:
+            result = []
+            for item in items:
+                if self.live_names is not None:
+                    self.live_names.next_item()
+                result.append((yield item))
+        finally:
+            self.live_names = live_names
+            self.body_depth -= 1
+        return result
+
+    def visit_in_scope(self, node: AstNode, live_after: Optional[set], is_loop:bool=False, targets=None):
+        self.begin_scope([], is_loop)
+        if targets is not None:
+            for target in (targets if type(targets) is tuple else [targets]):
+                self.symbol_scope.set_current_symbol(target, target)
+        items = yield from self.visit_items(node.items if isinstance(node, AstBody) else [node], live_after)
         result = _cl(makeBody(items), node)
         symbols = self.end_scope()
         return symbols, result
 
 
     def visit_attribute(self, node:AstAttribute):
-        prefix, base = self.visit_and_split(node.base)
+        prefix, base = yield from self.visit_and_split(node.base)
         if prefix is not None:
             return makeBody(prefix, node.clone(base=base))
         if base is node.base:
@@ -135,8 +291,8 @@ class StaticAssignments(TransformVisitor):
             return node.clone(base=base)
 
     def visit_binary(self, node:AstBinary):
-        prefix_l, left = self.visit_and_split(node.left)
-        prefix_r, right = self.visit_and_split(node.right)
+        prefix_l, left = yield from self.visit_and_split(node.left)
+        prefix_r, right = yield from self.visit_and_split(node.right)
         if prefix_l is not None and prefix_r is not None:
             prefix = prefix_l + prefix_r
             return makeBody(prefix, node.clone(left=left, right=right))
@@ -154,7 +310,7 @@ class StaticAssignments(TransformVisitor):
         prefix = []
         args = []
         for item in node.args:
-            p, a = self.visit_and_split(item)
+            p, a = yield from self.visit_and_split(item)
             if p is not None:
                 prefix += p
             args.append(a)
@@ -166,12 +322,19 @@ class StaticAssignments(TransformVisitor):
 
     def visit_call(self, node: AstCall):
         tmp = generate_temp_var()
-        result = AstDef(tmp, self._visit_call(node))
+        result = AstDef(tmp, (yield from self._visit_call(node)))
         if self.append_to_body(result):
             return AstSymbol(tmp)
         else:
             return makeBody(result, AstSymbol(tmp))
 
+    def visit_body(self, node: AstBody):
+        items = yield from self.visit_items(node.items, self.get_live_after(node))
+        if all([a is b for a, b in zip(items, node.items)]):
+            return node
+        else:
+            return _cl(makeBody(items), node)
+
     def visit_call_range(self, node: AstCall):
         if node.arg_count == 1 and is_integer(node.args[0]):
             return makeVector(list(range(node.args[0].value)))
@@ -179,10 +342,10 @@ class StaticAssignments(TransformVisitor):
             return self.visit_call(node)
 
     def visit_compare(self, node: AstCompare):
-        prefix_l, left = self.visit_and_split(node.left)
-        prefix_r, right = self.visit_and_split(node.right)
+        prefix_l, left = yield from self.visit_and_split(node.left)
+        prefix_r, right = yield from self.visit_and_split(node.right)
         if node.second_right is not None:
-            prefix_s, second_right = self.visit_and_split(node.second_right)
+            prefix_s, second_right = yield from self.visit_and_split(node.second_right)
         else:
             prefix_s, second_right = None, None
 
@@ -200,24 +363,24 @@ class StaticAssignments(TransformVisitor):
     def visit_def(self, node: AstDef):
         if isinstance(node.value, AstObserve):
             # We can never assign an observe to something!
-            result = [self.visit(node.value),
-                      self.visit(node.clone(value=AstValue(None)))]
+            result = [(yield node.value),
+                      (yield node.clone(value=AstValue(None)))]
             return makeBody(result)
 
         elif isinstance(node.value, AstSample):
             # We need to handle this as a special case in order to avoid an infinite loop
-            value = self._visit_sample(node.value)
+            value = yield from self._visit_sample(node.value)
             name = self.new_symbol_instance(node.name)
             return node.clone(name=name, value=value)
 
         elif isinstance(node.value, AstCall):
-            result = self._visit_call(node.value)
+            result = yield from self._visit_call(node.value)
             name = self.new_symbol_instance(node.name)
             return node.clone(name=name, value=result)
 
-        prefix, value = self.visit_and_split(node.value)
+        prefix, value = yield from self.visit_and_split(node.value)
         if prefix is not None:
-            return makeBody(prefix, self.visit(node.clone(value=value)))
+            return makeBody(prefix, (yield node.clone(value=value)))
 
         elif isinstance(value, AstFunction):
             return AstBody([])
@@ -233,7 +396,7 @@ class StaticAssignments(TransformVisitor):
         items = {}
         for key in node.items:
             item = node.items[key]
-            p, i = self.visit_and_split(item)
+            p, i = yield from self.visit_and_split(item)
             if p is not None:
                 prefix += p
             items[key] = i
@@ -243,39 +406,64 @@ class StaticAssignments(TransformVisitor):
             return AstDict(items)
 
     def visit_for(self, node: AstFor):
-        prefix, source = self.visit_and_split(node.source)
+        prefix, source = yield from self.visit_and_split(node.source)
         if prefix is not None:
-            return self.visit(makeBody(prefix, node.clone(source=source)))
+            return (yield makeBody(prefix, node.clone(source=source)))
 
-        if is_vector(source):
+        # Plates are kept as loops, so that the simplifier can turn them into a single observe-statement; the same
+        # holds for long loops, which do not contribute to the graph (see `can_keep_loop`)
+        if is_vector(source) and get_plate_observe(node.target, node.body) is None and \
+                not can_keep_loop(node, len(source), self.unroll_threshold):
             result = []
             for item in source:
                 result.append(AstLet(node.target, item, node.body))
-            return self.visit(makeBody(result))
+            result = makeBody(result)
+            self.replace_current(node, result)
+            return (yield result)
 
-        _, body = self.visit_in_scope(node.body, is_loop=True)
+        prefix = []
+        loop_names = self.loop_names
+        if is_deterministic_loop(node):
+            self.loop_names = dict(loop_names)
+            for name in sorted(get_loop_vars(node)):
+                if name in loop_names:
+                    continue
+                current = self.access_symbol(name) if self.has_symbol(name) else None
+                instance = self.new_symbol_instance(name)
+                self.loop_names[name] = instance
+                if current is not None:
+                    prefix.append(AstDef(instance, AstSymbol(current)))
+        try:
+            _, body = yield from self.visit_in_scope(node.body, self.get_live_in_loop(node), is_loop=True,
+                                                     targets=node.target)
+        finally:
+            self.loop_names = loop_names
         if source is node.source and body is node.body:
-            return node
+            result = node
         else:
-            return node.clone(source=source, body=body)
+            result = node.clone(source=source, body=body)
+        return makeBody(prefix, result) if len(prefix) > 0 else result
 
     def visit_if(self, node: AstIf):
 
         def phi(key, cond, left, right):
             return AstDef(key, AstIf(cond, AstSymbol(left), AstSymbol(right)))
 
-        prefix, test = self.visit_and_split(node.test)
+        prefix, test = yield from self.visit_and_split(node.test)
         if prefix is not None:
-            return makeBody(prefix, self.visit(node.clone(test=test)))
+            result = node.clone(test=test)
+            self.replace_current(node, result)
+            return makeBody(prefix, (yield result))
 
         if isinstance(test, AstValue):
             if test.value is True:
-                return self.visit(node.if_node)
+                return (yield node.if_node)
             elif test.value is False or test.value is None:
-                return self.visit(node.else_node)
+                return (yield node.else_node)
 
-        if_symbols, if_node = self.visit_in_scope(node.if_node)
-        else_symbols, else_node = self.visit_in_scope(node.else_node)
+        live_after = self.get_live_after(node)
+        if_symbols, if_node = yield from self.visit_in_scope(node.if_node, live_after)
+        else_symbols, else_node = yield from self.visit_in_scope(node.else_node, live_after)
         keys = set.union(set(if_symbols.keys()), set(else_symbols.keys()))
         if len(keys) == 0:
             if test is node.test and if_node is node.if_node and else_node is node.else_node:
@@ -290,14 +478,20 @@ class StaticAssignments(TransformVisitor):
                 test = AstSymbol(tmp)
             result.append(node.clone(test=test, if_node=if_node, else_node=else_node))
             for key in keys:
-                if key in if_symbols and key in else_symbols:
+                if live_after is not None and key not in live_after:
+                    # The variable is dead after the `if`
+                    pass
+                elif key in if_symbols and key in else_symbols:
                     result.append(phi(self.new_symbol_instance(key), test, if_symbols[key], else_symbols[key]))
                 elif not self.has_symbol(key):
                     pass
                 elif key in if_symbols:
-                    result.append(phi(self.new_symbol_instance(key), test, if_symbols[key], self.access_symbol(key)))
+                    # The instance from before the `if` must be read before the new instance is created
+                    current = self.access_symbol(key)
+                    result.append(phi(self.new_symbol_instance(key), test, if_symbols[key], current))
                 elif key in else_symbols:
-                    result.append(phi(self.new_symbol_instance(key), test, self.access_symbol(key), else_symbols[key]))
+                    current = self.access_symbol(key)
+                    result.append(phi(self.new_symbol_instance(key), test, current, else_symbols[key]))
             return makeBody(result)
 
     def visit_let(self, node: AstLet):
@@ -305,26 +499,27 @@ class StaticAssignments(TransformVisitor):
             result = makeBody(node.source, node.body)
         else:
             result = makeBody(AstDef(node.target, node.source), node.body)
-        result = self.visit(result)
+        self.replace_current(node, result)
+        result = yield result
         return result
 
     def visit_list_for(self, node: AstListFor):
-        prefix, source = self.visit_and_split(node.source)
+        prefix, source = yield from self.visit_and_split(node.source)
         if prefix is not None:
-            return makeBody(prefix, self.visit(node.clone(source=source)))
+            return makeBody(prefix, (yield node.clone(source=source)))
 
-        if is_vector(source):
+        if is_vector(source) and not can_keep_loop(node, len(source), self.unroll_threshold):
             result = []
             for item in source:
                 result.append(AstLet(node.target, item, node.expr))
-            return self.visit(makeVector(result))
+            return (yield makeVector(result))
 
         if isinstance(node.expr, AstSample):
-            expr = self._visit_sample(node.expr)
+            expr = yield from self._visit_sample(node.expr)
         elif isinstance(node.expr, AstCall):
-            expr = self._visit_call(node.expr)
+            expr = yield from self._visit_call(node.expr)
         else:
-            expr = self.visit(node.expr)
+            expr = yield node.expr
 
         if source is node.source and expr is node.expr:
             return node
@@ -332,10 +527,10 @@ class StaticAssignments(TransformVisitor):
             return node.clone(source=source, expr=expr)
 
     def visit_observe(self, node: AstObserve):
-        prefix, dist = self.visit_and_split(node.dist)
+        prefix, dist = yield from self.visit_and_split(node.dist)
         if prefix is not None:
-            return makeBody(prefix, self.visit(node.clone(dist=dist)))
-        prefix, value = self.visit_and_split(node.value)
+            return makeBody(prefix, (yield node.clone(dist=dist)))
+        prefix, value = yield from self.visit_and_split(node.value)
         if prefix is not None:
             return makeBody(prefix, node.clone(value=value))
         if dist is node.dist and value is node.value:
@@ -344,7 +539,7 @@ class StaticAssignments(TransformVisitor):
             return node.clone(dist=dist, value=value)
 
     def _visit_sample(self, node: AstSample):
-        prefix, dist = self.visit_and_split(node.dist)
+        prefix, dist = yield from self.visit_and_split(node.dist)
         if prefix is not None:
             return makeBody(prefix, node.clone(dist=dist))
         if dist is node.dist:
@@ -354,7 +549,7 @@ class StaticAssignments(TransformVisitor):
 
     def visit_sample(self, node: AstSample):
         tmp = generate_temp_var()
-        assign = AstDef(tmp, self._visit_sample(node))
+        assign = AstDef(tmp, (yield from self._visit_sample(node)))
         if self.append_to_body(assign):
             return AstSymbol(tmp)
         else:
@@ -368,7 +563,7 @@ class StaticAssignments(TransformVisitor):
             return node
 
     def visit_unary(self, node: AstUnary):
-        prefix, item = self.visit_and_split(node.item)
+        prefix, item = yield from self.visit_and_split(node.item)
         if prefix is not None:
             return makeBody(prefix, node.clone(item=item))
         if item is node.item:
@@ -380,7 +575,7 @@ class StaticAssignments(TransformVisitor):
         prefix = []
         items = []
         for item in node.items:
-            p, i = self.visit_and_split(item)
+            p, i = yield from self.visit_and_split(item)
             if p is not None:
                 prefix += p
             items.append(i)
@@ -390,11 +585,11 @@ class StaticAssignments(TransformVisitor):
             return makeVector(items)
 
     def visit_while(self, node: AstWhile):
-        prefix, test = self.visit_and_split(node.test)
+        prefix, test = yield from self.visit_and_split(node.test)
         if prefix is not None:
-            return makeBody(prefix, self.visit(node.clone(test=test)))
+            return makeBody(prefix, (yield node.clone(test=test)))
 
-        _, body = self.visit_in_scope(node.body, is_loop=True)
+        _, body = yield from self.visit_in_scope(node.body, self.get_live_in_loop(node), is_loop=True)
         if test is node.test and body is node.body:
             return node
         else:
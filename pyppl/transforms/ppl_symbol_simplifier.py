@@ -11,6 +11,10 @@ from ..aux.ppl_transform_visitor import TransformVisitor
 
 
 class SymbolSimplifier(TransformVisitor):
+    """
+    Shortens the names of variables. `visit_def` and `visit_let` are generators (see `AstNode.visit`), as are the
+    default methods of `TransformVisitor`, so that long chains of definitions and let-expressions can be renamed.
+    """
 
     def __init__(self):
         super().__init__()
@@ -50,7 +54,7 @@ class SymbolSimplifier(TransformVisitor):
             return name
 
     def visit_def(self, node: AstDef):
-        value = self.visit(node.value)
+        value = yield node.value
         name = self.simplify_symbol(node.name)
         if name != node.name or value is not node.value:
             return node.clone(name=name, value=value)
@@ -58,9 +62,9 @@ class SymbolSimplifier(TransformVisitor):
             return node
 
     def visit_let(self, node: AstLet):
-        source = self.visit(node.source)
+        source = yield node.source
         name = self.simplify_symbol(node.target)
-        body = self.visit(node.body)
+        body = yield node.body
         if name == node.target and source is node.source and body is node.body:
             return node
         else:
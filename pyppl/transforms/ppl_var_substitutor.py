@@ -99,7 +99,7 @@ class VarSubstitutor(Visitor):
         if dist is node.dist and value is node.value:
             return node
         else:
-            return _cl(AstObserve(dist, value), node)
+            return _cl(AstObserve(dist, value, node.size), node)
 
     def visit_return(self, node: AstReturn):
         value = self.visit(node.value)
@@ -10,12 +10,30 @@ from ..ppl_ast import *
 from .ppl_types import *
 
 class TypeInferencer(Visitor):
+    """
+    Infers the type of an expression. Names are resolved through the `parent`, which is typically the transforming
+    visitor asking for the type.
+
+    The inferred types are cached in the nodes (see `AstNode`), together with the bindings of all names the type
+    depends on, i.e. the values returned by `parent.resolve`. A cached type is only used as long as all these names
+    still resolve to the same values, so that asking for the type of the same subtree again (possibly in another
+    context) takes time proportional to the number of free names, rather than to the size of the subtree. Since
+    transforms create new nodes instead of modifying existing ones, new nodes never carry a stale type.
+    """
 
     __visit_children_first__ = True
 
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
+        self._dependencies = None
+        self._is_cacheable = True
+
+    def _lookup(self, name:str):
+        result = self.parent.resolve(name) if self.parent is not None else None
+        if self._dependencies is not None:
+            self._dependencies[name] = result
+        return result
 
     def define(self, name:str, value):
         if name is None or name == '_':
@@ -24,16 +42,42 @@ class TypeInferencer(Visitor):
             result = self.parent.resolve(name)
             if hasattr(result, 'set_type'):
                 result.set_type(value)
+                # The side effect on the symbol must not be skipped by using a cached type
+                self._is_cacheable = False
 
     def resolve(self, name:str):
-        if self.parent is not None:
-            result = self.parent.resolve(name)
-            if isinstance(result, Type):
-                return result
-            elif isinstance(result, AstNode):
-                return self.visit(result)
+        result = self._lookup(name)
+        if isinstance(result, Type):
+            return result
+        elif isinstance(result, AstNode):
+            return self.visit(result)
         return None
 
+    def visit(self, ast):
+        if not isinstance(ast, AstNode):
+            return super().visit(ast)
+        try:
+            result, dependencies = object.__getattribute__(ast, '_type_cache')
+        except AttributeError:
+            pass
+        else:
+            if all([self._lookup(name) is dependencies[name] for name in dependencies]):
+                return result
+
+        outer_dependencies, outer_cacheable = self._dependencies, self._is_cacheable
+        self._dependencies = dependencies = {}
+        self._is_cacheable = True
+        try:
+            result = ast.visit(self)
+            if self._is_cacheable:
+                ast._type_cache = (result, dependencies)
+        finally:
+            is_cacheable = self._is_cacheable
+            self._dependencies, self._is_cacheable = outer_dependencies, outer_cacheable and is_cacheable
+        if outer_dependencies is not None:
+            outer_dependencies.update(dependencies)
+        return result
+
     def get_value_of(self, node: AstNode):
         if isinstance(node, AstValue):
             return node.value
@@ -173,6 +217,8 @@ class TypeInferencer(Visitor):
         if isinstance(source, SequenceType):
             self.define(node.target, source.item)
             result = self.visit(node.expr)
+            if node.test is not None:
+                return List[result]
             return List[result][source.size]
         else:
             return AnyType
@@ -205,6 +251,8 @@ class TypeInferencer(Visitor):
 
     def visit_symbol(self, node: AstSymbol):
         result = self.resolve(node.name)
+        if result is None:
+            result = node.get_type()
         return result if result is not None else AnyType
 
     def visit_unary(self, node: AstUnary):
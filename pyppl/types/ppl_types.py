@@ -6,6 +6,7 @@
 # 07. Feb 2018, Tobias Kohn
 # 02. Jul 2018, Tobias Kohn
 #
+from array import array as _array
 from typing import Optional
 
 class Type(object):
@@ -391,7 +392,10 @@ def from_python(value):
         return _types[value]
 
     t = type(value)
-    if t in [list, tuple]:
+    if t is _array:
+        return List[Float if value.typecode == 'd' else Integer][len(value)]
+
+    elif t in [list, tuple]:
         item = union(*[from_python(item) for item in value])
         if t is list:
             return List[item][len(value)]
@@ -9,7 +9,7 @@ except:
 setup(
     name="PyPPLCompiler",
     version="0.",
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
     url="https://github.com/Tobias-Kohn/PyPPLCompiler",
     license="GPL-3.0",
     install_requires=install_reqs,